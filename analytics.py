@@ -0,0 +1,176 @@
+"""
+Listening stats computed from the Parquet archive written by archive.py
+
+Archived months are scanned column-wise with pyarrow; months that are not
+archived yet (at least the current one) are aggregated from song_plays and
+its partitions, so the results match the rollup-based stats of the web app.
+"""
+
+import os
+from sqlalchemy import text
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+# Directory of the archive, one `month=YYYY-MM` partition per month
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The listening history archive needs pyarrow - run: pip install pyarrow")
+
+def archived_months(archive_dir=ARCHIVE_DIR):
+    """Months (YYYY-MM) that have a partition in the archive"""
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(archive_dir)
+                  if name.startswith('month=') and os.listdir(os.path.join(archive_dir, name)))
+
+def archive_version(archive_dir=ARCHIVE_DIR):
+    """(month, modification time) of every archived month; archive.py writes
+    a month to a new directory, so this changes whenever the archive does"""
+    return tuple((month, os.stat(os.path.join(archive_dir, f'month={month}')).st_mtime_ns)
+                 for month in archived_months(archive_dir))
+
+def open_archive(archive_dir=ARCHIVE_DIR):
+    require_pyarrow()
+    return ds.dataset(archive_dir, format='parquet', partitioning='hive')
+
+def first_unarchived_day(months):
+    """First local date whose plays are not in the archive"""
+    if not months:
+        return '0000-00-00'
+    year, month = map(int, months[-1].split('-'))
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f'{year:04d}-{month:02d}-01'
+
+def _scan(dataset, columns, local_date=None, first_day=None):
+    """Read the given columns of the archived plays, pruning partitions by month"""
+    condition = None
+    if local_date:
+        condition = (ds.field('month') == local_date[:7]) & (ds.field('local_date') == local_date)
+    elif first_day:
+        condition = (ds.field('month') >= first_day[:7]) & (ds.field('local_date') >= first_day)
+    # Each file has its own dictionaries for the dictionary-encoded columns
+    return dataset.to_table(columns=columns, filter=condition).unify_dictionaries()
+
+def _counts(table, column):
+    """Number of rows per value of a column"""
+    counts = table.group_by(column).aggregate([([], 'count_all')])
+    return dict(zip(counts[column].to_pylist(), counts['count_all'].to_pylist()))
+
+def _add(target, counts):
+    for key, count in counts.items():
+        target[key] = target.get(key, 0) + count
+
+def _database_rows(session, sql, params, last_day=None):
+    """Rows of `sql` for the plays from `params['cutoff']` on, in the main
+    database and in the partitions of partitions.py; `sql` reads the plays
+    from {schema}.song_plays"""
+    # Imported here because archive.py points DATABASE_URL elsewhere before models is imported
+    from partitions import routed
+
+    rows = []
+    for schema in routed(session.connection(), params['cutoff'], last_day):
+        rows.extend(session.execute(text(sql.format(schema=schema)), params).all())
+    return rows
+
+def _add_rows(target, rows):
+    for key, count in rows:
+        target[key] = target.get(key, 0) + count
+
+def totals(session, local_date=None, archive_dir=ARCHIVE_DIR):
+    """Plays, listened milliseconds and completed plays, like rollups.totals"""
+    months = archived_months(archive_dir)
+    result = {'plays': 0, 'listened_ms': 0, 'completed': 0}
+    cutoff = first_unarchived_day(months)
+
+    if months and (local_date is None or local_date < cutoff):
+        table = _scan(open_archive(archive_dir), ['played_duration_ms', 'is_completed'], local_date)
+        result['plays'] += table.num_rows
+        result['listened_ms'] += pc.sum(table['played_duration_ms']).as_py() or 0
+        result['completed'] += pc.sum(pc.cast(table['is_completed'], pa.int64())).as_py() or 0
+
+    if local_date is None or local_date >= cutoff:
+        day_filter = 'AND local_date = :day' if local_date else ''
+        for plays, listened_ms, completed in _database_rows(session, f"""
+                SELECT count(*), coalesce(sum(played_duration_ms), 0), coalesce(sum(is_completed), 0)
+                FROM {{schema}}.song_plays WHERE local_date >= :cutoff {day_filter}""",
+                {'cutoff': cutoff, 'day': local_date}, local_date):
+            result['plays'] += plays
+            result['listened_ms'] += listened_ms
+            result['completed'] += completed
+    return result
+
+def listening_totals(session, local_date, archive_dir=ARCHIVE_DIR):
+    """All-time totals and those of `local_date`, like rollups.listening_totals"""
+    return {'all_time': totals(session, archive_dir=archive_dir),
+            'today': totals(session, local_date, archive_dir=archive_dir)}
+
+def chart_stats(session, first_day, top=10, archive_dir=ARCHIVE_DIR):
+    """Plays per hour of the day, per day since `first_day`, per device and of
+    the `top` artists, like rollups.chart_stats"""
+    months = archived_months(archive_dir)
+    cutoff = first_unarchived_day(months)
+    hourly = [0] * 24
+    daily, devices, artists = {}, {}, {}
+
+    if months:
+        dataset = open_archive(archive_dir)
+        table = _scan(dataset, ['local_hour', 'device_name', 'artists'])
+        for hour, count in _counts(table, 'local_hour').items():
+            hourly[hour] += count
+        device_names = pc.fill_null(pc.cast(table['device_name'], pa.string()), 'Unknown')
+        device_names = pc.if_else(pc.equal(device_names, ''), 'Unknown', device_names)
+        _add(devices, _counts(pa.table({'device': device_names}), 'device'))
+        _add(artists, _counts(pa.table({'artist': pc.list_flatten(table['artists'])}), 'artist'))
+        if first_day < cutoff:
+            _add(daily, _counts(_scan(dataset, ['local_date'], first_day=first_day), 'local_date'))
+
+    params = {'cutoff': cutoff, 'first_day': first_day}
+    for hour, count in _database_rows(session,
+            'SELECT local_hour, count(*) FROM {schema}.song_plays WHERE local_date >= :cutoff GROUP BY local_hour',
+            params):
+        if hour is not None:
+            hourly[hour] += count
+    _add_rows(daily, _database_rows(session,
+        'SELECT local_date, count(*) FROM {schema}.song_plays WHERE local_date >= :cutoff '
+        'AND local_date >= :first_day GROUP BY local_date', params))
+    _add_rows(devices, _database_rows(session,
+        "SELECT coalesce(nullif(device_name, ''), 'Unknown') AS device, count(*) FROM {schema}.song_plays "
+        "WHERE local_date >= :cutoff GROUP BY device", params))
+    _add_rows(artists, _database_rows(session,
+        'SELECT artists.name, count(*) FROM {schema}.song_plays AS song_plays '
+        'JOIN {schema}.play_artists AS play_artists ON play_artists.play_id = song_plays.id '
+        'JOIN main.artists ON artists.id = play_artists.artist_id WHERE local_date >= :cutoff GROUP BY artists.name',
+        params))
+
+    top_artists = sorted(artists.items(), key=lambda item: (-item[1], item[0]))[:top]
+    return {'hourly': hourly, 'daily': daily, 'devices': devices,
+            'top_artists': [list(item) for item in top_artists]}
+
+def monthly_artist_plays(archive_dir=ARCHIVE_DIR):
+    """Plays and listened time per artist per archived month"""
+    table = _scan(open_archive(archive_dir), ['month', 'artists', 'played_duration_ms'])
+    exploded = pa.table({
+        'month': pc.take(table['month'], pc.list_parent_indices(table['artists'])),
+        'artist': pc.list_flatten(table['artists']),
+        'played_duration_ms': pc.take(table['played_duration_ms'], pc.list_parent_indices(table['artists']))
+    })
+    return exploded.group_by(['month', 'artist']).aggregate([
+        ([], 'count_all'), ('played_duration_ms', 'sum')
+    ]).rename_columns(['month', 'artist', 'plays', 'listened_ms'])
+
+def device_completion_by_year(archive_dir=ARCHIVE_DIR):
+    """Plays and completion rate per device per archived year"""
+    table = _scan(open_archive(archive_dir), ['month', 'device_name', 'is_completed'])
+    grouped = pa.table({
+        'year': pc.utf8_slice_codeunits(pc.cast(table['month'], pa.string()), 0, 4),
+        'device': pc.cast(table['device_name'], pa.string()),
+        'completed': pc.cast(table['is_completed'], pa.int64())
+    }).group_by(['year', 'device']).aggregate([([], 'count_all'), ('completed', 'mean')])
+    return grouped.rename_columns(['year', 'device', 'plays', 'completion_rate'])
@@ -1,20 +1,29 @@
 import os
 import logging
-import pytz
 from datetime import datetime, timedelta
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, Response, render_template, jsonify, request, send_file
 from flask_socketio import SocketIO, emit
-from sqlalchemy import create_engine, Column, String, DateTime, Integer, Boolean, Text
+from sqlalchemy import create_engine, func, Column, String, DateTime, Integer, Boolean, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 import threading
 import time
 import requests
 import hashlib
 from pathlib import Path
-from models import SongPlay, Session
+from models import SongPlay, ReadSession, read_engine, LOCAL_TZ
+from spotify_client import create_spotify
+import rollups
+import analytics
+import partitions
+import search
+import export
+import history
+import artists
+import charts
+from response_cache import ResponseCache, RESPONSE_CACHE_MB
+import responses
+from notify import Listener, Relay, playback_snapshot
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -62,24 +71,23 @@ def cache_artist_image(artist_name, image_url):
         logger.warning(f"Error caching image for {artist_name}: {e}")
         return image_url  # Return original URL if caching fails
 
-# Configure logging with Berlin timezone
+# Configure logging with the configured timezone
 # Get log level from environment variable, default to ERROR
 log_level_str = os.getenv('LOG_LEVEL', 'ERROR').upper()
 log_level = getattr(logging, log_level_str, logging.ERROR)
 
-# Create a custom formatter that uses Berlin timezone
-class BerlinTimeFormatter(logging.Formatter):
+# Create a custom formatter that uses the configured timezone
+class LocalTimeFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
-        # Convert to Berlin timezone
-        berlin_tz = pytz.timezone('Europe/Berlin')
-        dt = datetime.fromtimestamp(record.created, berlin_tz)
+        # Convert to the configured timezone
+        dt = datetime.fromtimestamp(record.created, LOCAL_TZ)
         if datefmt:
             return dt.strftime(datefmt)
         else:
             return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 # Configure logging with custom formatter
-formatter = BerlinTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 # Create handlers
 file_handler = logging.FileHandler('output.log')
@@ -106,30 +114,64 @@ logger = logging.getLogger('app')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# Initialize Spotify client with configurable timeout
-spotify_timeout = int(os.getenv('SPOTIFY_TIMEOUT', 30))  # Default 30 seconds
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-    client_id=os.getenv('SPOTIPY_CLIENT_ID'),
-    client_secret=os.getenv('SPOTIPY_CLIENT_SECRET'),
-    redirect_uri=os.getenv('SPOTIPY_REDIRECT_URI'),
-    scope='user-read-playback-state user-read-currently-playing user-modify-playback-state',
-    open_browser=False  # Disable automatic browser opening
-), requests_timeout=spotify_timeout)
-
-# Global variable to track the last song count
-last_song_count = 0
+# jsonify writes with orjson when it is installed (see responses.py)
+app.json = responses.JSONProvider(app)
+# Message queue (a Redis URL, e.g. redis://localhost:6379/0) that carries the
+# Socket.IO emits and the tracker's notifications between the worker
+# processes of serve.py; not needed with a single process
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+# Socket.IO transports the server accepts; serve.py only allows websocket
+# with several workers, as long polling needs every request of a client to
+# reach the same worker
+SOCKETIO_TRANSPORTS = os.getenv('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',')
+# Events are written like the responses, datetimes included
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE,
+                    transports=SOCKETIO_TRANSPORTS, json=responses.SocketIOJSON)
+
+# Initialize Spotify client (SPOTIFY_API_URL points it at a stand-in API)
+sp = create_spotify(open_browser=False)  # Disable automatic browser opening
+
+# Highest play id that clients have been told about
+last_seen_play_id = 0
+_play_id_lock = threading.Lock()
+# Version of the database (see history.version) up to which the history has
+# been pushed to the clients; the next delta holds the groups changed since
+pushed_history_version = None
+_history_delta_lock = threading.Lock()
 background_task_started = False
+# Artists whose picture is being looked up in the background
+_artist_image_lookups = set()
+_artist_image_lock = threading.Lock()
 background_thread = None
 _background_lock = threading.Lock()
 
+# Latest playback snapshot per account, published by the tracker
+playback_snapshots = {}
+notification_listener = None
+# Whether this process receives the tracker's notifications, which makes it
+# the one that watches the database (see start_notification_listener)
+is_monitor = False
+_snapshot_lock = threading.Lock()
+# How long a snapshot published by the tracker stays valid (seconds)
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', 180))
+# How long a playback fetched by the web app itself is shared between requests
+LOCAL_SNAPSHOT_TTL = 3
+# Latest playback pushed to the clients per account, from which they
+# interpolate the progress
+announced_playback = {}
+# How far the reported progress may be from the interpolated one before the
+# clients get the playback again, e.g. after a seek (milliseconds)
+PROGRESS_DRIFT_MS = 3000
+
 def get_song_count():
     """Get the current number of songs in the database"""
     session = None
     try:
-        session = Session()
-        count = session.query(SongPlay).count()
+        session = ReadSession()
+        count = 0
+        for schema in partitions.routed(session.connection()):
+            plays, _ = partitions.play_entities(schema)
+            count += session.query(plays).count()
         logger.info(f"Database song count: {count}")
         return count
     except Exception as e:
@@ -139,33 +181,102 @@ def get_song_count():
         if session:
             session.close()
 
+def history_delta():
+    """The history groups changed since the last delta pushed to the clients,
+    as a `history_delta` event, or None when nothing changed
+
+    `songs` is None when the clients can't be sent a delta (before the first
+    one, after partitions were dropped, or when it would span too many days);
+    they then fetch the changes from /api/history?since= themselves.
+    """
+    global pushed_history_version
+    with _history_delta_lock:
+        session = None
+        try:
+            session = ReadSession()
+            # Read before the plays, like /api/history
+            version = tuple(history.version(session.connection()))
+            since = pushed_history_version
+            if since == version:
+                return None
+            songs = None
+            if since is not None and since[1] == version[1]:
+                songs = history.changed_songs(session, since[0])
+            pushed_history_version = version
+        finally:
+            if session:
+                session.close()
+    return {
+        'since': since[0] if since else None,
+        'change_seq': version[0],
+        'songs': songs,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def emit_play_changes(inserted, updated):
+    """Push the history groups of the plays that were added or changed to all
+    connected clients, if any changed since the last push"""
+    global last_seen_play_id
+    with _play_id_lock:
+        if inserted:
+            last_seen_play_id = max(last_seen_play_id, max(inserted))
+    try:
+        delta = history_delta()
+    except Exception as e:
+        logger.error(f"❌ Error reading the changed history: {e}")
+        delta = {'since': None, 'change_seq': None, 'songs': None, 'timestamp': datetime.now().isoformat()}
+    if delta is None:
+        return
+    delta.update(inserted=inserted, updated=updated)
+    changed = 'a reload' if delta['songs'] is None else f"{len(delta['songs'])} changed songs"
+    logger.info(f"🎵 Plays changed (new: {inserted}, closed: {updated}) - pushing {changed}")
+    socketio.emit('history_delta', delta)
+
+def handle_plays_notification(message):
+    """Forward a play change notification from the tracker to the clients"""
+    emit_play_changes(message.get('inserted') or [], message.get('updated') or [])
+
 def check_for_new_songs():
-    """Background task to check for new songs and emit WebSocket events"""
-    global last_song_count
-    logger.info("🔍 Starting background task to monitor database for new songs...")
+    """Background task that catches plays written without a notification.
+
+    The tracker notifies us directly when it inserts or closes a play. Other
+    writers (or a lost notification) are caught by watching SQLite's
+    `PRAGMA data_version`, which changes whenever another connection commits:
+    the history delta is then built from the change sequence, which also
+    covers plays that were updated, and is only pushed if a play changed.
+    """
+    global last_seen_play_id, pushed_history_version
+    logger.info("🔍 Starting background task to watch the database for changes...")
     consecutive_errors = 0
     max_consecutive_errors = 10
+    connection = None
+    data_version = None
     
     while True:
         try:
-            current_count = get_song_count()
-            # Only log every 10th check to reduce log spam when no new songs
-            if current_count != last_song_count or consecutive_errors > 0:
-                logger.info(f"📊 Current song count: {current_count}, Last count: {last_song_count}")
-            
-            if current_count > last_song_count:
-                # New songs detected
-                logger.info(f"🎵 New songs detected! Emitting WebSocket event. Count: {current_count}")
-                
-                # Emit to all connected clients - removed invalid broadcast parameter
-                socketio.emit('new_songs_detected', {
-                    'message': 'New songs detected in database',
-                    'count': current_count,
-                    'timestamp': datetime.now().isoformat()
-                })
-                
-                logger.info(f"📡 WebSocket event emitted to all clients. Count: {current_count}")
-                last_song_count = current_count
+            if connection is None:
+                # data_version is per connection, so keep the same one open
+                connection = read_engine.raw_connection()
+                session = ReadSession()
+                try:
+                    with _play_id_lock:
+                        last_seen_play_id = max(last_seen_play_id, session.query(func.max(SongPlay.id)).scalar() or 0)
+                    # Clients that loaded the history before are sent deltas from here on
+                    with _history_delta_lock:
+                        if pushed_history_version is None:
+                            pushed_history_version = tuple(history.version(session.connection()))
+                finally:
+                    session.close()
+
+            cursor = connection.cursor()
+            cursor.execute('PRAGMA data_version')
+            version = cursor.fetchone()[0]
+            if data_version is not None and version != data_version:
+                cursor.execute('SELECT id FROM song_plays WHERE id > ? ORDER BY id', (last_seen_play_id,))
+                new_ids = [row[0] for row in cursor.fetchall()]
+                emit_play_changes(new_ids, [])
+            data_version = version
+            cursor.close()
             
             # Reset error counter on successful operation
             consecutive_errors = 0
@@ -173,6 +284,9 @@ def check_for_new_songs():
         except Exception as e:
             consecutive_errors += 1
             logger.error(f"❌ Error in check_for_new_songs (attempt {consecutive_errors}): {e}")
+            if connection is not None:
+                connection.close()
+                connection = None
             
             # If too many consecutive errors, increase sleep time to avoid spam
             if consecutive_errors >= max_consecutive_errors:
@@ -180,11 +294,43 @@ def check_for_new_songs():
                 time.sleep(10)  # Sleep longer on repeated failures
                 continue
         
-        time.sleep(2)  # Check every 2 seconds
+        time.sleep(2)  # PRAGMA data_version reads no table data, so this is cheap
+
+def start_notification_listener():
+    """Listen for playback snapshots and play changes from the tracker;
+    returns whether this process is the monitor
+
+    Only one process can bind the notification port. With several workers
+    (see serve.py) the one that does is the monitor of the deployment: it
+    relays the playback snapshots to the other workers through the message
+    queue, and its Socket.IO emits (the playback and history deltas pushed
+    to the clients) reach the clients of all of them.
+    """
+    global notification_listener, is_monitor
+    with _snapshot_lock:
+        if notification_listener is not None:
+            return is_monitor
+        notification_listener = Listener()
+        notification_listener.on('playback', store_snapshot)
+        notification_listener.on('playback', announce_playback)
+        notification_listener.on('plays', handle_plays_notification)
+        is_monitor = notification_listener.start()
+        if SOCKETIO_MESSAGE_QUEUE:
+            relay = Relay(SOCKETIO_MESSAGE_QUEUE)
+            if is_monitor:
+                notification_listener.on('playback', relay.publish)
+            else:
+                relay.on('playback', store_snapshot)
+                relay.start()
+        return is_monitor
 
 def start_background_task():
-    """Start the background task if not already started"""
+    """Start the background task if not already started; only the monitor
+    process (see start_notification_listener) watches the database"""
     global background_task_started, background_thread
+    if not start_notification_listener():
+        logger.debug("ℹ️ Another process receives the tracker's notifications and watches the database")
+        return
     with _background_lock:
         if not background_task_started:
             logger.info("🚀 Starting background monitoring task...")
@@ -199,9 +345,6 @@ def start_background_task():
 def handle_connect():
     """Handle WebSocket connection"""
     logger.info('✅ Client connected')
-    global last_song_count
-    last_song_count = get_song_count()
-    logger.info(f"📊 Initial song count set to: {last_song_count}")
     emit('connected', {'message': 'Connected to Spotify Tracker'})
     
     # Start background task when first client connects
@@ -218,66 +361,120 @@ def handle_ping():
     logger.info('🏓 Ping received from client')
     emit('pong', {'message': 'pong', 'timestamp': datetime.now().isoformat()})
 
+@app.after_request
+def compress_response(response):
+    """Compress large responses with the encoding the client accepts"""
+    return responses.compress_response(response, request.accept_encodings)
+
 @app.route('/')
 def index():
     logger.info("📄 Index page requested")
     return render_template('index.html')
 
+def format_time(ms):
+    """Format milliseconds as m:ss"""
+    if ms is None or ms == 0:
+        return "0:00"
+    seconds = int(ms / 1000)
+    minutes = int(seconds / 60)
+    seconds = seconds % 60
+    return f"{minutes}:{seconds:02d}"
+
+def store_snapshot(snapshot):
+    """Remember the latest playback snapshot of an account"""
+    with _snapshot_lock:
+        playback_snapshots[snapshot.get('user_id')] = (snapshot, time.monotonic())
+
+def get_snapshot(user_id=None):
+    """Latest snapshot of an account, or None if there is no recent one"""
+    with _snapshot_lock:
+        entry = playback_snapshots.get(user_id)
+    if entry is None:
+        return None
+    snapshot, received = entry
+    # The tracker publishes at least every POLL_IDLE_MAX_INTERVAL seconds;
+    # playback we fetched ourselves is only shared for a few seconds
+    max_age = LOCAL_SNAPSHOT_TTL if snapshot.get('source') == 'app' else SNAPSHOT_MAX_AGE
+    if time.monotonic() - received > max_age:
+        return None
+    return snapshot
+
+def current_song(snapshot):
+    """What /api/current-song and the `playback` event send for a snapshot,
+    with the progress extrapolated to now"""
+    if not snapshot.get('track'):
+        return {'track': None}
+    # Extrapolate the progress from the time the snapshot was taken
+    progress_ms = snapshot['progress_ms']
+    duration_ms = snapshot['duration_ms']
+    if snapshot['is_playing']:
+        elapsed_ms = max(0, (time.time() - snapshot['fetched_at']) * 1000)
+        progress_ms = int(min(progress_ms + elapsed_ms, duration_ms or progress_ms + elapsed_ms))
+    progress_percentage = (progress_ms / duration_ms * 100) if duration_ms > 0 else 0
+    return {
+        'track': snapshot['track'],
+        'artist': snapshot['artist'],
+        'artists': snapshot.get('artists'),
+        'album': snapshot['album'],
+        'device': snapshot['device'],
+        'type': snapshot['device_type'],
+        'album_cover': snapshot['album_cover'],
+        'progress_ms': progress_ms,
+        'duration_ms': duration_ms,
+        'progress_percentage': round(progress_percentage, 2),
+        'progress_time': format_time(progress_ms),
+        'duration_time': format_time(duration_ms),
+        'is_playing': snapshot['is_playing'],
+        'release_year': snapshot['release_year']
+    }
+
+def playback_changed(previous, snapshot):
+    """Whether clients that interpolate the progress from the `previous`
+    snapshot need this one: another track, device or play state, or a
+    progress off by more than PROGRESS_DRIFT_MS"""
+    if previous is None:
+        return True
+    if any(previous.get(key) != snapshot.get(key) for key in ('track', 'track_uri', 'device', 'is_playing')):
+        return True
+    if not snapshot.get('track'):
+        return False
+    expected_ms = previous['progress_ms']
+    if previous['is_playing']:
+        expected_ms += (snapshot['fetched_at'] - previous['fetched_at']) * 1000
+    return abs(snapshot['progress_ms'] - expected_ms) > PROGRESS_DRIFT_MS
+
+def announce_playback(snapshot):
+    """Push a playback snapshot from the tracker to all connected clients
+    when it changes what they show"""
+    user_id = snapshot.get('user_id')
+    with _snapshot_lock:
+        if not playback_changed(announced_playback.get(user_id), snapshot):
+            return
+        announced_playback[user_id] = snapshot
+    song = current_song(snapshot)
+    logger.info(f"🎵 Playback changed: {song['track']} - pushing WebSocket event")
+    socketio.emit('playback', dict(song, user_id=user_id))
+
 @app.route('/api/current-song')
 def get_current_song():
     logger.info("🎵 Current song API requested")
+    start_notification_listener()
+    user_id = request.args.get('user')
     try:
-        playback = sp.current_playback()
-        if playback and playback.get('item'):
-            track = playback['item']
-            
-            # Get album cover URL
-            album_cover = None
-            if track['album']['images']:
-                # Use the medium size image (300x300)
-                album_cover = track['album']['images'][1]['url'] if len(track['album']['images']) > 1 else track['album']['images'][0]['url']
-            
-            # Get playback progress
-            progress_ms = playback.get('progress_ms', 0)
-            duration_ms = track.get('duration_ms', 0)
-            progress_percentage = (progress_ms / duration_ms * 100) if duration_ms > 0 else 0
-            
-            # Format time strings
-            def format_time(ms):
-                if ms is None or ms == 0:
-                    return "0:00"
-                seconds = int(ms / 1000)
-                minutes = int(seconds / 60)
-                seconds = seconds % 60
-                return f"{minutes}:{seconds:02d}"
-            
-            # Get release year from album
-            release_year = None
-            if track['album'].get('release_date'):
-                try:
-                    release_year = track['album']['release_date'][:4]  # Get first 4 characters (year)
-                except:
-                    release_year = None
-            
-            logger.info(f"🎵 Currently playing: {track['name']} by {', '.join([a['name'] for a in track['artists']])} - Progress: {format_time(progress_ms)}/{format_time(duration_ms)}")
-            return jsonify({
-                'track': track['name'],
-                'artist': ', '.join([a['name'] for a in track['artists']]),
-                'album': track['album']['name'],
-                'device': playback['device']['name'],
-                'type': playback['device']['type'],
-                'album_cover': album_cover,
-                'progress_ms': progress_ms,
-                'duration_ms': duration_ms,
-                'progress_percentage': round(progress_percentage, 2),
-                'progress_time': format_time(progress_ms),
-                'duration_time': format_time(duration_ms),
-                'is_playing': playback.get('is_playing', False),
-                'release_year': release_year
-            })
+        snapshot = get_snapshot(user_id)
+        if snapshot is None:
+            # No tracker is publishing for this account - ask Spotify ourselves
+            # and share the answer with other viewers for a few seconds
+            snapshot = playback_snapshot(sp.current_playback(), user_id)
+            snapshot['source'] = 'app'
+            store_snapshot(snapshot)
+
+        song = current_song(snapshot)
+        if song['track']:
+            logger.info(f"🎵 Currently playing: {song['track']} by {song['artist']} - Progress: {song['progress_time']}/{song['duration_time']}")
         else:
             logger.info("🎵 No song currently playing")
-            return jsonify({'track': None})
+        return jsonify(song)
     except Exception as e:
         error_msg = str(e)
         logger.error(f"❌ Error getting current song: {error_msg}")
@@ -294,91 +491,133 @@ def get_current_song():
         else:
             return jsonify({'error': f'Spotify API error: {error_msg}'}), 500
 
+# In-process cache of the responses of the read endpoints
+response_cache = ResponseCache(RESPONSE_CACHE_MB * 1024 * 1024)
+
+def cached_json(version, compute, *key_parts):
+    """JSON response of the requested endpoint and arguments at a `version`
+    of the database (see history.version), from response_cache or made from
+    the payload `compute()` returns; `key_parts` are any other inputs of the
+    payload. Bodies are cached compressed in the encoding the client accepts."""
+    encoding = responses.negotiate(request.accept_encodings)
+    # Stats of today and the last N days move with the date
+    key = (request.endpoint, tuple(sorted(request.args.items(multi=True))),
+           datetime.now(LOCAL_TZ).strftime('%Y-%m-%d'), tuple(version), encoding) + key_parts
+    entry = response_cache.get(key)
+    hit = entry is not None
+    if hit:
+        body, encoding = entry
+    else:
+        body = jsonify(compute()).get_data()
+        if encoding and len(body) >= responses.COMPRESS_MIN_SIZE:
+            body = responses.compress(body, encoding)
+        else:
+            encoding = None
+        response_cache.put(key, body, encoding)
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+def history_etag(version):
+    """ETag of /api/history for a version of the history and the query
+    string; `since` is left out, so a delta request is answered with 304 when
+    nothing changed since the version the client holds"""
+    query = sorted((name, value) for name, value in request.args.items(multi=True) if name != 'since')
+    if 'days' in request.args:
+        # The last N days move with the date
+        query.append(('today', datetime.now(LOCAL_TZ).strftime('%Y-%m-%d')))
+    digest = hashlib.sha1(repr(query).encode()).hexdigest()[:16]
+    return '{}-{}-{}'.format(*version, digest)
+
+def last_days_first_day():
+    """First local date of the last ?days=N days, or None without ?days=;
+    raises ValueError unless N is a whole number of at least 1"""
+    days = request.args.get('days')
+    if days is None:
+        return None
+    try:
+        days = int(days)
+    except ValueError:
+        raise ValueError(f"Invalid days '{days}', use a whole number")
+    if days < 1:
+        raise ValueError("days must be at least 1")
+    return (datetime.now(LOCAL_TZ) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
 @app.route('/api/history')
 def get_history():
+    """Plays grouped by track, album and day, newest first
+
+    One page of them is returned (?limit= groups, the first page unless
+    ?cursor= is given), sorted by ?sort= and ?direction= and filtered by
+    ?from= (or the last ?days=N days), ?to=, ?artist=, ?album=, ?device=,
+    ?completed= and ?q=, with the cursor of the next page, the range of days
+    it covers and the change sequence it reflects. With ?since=<change_seq>,
+    only the groups with a play inserted or updated after it are returned,
+    or "songs": null when they span too many days to send as a delta. The
+    whole history (optionally of the last ?days=N days) is only returned
+    with ?all=1, which a too large delta then falls back to ("full": true).
+    Responses carry an ETag and If-None-Match is answered with 304.
+    """
     logger.info("📜 History API requested")
     session = None
     try:
-        session = Session()
-        recent_songs = session.query(SongPlay).order_by(SongPlay.timestamp.desc()).all()
-        
-        songs = []
-        local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-        
-        # Group songs by track to handle artist name combinations
-        track_groups = {}
-        
-        for song in recent_songs:
-            # Convert UTC timestamp to local timezone
-            local_timestamp = None
-            local_date_str = None
-            
-            if song.timestamp:
-                # If timestamp is naive (no timezone), assume it's UTC
-                if song.timestamp.tzinfo is None:
-                    utc_timestamp = pytz.utc.localize(song.timestamp)
-                else:
-                    utc_timestamp = song.timestamp
-                
-                local_timestamp = utc_timestamp.astimezone(local_tz)
-                local_date_str = local_timestamp.strftime('%Y-%m-%d')
-            
-            # Create a unique key for each track
-            track_key = f"{song.track_name}_{song.album_name}_{local_date_str}"
-            
-            if track_key not in track_groups:
-                track_groups[track_key] = {
-                    'track_name': song.track_name,
-                    'album_name': song.album_name,
-                    'device_name': song.device_name,
-                    'device_type': song.device_type,
-                    'timestamp': local_timestamp,
-                    'date': local_date_str,
-                    'album_cover': song.album_cover_url,
-                    'track_uri': song.track_uri,
-                    'played_duration_ms': song.played_duration_ms,
-                    'track_duration_ms': song.track_duration_ms,
-                    'is_completed': song.is_completed,
-                    'start_time': song.start_time,
-                    'end_time': song.end_time,
-                    'artists': set()
-                }
-            
-            # Add artist to the set
-            track_groups[track_key]['artists'].add(song.artist_name)
-        
-        # Process each track group and combine artist names
-        for track_data in track_groups.values():
-            artists = list(track_data['artists'])
-            
-            # Handle "Tyler, The Creator" special case
-            if 'Tyler' in artists and 'The Creator' in artists:
-                # Remove both individual entries and add the combined name
-                artists = [artist for artist in artists if artist not in ['Tyler', 'The Creator']]
-                artists.append('Tyler, The Creator')
-            
-            # Join artists with commas
-            artist_name = ', '.join(sorted(artists))
-            
-            songs.append({
-                'track_name': track_data['track_name'],
-                'artist_name': artist_name,
-                'album_name': track_data['album_name'],
-                'device_name': track_data['device_name'],
-                'device_type': track_data['device_type'],
-                'timestamp': track_data['timestamp'].isoformat() if track_data['timestamp'] else None,
-                'date': track_data['date'],
-                'album_cover': track_data['album_cover'],
-                'track_uri': track_data['track_uri'],
-                'played_duration_ms': track_data['played_duration_ms'],
-                'track_duration_ms': track_data['track_duration_ms'],
-                'is_completed': track_data['is_completed'],
-                'start_time': track_data['start_time'].isoformat() if track_data['start_time'] else None,
-                'end_time': track_data['end_time'].isoformat() if track_data['end_time'] else None
-            })
-        
-        logger.info(f"📜 Returning {len(songs)} songs from history")
-        return jsonify({'songs': songs})
+        session = ReadSession()
+        # Read before the plays: a write in between is sent again next time
+        # rather than missed
+        change_seq, dropped = history.version(session.connection())
+        etag = history_etag((change_seq, dropped))
+        if request.if_none_match.contains_weak(etag):
+            # Compressed responses carry the weak form (see responses.py)
+            weak = '' if request.if_none_match.contains(etag) else 'W/'
+            return Response(status=304, headers={'ETag': f'{weak}"{etag}"'})
+
+        # The whole history is only sent to clients that ask for it
+        whole = request.args.get('all') in ('1', 'true')
+
+        def changed_songs():
+            # Optionally only the last `days` days, which only reads the
+            # partitions of their months
+            first_day = last_days_first_day()
+            songs, full = None, False
+            if 'since' in request.args:
+                try:
+                    since = int(request.args['since'])
+                except ValueError:
+                    raise ValueError(f"Invalid since '{request.args['since']}', use a change_seq")
+                songs = history.changed_songs(session, since, first_day)
+            if songs is None and whole:
+                songs, full = history.all_songs(session, first_day), True
+            if songs is None:
+                logger.info("📜 Too many changes for a delta, the client reloads the history")
+            else:
+                logger.info(f"📜 Returning {len(songs)} {'songs from history' if full else 'changed songs'}")
+            return {'songs': songs, 'change_seq': change_seq, 'full': full}
+
+        def songs_page():
+            completed = request.args.get('completed')
+            songs, next_cursor, (first_day, last_day) = history.page(
+                session, request.args.get('limit', history.DEFAULT_PAGE_SIZE, type=int),
+                request.args.get('cursor'), request.args.get('sort', 'timestamp'),
+                request.args.get('direction', 'desc'),
+                first_day=request.args.get('from') or last_days_first_day(), last_day=request.args.get('to') or None,
+                artist=request.args.get('artist') or None, album=request.args.get('album') or None,
+                device=request.args.get('device') or None, query=request.args.get('q') or None,
+                completed=None if completed in (None, '') else completed in ('1', 'true'))
+            return {'songs': songs, 'next_cursor': next_cursor, 'from': first_day, 'to': last_day,
+                    'change_seq': change_seq}
+
+        try:
+            response = cached_json((change_seq, dropped), changed_songs if whole or 'since' in request.args
+                                   else songs_page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response.set_etag(etag)
+        # Browsers revalidate with If-None-Match instead of reusing a stale copy
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         logger.error(f"❌ Error getting history: {e}")
         return jsonify({'error': str(e)}), 500
@@ -386,85 +625,75 @@ def get_history():
         if session:
             session.close()
 
+def stats_source():
+    """The module stats are read from: the rollups, or the Parquet archive with ?source=archive"""
+    return analytics if request.args.get('source') == 'archive' else rollups
+
+def stats_version(session):
+    """Version of the data the stats are read from, for cached_json: the
+    database's, and the archive's with ?source=archive"""
+    version = tuple(history.version(session.connection()))
+    if stats_source() is analytics:
+        version += analytics.archive_version()
+    return version
+
 @app.route('/api/listening-stats')
 def get_listening_stats():
     """Get listening time statistics"""
     logger.info("📊 Listening stats API requested")
     session = None
     try:
-        session = Session()
-        
-        # Calculate total listening time (all time)
-        total_listened_ms = session.query(SongPlay.played_duration_ms).filter(
-            SongPlay.played_duration_ms > 0
-        ).all()
-        total_listened_ms = sum([row[0] for row in total_listened_ms])
+        session = ReadSession()
         
-        # Calculate today's listening time using local timezone
-        local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-        today = datetime.now(local_tz).date()
+        def listening_stats():
+            # All-time and today's totals from the rollup tables (or the archive)
+            totals = stats_source().listening_totals(session, datetime.now(LOCAL_TZ).strftime('%Y-%m-%d'))
+            all_time, today = totals['all_time'], totals['today']
+            total_listened_ms = all_time['listened_ms']
+            today_listened_ms = today['listened_ms']
+            completed_songs = all_time['completed']
+            total_songs = all_time['plays']
+            catalog = rollups.catalog_counts(session)
         
-        # Convert UTC timestamps to local timezone for comparison
-        today_songs = []
-        all_songs = session.query(SongPlay).all()
-        
-        for song in all_songs:
-            # Convert UTC timestamp to local timezone
-            if song.timestamp:
-                # If timestamp is naive (no timezone), assume it's UTC
-                if song.timestamp.tzinfo is None:
-                    utc_timestamp = pytz.utc.localize(song.timestamp)
-                else:
-                    utc_timestamp = song.timestamp
-                
-                local_timestamp = utc_timestamp.astimezone(local_tz)
-                if local_timestamp.date() == today:
-                    today_songs.append(song)
-        
-        today_listened_ms = sum([song.played_duration_ms for song in today_songs])
-        
-        # Calculate total songs completed
-        completed_songs = session.query(SongPlay).filter(
-            SongPlay.is_completed == True
-        ).count()
-        
-        # Calculate total songs started
-        total_songs = session.query(SongPlay).count()
-        
-        def format_duration(ms):
-            """Format milliseconds to human readable time"""
-            if not ms:
-                return "0m"
-            # Convert to float first to handle any decimal milliseconds
-            total_seconds = float(ms) / 1000
-            total_minutes = total_seconds / 60
-            total_hours = total_minutes / 60
-            total_days = total_hours / 24
+            def format_duration(ms):
+                """Format milliseconds to human readable time"""
+                if not ms:
+                    return "0m"
+                # Convert to float first to handle any decimal milliseconds
+                total_seconds = float(ms) / 1000
+                total_minutes = total_seconds / 60
+                total_hours = total_minutes / 60
+                total_days = total_hours / 24
             
-            if total_days >= 1:
-                days = int(total_days)
-                hours = int(total_hours % 24)
-                minutes = total_minutes % 60
-                return f"{days}d {hours}h {minutes:.1f}m"
-            elif total_hours >= 1:
-                hours = int(total_hours)
-                minutes = total_minutes % 60
-                return f"{hours}h {minutes:.1f}m"
-            else:
-                return f"{total_minutes:.1f}m"
+                if total_days >= 1:
+                    days = int(total_days)
+                    hours = int(total_hours % 24)
+                    minutes = total_minutes % 60
+                    return f"{days}d {hours}h {minutes:.1f}m"
+                elif total_hours >= 1:
+                    hours = int(total_hours)
+                    minutes = total_minutes % 60
+                    return f"{hours}h {minutes:.1f}m"
+                else:
+                    return f"{total_minutes:.1f}m"
         
-        stats = {
-            'total_listened': format_duration(total_listened_ms),
-            'total_listened_ms': total_listened_ms,
-            'today_listened': format_duration(today_listened_ms),
-            'today_listened_ms': today_listened_ms,
-            'completed_songs': completed_songs,
-            'total_songs': total_songs,
-            'completion_rate': round((completed_songs / total_songs * 100) if total_songs > 0 else 0, 1)
-        }
+            stats = {
+                'total_listened': format_duration(total_listened_ms),
+                'total_listened_ms': total_listened_ms,
+                'today_listened': format_duration(today_listened_ms),
+                'today_listened_ms': today_listened_ms,
+                'completed_songs': completed_songs,
+                'total_songs': total_songs,
+                'today_songs': today['plays'],
+                'unique_artists': catalog['artists'],
+                'unique_albums': catalog['albums'],
+                'completion_rate': round((completed_songs / total_songs * 100) if total_songs > 0 else 0, 1)
+            }
         
-        logger.info(f"📊 Returning listening stats: {stats}")
-        return jsonify(stats)
+            logger.info(f"📊 Returning listening stats: {stats}")
+            return stats
+
+        return cached_json(stats_version(session), listening_stats)
     except Exception as e:
         logger.error(f"❌ Error getting listening stats: {e}")
         return jsonify({'error': str(e)}), 500
@@ -472,6 +701,85 @@ def get_listening_stats():
         if session:
             session.close()
 
+@app.route('/api/chart-stats')
+def get_chart_stats():
+    """Get the plays per hour, day, device and top artist for the charts"""
+    logger.info("📈 Chart stats API requested")
+    session = None
+    try:
+        session = ReadSession()
+        first_day = (datetime.now(LOCAL_TZ) - timedelta(days=29)).strftime('%Y-%m-%d')
+        return cached_json(stats_version(session), lambda: stats_source().chart_stats(session, first_day))
+    except Exception as e:
+        logger.error(f"❌ Error getting chart stats: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if session:
+            session.close()
+
+@app.route('/api/charts/<name>')
+def get_chart(name):
+    """One chart of the dashboard aggregated in SQL, between ?from= and ?to=
+    (or over the last ?days=N days), split by ?bucket= (day, week, month,
+    hour or weekday); top charts take ?top="""
+    if name not in charts.CHARTS:
+        return jsonify({'error': f"Unknown chart '{name}', use one of: {', '.join(charts.CHARTS)}"}), 404
+    session = None
+    try:
+        session = ReadSession()
+        try:
+            first_day = request.args.get('from') or last_days_first_day()
+            return jsonify(charts.chart(session, name, first_day, request.args.get('to') or None,
+                                        request.args.get('bucket', 'day'),
+                                        request.args.get('top', charts.DEFAULT_TOP, type=int)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"❌ Error getting chart {name}: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if session:
+            session.close()
+
+@app.route('/api/search')
+def search_tracks():
+    """Tracks whose name, artists or album contain words starting with the typed ones"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    session = None
+    try:
+        session = ReadSession()
+        return jsonify({'results': search.search(session, query, limit)})
+    except Exception as e:
+        logger.error(f"❌ Error searching for '{query}': {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if session:
+            session.close()
+
+@app.route('/api/export')
+def export_history():
+    """The plays between ?from= and ?to= (local dates) as a CSV or NDJSON
+    download, streamed as it is read; ?gzip=1 compresses it"""
+    file_format = request.args.get('format', 'csv')
+    first_day = request.args.get('from') or None
+    last_day = request.args.get('to') or None
+    compress = request.args.get('gzip') in ('1', 'true')
+    if file_format not in export.FORMATS:
+        return jsonify({'error': f"Unknown format '{file_format}', use csv or ndjson"}), 400
+    for day in (first_day, last_day):
+        try:
+            if day:
+                datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': f"Invalid date '{day}', use YYYY-MM-DD"}), 400
+
+    logger.info(f"📤 Exporting history as {file_format} ({first_day or 'start'} to {last_day or 'today'})")
+    name = export.filename(file_format, first_day, last_day, compress)
+    return Response(export.export(ReadSession, file_format, first_day, last_day, compress),
+                    mimetype='application/gzip' if compress else export.FORMATS[file_format],
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
 @app.route('/api/play-song', methods=['POST'])
 def play_song():
     """Play a song on the current Spotify player"""
@@ -554,12 +862,16 @@ def play_song():
 
 @app.route('/api/test-websocket')
 def test_websocket():
-    """Test endpoint to manually trigger WebSocket event"""
+    """Test endpoint to manually trigger WebSocket event; clients reload the
+    history changes over HTTP"""
     logger.info("🧪 Manual WebSocket test triggered")
     try:
-        socketio.emit('new_songs_detected', {
-            'message': 'Manual test - new songs detected in database',
-            'count': get_song_count()
+        socketio.emit('history_delta', {
+            'since': None,
+            'change_seq': None,
+            'songs': None,
+            'count': get_song_count(),
+            'timestamp': datetime.now().isoformat()
         })
         logger.info("🧪 WebSocket test event sent successfully")
         return jsonify({'message': 'WebSocket test event sent'})
@@ -567,9 +879,115 @@ def test_websocket():
         logger.error(f"❌ Error in WebSocket test: {e}")
         return jsonify({'error': str(e)}), 500
 
+def fetch_artist_image(artist_name, artist_ids):
+    """Look up the artist's picture on Spotify and cache it; returns its URL or None"""
+    artist_image = None
+    try:
+        spotify_ids = [artist_id for artist_id in artist_ids if not artist_id.startswith('local:')]
+        if spotify_ids:
+            # The Spotify ID is known from the tracked plays, no need to search by name
+            artist = sp.artist(spotify_ids[0])
+            if artist.get('images'):
+                artist_image = cache_artist_image(artist_name, artist['images'][0]['url'])
+        else:
+            # Strategy 1: Search with quotes for exact match
+            search_query = f'"{artist_name}"'
+            search_results = sp.search(q=search_query, type='artist', limit=5)
+        
+            if search_results['artists']['items']:
+                # Try to find an exact match first
+                exact_match = None
+                for artist in search_results['artists']['items']:
+                    if artist['name'].lower() == artist_name.lower():
+                        exact_match = artist
+                        break
+            
+                if exact_match:
+                    artist = exact_match
+                    logger.info(f"Found exact match for {artist_name}: {artist['name']}")
+                else:
+                    # Strategy 2: Try without quotes if no exact match
+                    search_results2 = sp.search(q=artist_name, type='artist', limit=5)
+                    if search_results2['artists']['items']:
+                        # Look for close matches
+                        best_match = None
+                        best_score = 0
+                    
+                        for artist in search_results2['artists']['items']:
+                            # Simple similarity scoring
+                            artist_lower = artist['name'].lower()
+                            query_lower = artist_name.lower()
+                        
+                            # Exact match gets highest score
+                            if artist_lower == query_lower:
+                                best_match = artist
+                                break
+                            # Contains the full name
+                            elif query_lower in artist_lower or artist_lower in query_lower:
+                                score = len(set(artist_lower.split()) & set(query_lower.split()))
+                                if score > best_score:
+                                    best_score = score
+                                    best_match = artist
+                    
+                        if best_match:
+                            artist = best_match
+                            logger.info(f"Found best match for {artist_name}: {artist['name']}")
+                        else:
+                            artist = search_results2['artists']['items'][0]
+                            logger.warning(f"No good match found for {artist_name}, using: {artist['name']}")
+                    else:
+                        artist = search_results['artists']['items'][0]
+                        logger.warning(f"No exact match found for {artist_name}, using: {artist['name']}")
+            
+                if artist['images']:
+                    spotify_image_url = artist['images'][0]['url']  # Get the largest image
+                    # Cache the image and get the cached URL
+                    artist_image = cache_artist_image(artist_name, spotify_image_url)
+    except Exception as e:
+        logger.warning(f"Could not fetch artist image for {artist_name}: {e}")
+    return artist_image
+
+def announce_artist_image(artist_name, artist_ids):
+    """Fetch an artist's picture in the background and send it to the clients"""
+    try:
+        artist_image = fetch_artist_image(artist_name, artist_ids)
+        if artist_image:
+            socketio.emit('artist_image', {'artist_name': artist_name, 'artist_image': artist_image})
+    finally:
+        with _artist_image_lock:
+            _artist_image_lookups.discard(artist_name)
+
+def request_artist_image(artist_name, artist_ids):
+    """The cached picture of an artist; without one, a lookup is started in the
+    background (one per artist at a time) and None is returned"""
+    cached_image = get_cached_artist_image(artist_name)
+    if cached_image:
+        return cached_image
+    with _artist_image_lock:
+        if artist_name in _artist_image_lookups:
+            return None
+        _artist_image_lookups.add(artist_name)
+    threading.Thread(target=announce_artist_image, args=(artist_name, artist_ids), daemon=True).start()
+    return None
+
+def format_artist_duration(ms):
+    if not ms:
+        return "0m"
+    minutes = int(ms / 60000)
+    hours = minutes // 60
+    minutes = minutes % 60
+    if hours > 0:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
 @app.route('/api/artist')
 def get_artist_stats():
-    """Get detailed statistics for a specific artist"""
+    """Stats of an artist and the first page of its solo tracks, features and
+    plays, with the cursor of each list's next page (see /api/artist/songs)
+
+    The artist's picture comes from the cache; when it isn't cached yet it
+    is looked up in the background and sent with the 'artist_image' event.
+    """
     artist_name = request.args.get('name')
     if not artist_name:
         return jsonify({'error': 'Artist name is required'}), 400
@@ -577,194 +995,23 @@ def get_artist_stats():
     logger.info(f"🎤 Artist stats API requested for: {artist_name}")
     session = None
     try:
-        session = Session()
+        session = ReadSession()
         
         # Decode URL-encoded artist name
         import urllib.parse
         artist_name = urllib.parse.unquote(artist_name)
         
-        # Get all songs where this artist appears (either solo or as feature)
-        all_songs = session.query(SongPlay).all()
-        
-        solo_songs = []
-        feature_songs = []
-        all_plays = []  # All plays including duplicates for history
-        total_listened_ms = 0
-        
-        for song in all_songs:
-            # Handle special case for "Tyler, The Creator"
-            if song.artist_name == 'Tyler, The Creator' and artist_name == 'Tyler, The Creator':
-                solo_songs.append(song)
-                all_plays.append(song)
-                total_listened_ms += song.played_duration_ms or 0
-            else:
-                # Split artist names and check if our artist appears
-                artists = [x.strip() for x in song.artist_name.split(',')]
-                if artist_name in artists:
-                    all_plays.append(song)  # Add to history regardless
-                    if len(artists) == 1:
-                        # Solo song - artist is the only artist
-                        solo_songs.append(song)
-                    else:
-                        # Feature song - artist appears with other artists
-                        feature_songs.append(song)
-                    total_listened_ms += song.played_duration_ms or 0
-        
-        # Calculate statistics
-        solo_count = len(solo_songs)
-        feature_count = len(feature_songs)
-        total_songs = solo_count + feature_count
-        
-        # Get unique tracks for profile (avoid duplicates)
-        unique_solo_tracks = {}
-        unique_feature_tracks = {}
-        
-        # Process solo songs - keep only unique tracks
-        for song in solo_songs:
-            track_key = f"{song.track_name}_{song.album_name}"
-            if track_key not in unique_solo_tracks:
-                unique_solo_tracks[track_key] = song
-            else:
-                # If we already have this track, keep the one with more play time
-                existing = unique_solo_tracks[track_key]
-                if (song.played_duration_ms or 0) > (existing.played_duration_ms or 0):
-                    unique_solo_tracks[track_key] = song
-        
-        # Process feature songs - keep only unique tracks
-        for song in feature_songs:
-            track_key = f"{song.track_name}_{song.album_name}"
-            if track_key not in unique_feature_tracks:
-                unique_feature_tracks[track_key] = song
-            else:
-                # If we already have this track, keep the one with more play time
-                existing = unique_feature_tracks[track_key]
-                if (song.played_duration_ms or 0) > (existing.played_duration_ms or 0):
-                    unique_feature_tracks[track_key] = song
-        
-        # Get unique track counts
-        unique_tracks = len(unique_solo_tracks) + len(unique_feature_tracks)
-        
-        # Format total listening time
-        def format_duration(ms):
-            if not ms:
-                return "0m"
-            minutes = int(ms / 60000)
-            hours = minutes // 60
-            minutes = minutes % 60
-            if hours > 0:
-                return f"{hours}h {minutes}m"
-            return f"{minutes}m"
-        
-        # Try to get artist profile picture from Spotify
-        artist_image = None
-        
-        # First check if we have a cached version
-        cached_image = get_cached_artist_image(artist_name)
-        if cached_image:
-            artist_image = cached_image
-            logger.info(f"Using cached image for {artist_name}")
-        else:
-            # If not cached, fetch from Spotify and cache it
-            try:
-                # Strategy 1: Search with quotes for exact match
-                search_query = f'"{artist_name}"'
-                search_results = sp.search(q=search_query, type='artist', limit=5)
-                
-                if search_results['artists']['items']:
-                    # Try to find an exact match first
-                    exact_match = None
-                    for artist in search_results['artists']['items']:
-                        if artist['name'].lower() == artist_name.lower():
-                            exact_match = artist
-                            break
-                    
-                    if exact_match:
-                        artist = exact_match
-                        logger.info(f"Found exact match for {artist_name}: {artist['name']}")
-                    else:
-                        # Strategy 2: Try without quotes if no exact match
-                        search_results2 = sp.search(q=artist_name, type='artist', limit=5)
-                        if search_results2['artists']['items']:
-                            # Look for close matches
-                            best_match = None
-                            best_score = 0
-                            
-                            for artist in search_results2['artists']['items']:
-                                # Simple similarity scoring
-                                artist_lower = artist['name'].lower()
-                                query_lower = artist_name.lower()
-                                
-                                # Exact match gets highest score
-                                if artist_lower == query_lower:
-                                    best_match = artist
-                                    break
-                                # Contains the full name
-                                elif query_lower in artist_lower or artist_lower in query_lower:
-                                    score = len(set(artist_lower.split()) & set(query_lower.split()))
-                                    if score > best_score:
-                                        best_score = score
-                                        best_match = artist
-                            
-                            if best_match:
-                                artist = best_match
-                                logger.info(f"Found best match for {artist_name}: {artist['name']}")
-                            else:
-                                artist = search_results2['artists']['items'][0]
-                                logger.warning(f"No good match found for {artist_name}, using: {artist['name']}")
-                        else:
-                            artist = search_results['artists']['items'][0]
-                            logger.warning(f"No exact match found for {artist_name}, using: {artist['name']}")
-                    
-                    if artist['images']:
-                        spotify_image_url = artist['images'][0]['url']  # Get the largest image
-                        # Cache the image and get the cached URL
-                        artist_image = cache_artist_image(artist_name, spotify_image_url)
+        def artist_stats():
+            result = artists.artist_page(session, artist_name)
+            result['artist_image'] = request_artist_image(artist_name, result.pop('artist_ids'))
+            result['total_listening_time'] = format_artist_duration(result['total_listened_ms'])
             
-            except Exception as e:
-                logger.warning(f"Could not fetch artist image for {artist_name}: {e}")
+            logger.info(f"🎤 Artist stats for {artist_name}: {result['total_songs']} total songs, {result['total_listening_time']} listening time")
+            return result
         
-        result = {
-            'artist_name': artist_name,
-            'artist_image': artist_image,
-            'solo_songs': solo_count,
-            'feature_songs': feature_count,
-            'total_songs': total_songs,
-            'unique_tracks': unique_tracks,
-            'total_listening_time': format_duration(total_listened_ms),
-            'total_listened_ms': total_listened_ms,
-            'solo_songs_list': [{
-                'track_name': song.track_name,
-                'album_name': song.album_name,
-                'played_duration_ms': song.played_duration_ms,
-                'track_duration_ms': song.track_duration_ms,
-                'timestamp': song.timestamp.isoformat() if song.timestamp else None,
-                'album_cover': song.album_cover_url,
-                'track_uri': song.track_uri
-            } for song in list(unique_solo_tracks.values())[:10]],  # Limit to 10 most recent unique tracks
-            'feature_songs_list': [{
-                'track_name': song.track_name,
-                'album_name': song.album_name,
-                'artist_name': song.artist_name,
-                'played_duration_ms': song.played_duration_ms,
-                'timestamp': song.timestamp.isoformat() if song.timestamp else None,
-                'album_cover': song.album_cover_url,
-                'track_uri': song.track_uri
-            } for song in list(unique_feature_tracks.values())[:10]],  # Limit to 10 most recent unique tracks
-            'full_history_list': [{
-                'track_name': song.track_name,
-                'album_name': song.album_name,
-                'artist_name': song.artist_name,
-                'played_duration_ms': song.played_duration_ms,
-                'track_duration_ms': song.track_duration_ms,
-                'timestamp': song.timestamp.isoformat() if song.timestamp else None,
-                'album_cover': song.album_cover_url,
-                'track_uri': song.track_uri,
-                'is_solo': len([x.strip() for x in song.artist_name.split(',')]) == 1 or (song.artist_name == 'Tyler, The Creator' and artist_name == 'Tyler, The Creator')
-            } for song in sorted(all_plays, key=lambda x: x.timestamp, reverse=True)[:50]]  # Limit to 50 most recent plays (including duplicates)
-        }
-        
-        logger.info(f"🎤 Artist stats for {artist_name}: {total_songs} total songs, {format_duration(total_listened_ms)} listening time")
-        return jsonify(result)
+        # Keyed on the cached picture too, so that the page is made again once
+        # the background lookup has cached it
+        return cached_json(history.version(session.connection()), artist_stats, get_cached_artist_image(artist_name))
         
     except Exception as e:
         logger.error(f"❌ Error getting artist stats: {e}")
@@ -773,6 +1020,34 @@ def get_artist_stats():
         if session:
             session.close()
 
+@app.route('/api/artist/songs')
+def get_artist_songs():
+    """A page of an artist's ?list= (solo, feature or history) after ?cursor=,
+    ?limit= entries long, with the cursor of the next page"""
+    artist_name = request.args.get('name')
+    if not artist_name:
+        return jsonify({'error': 'Artist name is required'}), 400
+    session = None
+    try:
+        session = ReadSession()
+        try:
+            songs, next_cursor = artists.songs(session, artist_name, request.args.get('list', 'history'),
+                                               request.args.get('limit', type=int), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'songs': songs, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"❌ Error getting songs of artist {artist_name}: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if session:
+            session.close()
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    """Hits, misses and size of the response cache"""
+    return jsonify(response_cache.stats())
+
 @app.route('/api/debug/artist-search')
 def debug_artist_search():
     """Debug endpoint to test artist search functionality"""
@@ -832,7 +1107,7 @@ def serve_cached_image(filename):
 
 if __name__ == '__main__':
     logger.info("🚀 Starting Flask app with WebSocket support...")
-    # Start the background task for checking new songs
+    # Start the notification listener and the background task for checking new songs
     start_background_task()
     # Get port from environment variable, default to 5000
     port = int(os.getenv('PORT', 5000))
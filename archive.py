@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Columnar archive of the listening history
+
+Writes the plays of every finished month to a Parquet file under
+ARCHIVE_DIR/month=YYYY-MM/, with dictionary-encoded artist, album and device
+columns, for the analytics in analytics.py. The current month stays in
+SQLite only. Commands:
+
+    python archive.py export [--force]   archive months that are not archived yet
+    python archive.py verify             compare archive stats with the SQLite path
+    python archive.py benchmark --plays 1000000
+"""
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from analytics import ARCHIVE_DIR, archived_months, require_pyarrow
+import analytics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger('archive')
+
+def archive_schema():
+    strings = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('user_id', strings),
+        ('track_id', pa.string()),
+        ('track_name', pa.string()),
+        ('artist_name', strings),
+        ('artists', pa.list_(pa.string())),
+        ('album_name', strings),
+        ('device_name', strings),
+        ('device_type', strings),
+        ('timestamp_ms', pa.int64()),
+        ('local_date', pa.string()),
+        ('local_hour', pa.int8()),
+        ('played_duration_ms', pa.float64()),
+        ('track_duration_ms', pa.int64()),
+        ('is_completed', pa.bool_())
+    ])
+
+PLAY_COLUMNS = ['id', 'user_id', 'track_id', 'track_name', 'artist_name', 'album_name', 'device_name',
+                'device_type', 'timestamp_ms', 'local_date', 'local_hour', 'played_duration_ms',
+                'track_duration_ms', 'is_completed']
+
+def month_range(month):
+    """First day of a month and of the month after it"""
+    year, number = map(int, month.split('-'))
+    following = f'{year + 1:04d}-01' if number == 12 else f'{year:04d}-{number + 1:02d}'
+    return f'{month}-01', f'{following}-01'
+
+def read_month(conn, month):
+    """All plays of a month as an Arrow table in the archive schema"""
+    from partitions import routed
+
+    first_day, next_month = month_range(month)
+    params = {'first_day': first_day, 'next_month': next_month}
+    rows, artists = [], {}
+    for schema in routed(conn, first_day, first_day):
+        rows.extend(conn.execute(text(
+            f"SELECT {', '.join(PLAY_COLUMNS)} FROM {schema}.song_plays "
+            "WHERE local_date >= :first_day AND local_date < :next_month"), params).fetchall())
+        for play_id, name in conn.execute(text(
+                f'SELECT play_artists.play_id, artists.name FROM {schema}.play_artists AS play_artists '
+                'JOIN main.artists ON artists.id = play_artists.artist_id '
+                f'JOIN {schema}.song_plays AS song_plays ON song_plays.id = play_artists.play_id '
+                'WHERE local_date >= :first_day AND local_date < :next_month '
+                'ORDER BY play_artists.play_id, play_artists.position'), params):
+            artists.setdefault(play_id, []).append(name)
+    rows.sort(key=lambda row: row[0])
+
+    columns = {name: [row[index] for row in rows] for index, name in enumerate(PLAY_COLUMNS)}
+    columns['artists'] = [artists.get(play_id, []) for play_id in columns['id']]
+    columns['is_completed'] = [bool(value) for value in columns['is_completed']]
+    columns['track_duration_ms'] = [int(value) if value is not None else None for value in columns['track_duration_ms']]
+    columns['played_duration_ms'] = [float(value or 0) for value in columns['played_duration_ms']]
+    schema = archive_schema()
+    return pa.table({name: pa.array(columns[name], type=schema.field(name).type) for name in schema.names},
+                    schema=schema)
+
+def write_month(table, month, archive_dir=ARCHIVE_DIR):
+    """Replace the partition of a month with `table`"""
+    directory = os.path.join(archive_dir, f'month={month}')
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    pq.write_table(table, os.path.join(temporary, 'plays.parquet'), compression='zstd')
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(temporary, directory)
+
+def export(engine, archive_dir=ARCHIVE_DIR, force=False, current_month=None):
+    """Archive every finished month that is not archived yet (all of them with `force`)"""
+    require_pyarrow()
+    from models import LOCAL_TZ
+    from partitions import cold_months
+    current_month = current_month or datetime.now(LOCAL_TZ).strftime('%Y-%m')
+    done = set() if force else set(archived_months(archive_dir))
+    with engine.connect() as conn:
+        months = sorted({month for month, in conn.execute(text(
+            'SELECT DISTINCT substr(local_date, 1, 7) FROM song_plays WHERE local_date IS NOT NULL'
+        ))} | set(cold_months(conn)))
+        exported = 0
+        for month in months:
+            if month >= current_month or month in done:
+                continue
+            table = read_month(conn, month)
+            write_month(table, month, archive_dir)
+            exported += table.num_rows
+            logger.info(f"📦 Archived {table.num_rows} plays of {month}")
+    return exported
+
+def verify(session, archive_dir=ARCHIVE_DIR):
+    """Compare the archive-based stats with the rollup-based ones; returns True if they match"""
+    import rollups
+    from models import LOCAL_TZ
+    today = datetime.now(LOCAL_TZ).strftime('%Y-%m-%d')
+    first_day = (datetime.now(LOCAL_TZ) - timedelta(days=29)).strftime('%Y-%m-%d')
+    ok = True
+    for name, expected, actual in [
+            ('totals', rollups.totals(session), analytics.totals(session, archive_dir=archive_dir)),
+            ('today', rollups.totals(session, today), analytics.totals(session, today, archive_dir=archive_dir)),
+            ('charts', rollups.chart_stats(session, first_day, top=1000),
+             analytics.chart_stats(session, first_day, top=1000, archive_dir=archive_dir))]:
+        if name == 'charts':
+            expected['top_artists'] = sorted(map(tuple, expected['top_artists']))
+            actual['top_artists'] = sorted(map(tuple, actual['top_artists']))
+        else:
+            expected['listened_ms'] = round(expected['listened_ms'])
+            actual['listened_ms'] = round(actual['listened_ms'])
+        matches = expected == actual
+        ok = ok and matches
+        print(f"{'✅' if matches else '❌'} {name}")
+        if not matches:
+            print(f"   SQLite:  {expected}\n   Archive: {actual}")
+    return ok
+
+def benchmark(plays):
+    """Time wide analytical queries on SQLite and on the archive with `plays` synthetic plays"""
+    require_pyarrow()
+    directory = tempfile.mkdtemp(prefix='spotify-archive-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    archive_dir = os.path.join(directory, 'archive')
+    from models import engine
+    from synthetic import generate_history
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        generate_history(conn, plays, start=datetime(2016, 1, 1))
+    print(f"Generated {plays} plays in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    export(engine, archive_dir, current_month='9999-12')
+    print(f"Exported to Parquet in {time.perf_counter() - started:.1f}s "
+          f"({sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(archive_dir) for name in names) / 1e6:.1f} MB, "
+          f"SQLite {os.path.getsize(os.path.join(directory, 'bench.db')) / 1e6:.1f} MB)")
+
+    queries = [
+        ('plays per artist per month',
+         'SELECT substr(local_date, 1, 7), artists.name, count(*), sum(played_duration_ms) FROM song_plays '
+         'JOIN play_artists ON play_artists.play_id = song_plays.id JOIN artists ON artists.id = play_artists.artist_id '
+         'GROUP BY 1, 2',
+         lambda: analytics.monthly_artist_plays(archive_dir)),
+        ('completion rate per device per year',
+         'SELECT substr(local_date, 1, 4), device_name, count(*), avg(is_completed) FROM song_plays GROUP BY 1, 2',
+         lambda: analytics.device_completion_by_year(archive_dir))
+    ]
+    with engine.connect() as conn:
+        for name, sql, scan in queries:
+            started = time.perf_counter()
+            expected = len(conn.execute(text(sql)).fetchall())
+            sqlite_time = time.perf_counter() - started
+            started = time.perf_counter()
+            actual = scan().num_rows
+            archive_time = time.perf_counter() - started
+            print(f"{name}: SQLite {sqlite_time:.2f}s, archive {archive_time:.2f}s "
+                  f"({sqlite_time / archive_time:.1f}x, {expected} / {actual} groups)")
+    print(f"Data:            {directory}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar archive of the listening history")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('export').add_argument('--force', action='store_true', help="Rewrite archived months too")
+    commands.add_parser('verify')
+    commands.add_parser('benchmark').add_argument('--plays', type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        benchmark(args.plays)
+    elif args.command == 'export':
+        from models import engine
+        print(f"Archived {export(engine, force=args.force)} plays to {ARCHIVE_DIR}")
+    else:
+        from models import ReadSession
+        session = ReadSession()
+        try:
+            if not verify(session):
+                raise SystemExit(1)
+        finally:
+            session.close()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Artist pages: stats and paged song lists of one artist
+
+An artist is looked up by name in the artists table and its plays through
+the ix_play_artists_artist_id index, so an artist page reads that artist's
+plays only. A play is solo when the artist is its only credited artist and a
+feature otherwise. The play counts, listening time and unique tracks are
+aggregate queries; the solo and feature tracks (one entry per track and
+album, most recently played first) and the full history of plays are read a
+page at a time, with an opaque cursor for the next page.
+
+Run this file with `--benchmark` to time artist pages on a large synthetic history.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+from datetime import datetime
+from sqlalchemy import text
+
+# Page sizes of the track lists and of the history when a request asks for none, and the largest allowed
+DEFAULT_TRACKS_PAGE_SIZE = 10
+DEFAULT_PLAYS_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+LISTS = ('solo', 'feature', 'history')
+
+# Plays of the artist's ids in a schema yielded by partitions.routed
+ARTIST_PLAYS = """
+    FROM {schema}.play_artists AS play_artists
+    JOIN {schema}.song_plays AS song_plays ON song_plays.id = play_artists.play_id
+    WHERE play_artists.artist_id IN ({ids})"""
+SOLO = ('((SELECT count(*) FROM {schema}.play_artists AS credits '
+        'WHERE credits.play_id = song_plays.id) = 1)')
+
+# Plays after the cursor (:after_ms, :after_id) of a history page
+PLAYS_AFTER = ('song_plays.timestamp_ms <= :after_ms AND (song_plays.timestamp_ms < :after_ms '
+               'OR song_plays.id < :after_id)')
+# Newest plays scanned per play of a history page before reading the artist's plays through their index
+RECENT_SCAN_FACTOR = 20
+
+SONG_COLUMNS = ('song_plays.track_name, song_plays.album_name, song_plays.artist_name, song_plays.played_duration_ms, '
+                'song_plays.track_duration_ms, song_plays.album_cover_url, song_plays.track_uri, song_plays.timestamp')
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, length):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != length:
+        raise ValueError("Invalid cursor")
+    return key
+
+def artist_ids(conn, name):
+    """Ids of the artist (a Spotify ID and "local:" ids can share a name)"""
+    return [artist_id for artist_id, in conn.execute(text('SELECT id FROM artists WHERE name = :name'), {'name': name})]
+
+def artist_filter(ids):
+    """IN list of `ids` for ARTIST_PLAYS and its parameters"""
+    return ', '.join(f':artist{index}' for index in range(len(ids))), {f'artist{index}': artist_id
+                                                                     for index, artist_id in enumerate(ids)}
+
+def song(row, is_solo=None):
+    """A play or track of the artist as the artist API returns it"""
+    result = {
+        'track_name': row['track_name'],
+        'album_name': row['album_name'],
+        'artist_name': row['artist_name'],
+        'played_duration_ms': row['played_duration_ms'],
+        'track_duration_ms': row['track_duration_ms'],
+        'timestamp': row['timestamp'].replace(' ', 'T') if row['timestamp'] else None,
+        'album_cover': row['album_cover_url'],
+        'track_uri': row['track_uri']
+    }
+    if is_solo is not None:
+        result['is_solo'] = bool(is_solo)
+    return result
+
+def track_groups(conn, ids):
+    """The artist's plays grouped by solo, track and album, from one aggregate
+    query per schema: plays, listened milliseconds and the newest play of each"""
+    from partitions import routed
+
+    groups = {}
+    if not ids:
+        return groups
+    placeholders, params = artist_filter(ids)
+    for schema in routed(conn):
+        # Bare columns come from the newest play of each group (see history.py)
+        for row in conn.execute(text(
+                f"SELECT max(coalesce(song_plays.timestamp_ms, 0)) AS timestamp_ms, "
+                f"{SOLO.format(schema=schema)} AS is_solo, "
+                f"coalesce(song_plays.track_name, '') AS group_track, "
+                f"coalesce(song_plays.album_name, '') AS group_album, "
+                f"count(*) AS plays, coalesce(sum(song_plays.played_duration_ms), 0) AS listened_ms, {SONG_COLUMNS} "
+                f"{ARTIST_PLAYS.format(schema=schema, ids=placeholders)} "
+                f"GROUP BY is_solo, group_track, group_album"), params).mappings():
+            key = (bool(row['is_solo']), row['group_track'], row['group_album'])
+            group = groups.get(key)
+            if group is None:
+                groups[key] = dict(row)
+                continue
+            if group['timestamp_ms'] < row['timestamp_ms']:
+                groups[key] = dict(row, plays=group['plays'], listened_ms=group['listened_ms'])
+                group, row = groups[key], group
+            group['plays'] += row['plays']
+            group['listened_ms'] += row['listened_ms']
+    return groups
+
+def summary(groups):
+    """Solo and feature plays, listened milliseconds and unique tracks of the
+    artist's `track_groups`; a track counts once as solo and once as feature,
+    like the lists"""
+    solo_songs = sum(group['plays'] for (is_solo, _, _), group in groups.items() if is_solo)
+    total_songs = sum(group['plays'] for group in groups.values())
+    return {
+        'solo_songs': solo_songs,
+        'feature_songs': total_songs - solo_songs,
+        'total_listened_ms': sum(group['listened_ms'] for group in groups.values()),
+        'total_songs': total_songs,
+        'unique_tracks': len(groups)
+    }
+
+def tracks(groups, solo, limit=DEFAULT_TRACKS_PAGE_SIZE, cursor=None):
+    """A page of the artist's solo (or feature) tracks of its `track_groups`,
+    most recently played first, and the cursor of the next page"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = tuple(decode_cursor(cursor, 3)) if cursor else None
+    ordered = sorted(((group['timestamp_ms'], track, album) for (is_solo, track, album), group in groups.items()
+                      if is_solo == solo and (not after or (group['timestamp_ms'], track, album) < after)),
+                     reverse=True)
+    page = ordered[:limit]
+    next_cursor = encode_cursor(list(page[-1])) if len(ordered) > limit else None
+    return [song(groups[(solo, track, album)]) for _, track, album in page], next_cursor
+
+def month_end_ms(month):
+    """Epoch milliseconds of the first local midnight after a month (YYYY-MM)"""
+    from models import LOCAL_TZ
+    from partitions import shift_month
+
+    year, number = map(int, shift_month(month, 1).split('-'))
+    return int(LOCAL_TZ.localize(datetime(year, number, 1)).timestamp() * 1000)
+
+def plays(conn, ids, limit=DEFAULT_PLAYS_PAGE_SIZE, cursor=None):
+    """A page of the artist's plays, newest first, and the cursor of the next page
+
+    The newest plays of each schema are scanned first through the timestamp
+    index, which finds a page of an artist that has a good share of the plays
+    after a few rows; when they don't fill the page, the artist's plays are
+    read through the play_artists index instead. Partitions are read newest
+    month first and only until the page is full of plays newer than the next
+    partition's month. Plays without a timestamp are not listed.
+    """
+    from partitions import routed_months
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor, 2) if cursor else None
+    if not ids:
+        return [], None
+    placeholders, params = artist_filter(ids)
+    params.update({'after_ms': after[0] if after else None, 'after_id': after[1] if after else None,
+                   'wanted': limit + 1, 'scanned': (limit + 1) * RECENT_SCAN_FACTOR})
+    condition = f'song_plays.timestamp_ms IS NOT NULL{f" AND {PLAYS_AFTER}" if after else ""}'
+    found = []
+    schemas = routed_months(conn)
+    try:
+        for month, schema in schemas:
+            if month and len(found) > limit and found[limit]['timestamp_ms'] >= month_end_ms(month):
+                # This partition and the older ones only hold older plays
+                break
+            columns = f'song_plays.timestamp_ms, song_plays.id, {SOLO.format(schema=schema)} AS is_solo, {SONG_COLUMNS}'
+            recent = conn.execute(text(
+                f'SELECT {columns} FROM ('
+                f'SELECT id FROM {schema}.song_plays AS song_plays WHERE {condition} '
+                f'ORDER BY timestamp_ms DESC, id DESC LIMIT :scanned) AS recent '
+                f'JOIN {schema}.song_plays AS song_plays ON song_plays.id = recent.id '
+                f'WHERE EXISTS (SELECT 1 FROM {schema}.play_artists AS play_artists '
+                f'WHERE play_artists.play_id = song_plays.id AND play_artists.artist_id IN ({placeholders})) '
+                f'ORDER BY song_plays.timestamp_ms DESC, song_plays.id DESC LIMIT :wanted'), params).mappings().all()
+            if len(recent) <= limit:
+                recent = conn.execute(text(
+                    f'SELECT {columns} {ARTIST_PLAYS.format(schema=schema, ids=placeholders)} '
+                    f'AND {condition} '
+                    f'ORDER BY song_plays.timestamp_ms DESC, song_plays.id DESC LIMIT :wanted'), params).mappings().all()
+            found.extend(dict(row) for row in recent)
+            found.sort(key=lambda row: (row['timestamp_ms'], row['id']), reverse=True)
+            del found[limit + 1:]
+    finally:
+        schemas.close()
+    page = found[:limit]
+    next_cursor = encode_cursor([page[-1]['timestamp_ms'], page[-1]['id']]) if len(found) > limit else None
+    return [song(row, row['is_solo']) for row in page], next_cursor
+
+def songs(session, name, list_name, limit=None, cursor=None):
+    """A page of one of the LISTS of an artist and the cursor of the next page
+
+    Raises ValueError for an unknown list or an invalid cursor.
+    """
+    if list_name not in LISTS:
+        raise ValueError(f"Unknown list '{list_name}', use one of: {', '.join(LISTS)}")
+    conn = session.connection()
+    ids = artist_ids(conn, name)
+    if list_name == 'history':
+        return plays(conn, ids, limit or DEFAULT_PLAYS_PAGE_SIZE, cursor)
+    if cursor:
+        decode_cursor(cursor, 3)
+    return tracks(track_groups(conn, ids), list_name == 'solo', limit or DEFAULT_TRACKS_PAGE_SIZE, cursor)
+
+def artist_page(session, name):
+    """Stats of an artist with the first page of each list and their cursors"""
+    conn = session.connection()
+    ids = artist_ids(conn, name)
+    groups = track_groups(conn, ids)
+    result = dict(summary(groups), artist_name=name, artist_ids=ids)
+    for list_name, (songs_page, next_cursor) in (('solo_songs', tracks(groups, True)),
+                                                 ('feature_songs', tracks(groups, False)),
+                                                 ('full_history', plays(conn, ids))):
+        result[f'{list_name}_list'] = songs_page
+        result[f'{list_name}_cursor'] = next_cursor
+    return result
+
+def benchmark(plays_count, artists=2000):
+    """Time artist pages and later history pages on `plays_count` synthetic plays"""
+    directory = tempfile.mkdtemp(prefix='spotify-artists-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from models import engine, ReadSession
+    from synthetic import generate_history
+
+    with engine.begin() as conn:
+        generate_history(conn, plays_count, artists)
+    print(f"Generated {plays_count} plays")
+
+    session = ReadSession()
+    try:
+        for name in ('Artist 0', 'Artist 10', 'Artist 1000'):
+            started = time.perf_counter()
+            page = artist_page(session, name)
+            elapsed = (time.perf_counter() - started) * 1000
+            cursor, pages = page['full_history_cursor'], []
+            for _ in range(10):
+                if not cursor:
+                    break
+                started = time.perf_counter()
+                _, cursor = songs(session, name, 'history', cursor=cursor)
+                pages.append((time.perf_counter() - started) * 1000)
+            later = f", later history pages {sum(pages) / len(pages):6.1f}ms" if pages else ''
+            print(f"{name:<12} {page['total_songs']:>7} plays: artist page {elapsed:7.1f}ms{later}")
+    finally:
+        session.close()
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Artist pages: stats and paged song lists of one artist")
+    parser.add_argument('--benchmark', action='store_true', help="Time artist pages on a synthetic history")
+    parser.add_argument('--plays', type=int, default=1000000, help="Plays generated by the benchmark")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_usage()
+        sys.exit(1)
+    benchmark(args.plays)
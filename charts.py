@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Aggregates for the charts of the dashboard
+
+Every chart of /api/charts/<name> is computed in SQL from the rollup tables,
+plus the plays that are not rolled up yet (like rollups.chart_stats), so its
+cost follows the number of days in its range rather than the number of plays
+ever recorded, and the response only holds the plotted `labels` and `values`.
+
+Charts over time put their values in buckets of a day, a week (starting on
+Monday) or a month, empty buckets included; `hour` and `weekday` buckets fold
+the range onto the hours of the day and the days of the week.
+
+Run this file with `--benchmark` to time every chart on a large synthetic history.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from rollups import PENDING
+
+# Number of entries of the top charts when a request asks for none, and the most allowed
+DEFAULT_TOP = 10
+MAX_TOP = 50
+
+# Bucket key of each bucket size, on rows with a local_date (and local_hour)
+BUCKETS = {
+    'day': 'local_date',
+    'week': "date(local_date, 'weekday 0', '-6 days')",
+    'month': 'substr(local_date, 1, 7)',
+    'hour': 'local_hour',
+    'weekday': "(CAST(strftime('%w', local_date) AS INTEGER) + 6) % 7"
+}
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Plays, listened milliseconds and completed plays per bucket
+HOURLY = """
+    SELECT {bucket} AS bucket, sum(plays), sum(listened_ms), sum(completed) FROM (
+        SELECT local_date, local_hour, device_name, plays, listened_ms, completed FROM hourly_rollups
+        WHERE local_date BETWEEN :first_day AND :last_day
+        UNION ALL
+        SELECT local_date, local_hour, coalesce(device_name, ''), 1, coalesce(played_duration_ms, 0),
+               coalesce(is_completed, 0)
+        FROM song_plays WHERE {pending} AND local_date BETWEEN :first_day AND :last_day
+    ) GROUP BY bucket"""
+
+# Summed track durations and plays of the tracks with a known duration, per bucket
+DURATIONS = """
+    SELECT {bucket} AS bucket, sum(plays * duration_ms), sum(plays) FROM (
+        SELECT local_date, plays, tracks.duration_ms FROM track_rollups
+        JOIN tracks ON tracks.id = track_rollups.track_id
+        WHERE local_date BETWEEN :first_day AND :last_day AND tracks.duration_ms > 0
+        UNION ALL
+        SELECT local_date, 1, track_duration_ms FROM song_plays
+        WHERE {pending} AND local_date BETWEEN :first_day AND :last_day AND track_duration_ms > 0
+    ) GROUP BY bucket"""
+
+# Plays per artist, grouped by name: an artist can have a Spotify ID and a "local:" id
+ARTISTS = """
+    SELECT {bucket} AS bucket, artists.name, sum(plays) AS total FROM (
+        SELECT local_date, artist_id, plays FROM artist_rollups WHERE local_date BETWEEN :first_day AND :last_day
+        UNION ALL
+        SELECT song_plays.local_date, play_artists.artist_id, 1 FROM song_plays
+        JOIN play_artists ON play_artists.play_id = song_plays.id
+        WHERE {pending} AND song_plays.local_date BETWEEN :first_day AND :last_day
+    ) AS counts JOIN artists ON artists.id = counts.artist_id
+    GROUP BY bucket, artists.name ORDER BY total DESC"""
+
+ALBUMS = """
+    SELECT albums.name, sum(plays) AS total FROM (
+        SELECT track_id, plays FROM track_rollups WHERE local_date BETWEEN :first_day AND :last_day
+        UNION ALL
+        SELECT track_id, 1 FROM song_plays WHERE {pending} AND local_date BETWEEN :first_day AND :last_day
+    ) AS counts JOIN tracks ON tracks.id = counts.track_id JOIN albums ON albums.id = tracks.album_id
+    GROUP BY albums.name ORDER BY total DESC LIMIT :top"""
+
+def bucket_keys(bucket, first_day, last_day):
+    """Keys of every bucket between first_day and last_day, in order"""
+    if bucket == 'hour':
+        return list(range(24))
+    if bucket == 'weekday':
+        return list(range(7))
+    first, last = date.fromisoformat(first_day), date.fromisoformat(last_day)
+    if bucket == 'week':
+        first -= timedelta(days=first.weekday())
+    keys = []
+    while first <= last:
+        if bucket == 'month':
+            keys.append(first.strftime('%Y-%m'))
+            first = (first.replace(day=1) + timedelta(days=32)).replace(day=1)
+        else:
+            keys.append(first.isoformat())
+            first += timedelta(days=7 if bucket == 'week' else 1)
+    return keys
+
+def bucket_labels(bucket, keys):
+    if bucket == 'hour':
+        return [f'{hour}:00' for hour in keys]
+    if bucket == 'weekday':
+        return [WEEKDAYS[day] for day in keys]
+    return keys
+
+def bucketed(conn, sql, params, bucket, value):
+    """Chart of `value(*sums)` for every bucket of the range, 0 where there were no plays"""
+    sums = {key: value(*rest) for key, *rest in conn.execute(
+        text(sql.format(bucket=BUCKETS[bucket], pending=PENDING)), params)}
+    keys = bucket_keys(bucket, params['first_day'], params['last_day'])
+    return {'labels': bucket_labels(bucket, keys), 'values': [sums.get(key, 0) for key in keys]}
+
+def plays_chart(conn, params, bucket):
+    return bucketed(conn, HOURLY, params, bucket, lambda plays, listened_ms, completed: plays)
+
+def listening_time_chart(conn, params, bucket):
+    """Minutes listened"""
+    return bucketed(conn, HOURLY, params, bucket, lambda plays, listened_ms, completed: round(listened_ms / 60000, 1))
+
+def completion_rate_chart(conn, params, bucket):
+    """Percentage of the plays that were completed"""
+    return bucketed(conn, HOURLY, params, bucket,
+                    lambda plays, listened_ms, completed: round(100 * completed / plays, 1) if plays else 0)
+
+def average_duration_chart(conn, params, bucket):
+    """Average length of the tracks played, in minutes"""
+    return bucketed(conn, DURATIONS, params, bucket,
+                    lambda duration_ms, plays: round(duration_ms / plays / 60000, 2) if plays else 0)
+
+def streak_chart(conn, params, bucket):
+    """Days in a row with listening time, on every day of the range"""
+    chart = listening_time_chart(conn, params, bucket)
+    streak, values = 0, []
+    for minutes in chart['values']:
+        streak = streak + 1 if minutes > 0 else 0
+        values.append(streak)
+    return {'labels': chart['labels'], 'values': values}
+
+def devices_chart(conn, params, bucket):
+    rows = conn.execute(text(HOURLY.format(bucket="coalesce(nullif(device_name, ''), 'Unknown')", pending=PENDING)
+                             + ' ORDER BY 2 DESC'), params).all()
+    return {'labels': [row[0] for row in rows], 'values': [row[1] for row in rows]}
+
+def top_artists_chart(conn, params, bucket):
+    rows = conn.execute(text(ARTISTS.format(bucket="''", pending=PENDING) + ' LIMIT :top'), params).all()
+    return {'labels': [row[1] for row in rows], 'values': [row[2] for row in rows]}
+
+def top_albums_chart(conn, params, bucket):
+    rows = conn.execute(text(ALBUMS.format(pending=PENDING)), params).all()
+    return {'labels': [row[0] for row in rows], 'values': [row[1] for row in rows]}
+
+def top_artist_by_weekday_chart(conn, params, bucket):
+    """Plays of the most played artist of each day of the week, and their names in `artists`"""
+    top = {}
+    # Rows come most played first, so the first of each weekday is its top artist
+    for weekday, name, plays in conn.execute(text(ARTISTS.format(bucket=BUCKETS['weekday'], pending=PENDING)), params):
+        top.setdefault(weekday, (name, plays))
+    return {'labels': WEEKDAYS, 'values': [top.get(day, (None, 0))[1] for day in range(7)],
+            'artists': [top.get(day, (None, 0))[0] for day in range(7)]}
+
+# Chart of each name and the buckets it can be split into (None: not split)
+CHARTS = {
+    'plays': (plays_chart, ('day', 'week', 'month', 'hour', 'weekday')),
+    'listening-time': (listening_time_chart, ('day', 'week', 'month', 'hour', 'weekday')),
+    'completion-rate': (completion_rate_chart, ('day', 'week', 'month', 'hour', 'weekday')),
+    'average-duration': (average_duration_chart, ('day', 'week', 'month', 'weekday')),
+    'streak': (streak_chart, ('day',)),
+    'devices': (devices_chart, None),
+    'top-artists': (top_artists_chart, None),
+    'top-albums': (top_albums_chart, None),
+    'top-artist-by-weekday': (top_artist_by_weekday_chart, None)
+}
+
+def first_played_day(conn):
+    """The first local date in the rollups or of a play not rolled up yet"""
+    return conn.execute(text(
+        f'SELECT min((SELECT min(local_date) FROM hourly_rollups), '
+        f'coalesce((SELECT min(local_date) FROM song_plays WHERE {PENDING}), \'9999-12-31\'))')).scalar()
+
+def chart(session, name, first_day=None, last_day=None, bucket='day', top=DEFAULT_TOP):
+    """The labels and values of chart `name` between first_day and last_day
+    (local dates, inclusive; by default from the first play to today)
+
+    Raises KeyError for an unknown chart and ValueError for an invalid date,
+    a bucket the chart can't be split into or a range that ends before it
+    starts.
+    """
+    from models import LOCAL_TZ
+
+    function, buckets = CHARTS[name]
+    if buckets and bucket not in buckets:
+        raise ValueError(f"Chart '{name}' can't be split by '{bucket}', use one of: {', '.join(buckets)}")
+    for day in (first_day, last_day):
+        try:
+            if day:
+                date.fromisoformat(day)
+        except ValueError:
+            raise ValueError(f"Invalid date '{day}', use YYYY-MM-DD")
+    conn = session.connection()
+    last_day = last_day or datetime.now(LOCAL_TZ).strftime('%Y-%m-%d')
+    first_day = first_day or min(first_played_day(conn) or last_day, last_day)
+    if first_day > last_day:
+        raise ValueError(f"The range ends ({last_day}) before it starts ({first_day})")
+    params = {'first_day': first_day, 'last_day': last_day, 'top': max(1, min(top, MAX_TOP))}
+    return dict(function(conn, params, bucket), chart=name, bucket=bucket if buckets else None,
+                **{'from': first_day, 'to': last_day})
+
+def benchmark(plays, repeat=5):
+    """Time every chart over the last 30 days and over all of `plays` synthetic plays"""
+    directory = tempfile.mkdtemp(prefix='spotify-charts-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from models import engine, ReadSession
+    from synthetic import generate_history
+
+    with engine.begin() as conn:
+        generate_history(conn, plays)
+    print(f"Generated {plays} plays")
+
+    session = ReadSession()
+    try:
+        month = (datetime.now() - timedelta(days=29)).strftime('%Y-%m-%d')
+        for name, (_, buckets) in CHARTS.items():
+            for first_day, bucket in [(month, (buckets or ['day'])[0]), (None, (buckets or ['day'])[-1])]:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    result = chart(session, name, first_day, bucket=bucket)
+                    timings.append((time.perf_counter() - started) * 1000)
+                print(f"{name:<22} {'last 30 days' if first_day else 'all time':<13} {bucket if buckets else '':<8}"
+                      f"{min(timings):8.1f}ms, {len(result['values'])} values")
+    finally:
+        session.close()
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregates for the charts of the dashboard")
+    parser.add_argument('--benchmark', action='store_true', help="Time the charts on a synthetic history")
+    parser.add_argument('--plays', type=int, default=1000000, help="Plays generated by the benchmark")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_usage()
+        sys.exit(1)
+    benchmark(args.plays)
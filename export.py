@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Export of the listening history as CSV or NDJSON
+
+`export` yields the file in chunks while it reads the plays from a streaming
+cursor, EXPORT_BATCH_SIZE rows at a time, so /api/export and this script use
+the same memory for a week of plays as for ten years of them. Plays of the
+main database come first, then those of each partition, newest month first;
+each part is ordered by start time.
+
+    python export.py --format ndjson --from 2024-01-01 --gzip > plays.ndjson.gz
+    python export.py --benchmark --plays 1000000
+"""
+
+import io
+import os
+import csv
+import sys
+import json
+import time
+import zlib
+import argparse
+import tempfile
+import tracemalloc
+from sqlalchemy import text
+
+# Rows fetched from the database at a time
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+# Characters collected before a chunk is sent
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+COLUMNS = ['id', 'user_id', 'timestamp_ms', 'local_date', 'local_hour', 'start_time', 'end_time',
+           'track_id', 'track_name', 'artists', 'album_name', 'device_name', 'device_type', 'track_uri',
+           'played_duration_ms', 'track_duration_ms', 'is_completed']
+# Separates the artist names collected by the query
+ARTIST_SEPARATOR = '\x1f'
+
+def plays(session, first_day=None, last_day=None):
+    """Yield the plays between first_day and last_day (local dates, inclusive) as tuples of COLUMNS"""
+    from partitions import routed
+
+    conditions = ['local_date IS NOT NULL']
+    if first_day:
+        conditions.append('local_date >= :first_day')
+    if last_day:
+        conditions.append('local_date <= :last_day')
+    params = {'first_day': first_day, 'last_day': last_day}
+    conn = session.connection()
+    schemas = routed(conn, first_day, last_day)
+    try:
+        for schema in schemas:
+            columns = [f"(SELECT group_concat(name, '{ARTIST_SEPARATOR}') FROM ("
+                       f"SELECT artists.name FROM {schema}.play_artists AS play_artists "
+                       "JOIN main.artists ON artists.id = play_artists.artist_id "
+                       "WHERE play_artists.play_id = song_plays.id ORDER BY play_artists.position))"
+                       if column == 'artists' else f'song_plays.{column}' for column in COLUMNS]
+            result = conn.execute(text(
+                f"SELECT {', '.join(columns)} FROM {schema}.song_plays AS song_plays "
+                f"WHERE {' AND '.join(conditions)} ORDER BY song_plays.timestamp_ms"
+            ).execution_options(yield_per=EXPORT_BATCH_SIZE), params)
+            try:
+                yield from result
+            finally:
+                result.close()
+    finally:
+        # Also when the client goes away in the middle of the export: the
+        # partition is detached before the connection goes back to the pool
+        schemas.close()
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        row = list(row)
+        row[COLUMNS.index('artists')] = ', '.join((row[COLUMNS.index('artists')] or '').split(ARTIST_SEPARATOR))
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_lines(rows):
+    artists = COLUMNS.index('artists')
+    completed = COLUMNS.index('is_completed')
+    lines = []
+    size = 0
+    for row in rows:
+        play = dict(zip(COLUMNS, row))
+        play['artists'] = row[artists].split(ARTIST_SEPARATOR) if row[artists] else []
+        play['is_completed'] = bool(row[completed])
+        line = json.dumps(play, ensure_ascii=False)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines, size = [], 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export(session_factory, format='csv', first_day=None, last_day=None, compress=False):
+    """Yield the export in chunks of bytes, gzip-compressed with `compress`
+
+    The session is opened by the first chunk and closed by the last one, so
+    the generator can be handed to a streaming response.
+    """
+    session = session_factory()
+    rows = plays(session, first_day, last_day)
+    try:
+        lines = (csv_lines if format == 'csv' else ndjson_lines)(rows)
+        if not compress:
+            for chunk in lines:
+                yield chunk.encode('utf-8')
+            return
+        # wbits=31 writes a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in lines:
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        rows.close()
+        session.close()
+
+def filename(format, first_day=None, last_day=None, compress=False):
+    """Download name of an export, e.g. spotify-history-2024-01-01-to-2024-06-30.csv.gz"""
+    name = 'spotify-history'
+    if first_day or last_day:
+        name += f"-{first_day or 'start'}-to-{last_day or 'today'}"
+    return f"{name}.{format}" + ('.gz' if compress else '')
+
+def benchmark(plays_count):
+    """Export `plays_count` synthetic plays in both formats and report time and peak memory"""
+    directory = tempfile.mkdtemp(prefix='spotify-export-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from models import engine, ReadSession
+    from synthetic import generate_history
+
+    with engine.begin() as conn:
+        generate_history(conn, plays_count)
+    print(f"Generated {plays_count} plays")
+
+    for format in FORMATS:
+        for compress in (False, True):
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in export(ReadSession, format, compress=compress))
+            elapsed = time.perf_counter() - started
+            # Again with allocation tracing, which slows Python down too much to time it
+            tracemalloc.start()
+            for _ in export(ReadSession, format, compress=compress):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{filename(format, compress=compress):<26} {size / 1e6:8.1f} MB in {elapsed:5.1f}s, "
+                  f"peak Python memory {peak / 1e6:.1f} MB")
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the listening history as CSV or NDJSON")
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--from', dest='first_day', help="First local date (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='last_day', help="Last local date (YYYY-MM-DD)")
+    parser.add_argument('--gzip', action='store_true', help="Compress the output")
+    parser.add_argument('--benchmark', action='store_true', help="Measure time and memory on synthetic plays")
+    parser.add_argument('--plays', type=int, default=1000000, help="Plays generated by the benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.plays)
+    else:
+        from models import ReadSession
+        for chunk in export(ReadSession, args.format, args.first_day, args.last_day, args.gzip):
+            sys.stdout.buffer.write(chunk)
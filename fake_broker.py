@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Fake message broker
+A local stand-in for the Redis publish/subscribe commands that the web app's
+message queue uses (SOCKETIO_MESSAGE_QUEUE), so several workers of serve.py
+can be run and load-tested without a Redis server. Nothing is stored; a
+message reaches the clients subscribed to its channel at the time.
+
+    python fake_broker.py [--port 6399]
+
+Point the web app at a running fake broker with
+SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6399/0
+"""
+
+import logging
+import argparse
+import threading
+import socketserver
+
+logger = logging.getLogger('fake_broker')
+
+DEFAULT_PORT = 6399
+
+def encode(value, kind=b'*'):
+    """RESP encoding of a reply; lists are sent as arrays, or as pushes
+    (kind b'>') and maps (b'%', of pairs) in RESP3"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if kind == b'%':
+        return b'%%%d\r\n%s' % (len(value), b''.join(encode(key) + encode(item) for key, item in value))
+    return kind + b'%d\r\n%s' % (len(value), b''.join(encode(item) for item in value))
+
+class FakeBrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeBrokerHandler)
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'redis://{self.server_address[0]}:{self.server_address[1]}/0'
+
+    def publish(self, channel, message):
+        """Send a message to the subscribers of a channel; returns their number"""
+        with self.lock:
+            handlers = list(self.subscribers.get(channel, ()))
+        for handler in handlers:
+            handler.send(handler.encode_push([b'message', channel, message]))
+        return len(handlers)
+
+class FakeBrokerHandler(socketserver.StreamRequestHandler):
+    """One client connection: reads commands and answers them"""
+
+    def setup(self):
+        super().setup()
+        self.channels = set()
+        self.send_lock = threading.Lock()
+        # RESP version the client asked for with HELLO
+        self.protocol = 2
+
+    def encode_push(self, value):
+        return encode(value, b'>' if self.protocol == 3 else b'*')
+
+    def send(self, data):
+        try:
+            with self.send_lock:
+                self.wfile.write(data)
+        except OSError:
+            pass
+
+    def read_command(self):
+        """Next command as a list of bytes, or None once the client is gone"""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. typed into telnet
+            return line.split()
+        arguments = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    def handle(self):
+        server = self.server
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name, arguments = command[0].upper(), command[1:]
+                if name == b'SUBSCRIBE':
+                    for channel in arguments:
+                        with server.lock:
+                            server.subscribers.setdefault(channel, set()).add(self)
+                        self.channels.add(channel)
+                        self.send(self.encode_push([b'subscribe', channel, len(self.channels)]))
+                elif name == b'UNSUBSCRIBE':
+                    for channel in arguments or list(self.channels):
+                        with server.lock:
+                            server.subscribers.get(channel, set()).discard(self)
+                        self.channels.discard(channel)
+                        self.send(self.encode_push([b'unsubscribe', channel, len(self.channels)]))
+                elif name == b'PUBLISH' and len(arguments) == 2:
+                    self.send(encode(server.publish(*arguments)))
+                elif name == b'HELLO':
+                    self.protocol = int(arguments[0]) if arguments else self.protocol
+                    info = [(b'server', b'redis'), (b'version', b'7.0.0'), (b'proto', self.protocol),
+                            (b'mode', b'standalone'), (b'role', b'master'), (b'modules', [])]
+                    self.send(encode(info, b'%') if self.protocol == 3 else
+                              encode([item for pair in info for item in pair]))
+                elif name == b'PING':
+                    self.send(self.encode_push([b'pong', b'']) if self.channels else b'+PONG\r\n')
+                elif name in (b'SELECT', b'CLIENT', b'AUTH'):
+                    self.send(b'+OK\r\n')
+                else:
+                    self.send(b"-ERR unknown command '%s'\r\n" % name)
+        except (OSError, ValueError):
+            pass
+        finally:
+            with server.lock:
+                for channel in self.channels:
+                    server.subscribers.get(channel, set()).discard(self)
+
+def start_broker(host='127.0.0.1', port=DEFAULT_PORT):
+    """Start a fake broker on a background thread and return it"""
+    server = FakeBrokerServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Redis publish/subscribe broker for testing and load-testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    server = start_broker(args.host, args.port)
+    print(f"Fake message broker running at {server.url}")
+    print(f"Start the web app with SOCKETIO_MESSAGE_QUEUE={server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Fake Spotify Web API
+A local stand-in for the parts of the Spotify Web API used by tracker.py and
+app.py, so both can be exercised and load-tested without touching Spotify.
+
+    python fake_spotify.py serve [--script session.json | --trace trace.jsonl] [--speed 60]
+    python fake_spotify.py simulate [--script session.json | --trace trace.jsonl] [--hours 24]
+    python fake_spotify.py record trace.jsonl [--interval 5] [--duration 3600]
+
+Point the tracker or the web app at a running fake server with
+SPOTIFY_API_URL=http://127.0.0.1:8099/v1/
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytz
+
+logger = logging.getLogger('fake_spotify')
+
+DEFAULT_PORT = 8099
+
+class VirtualClock:
+    """Seconds since the start of a session, running `speed` times faster than real time"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.offset = 0.0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def now(self):
+        with self.lock:
+            return self.offset + (time.monotonic() - self.started) * self.speed
+
+    def advance(self, seconds):
+        with self.lock:
+            self.offset += seconds
+
+class ManualClock(VirtualClock):
+    """Virtual clock that only moves when advanced explicitly"""
+
+    def __init__(self):
+        super().__init__(speed=0.0)
+
+def make_track(track_id, name, artists, album, duration_ms, release_date='2020-01-01'):
+    """Build a track object shaped like the ones the Spotify API returns"""
+    artist_objects = [{'id': a_id, 'name': a_name, 'uri': f'spotify:artist:{a_id}', 'type': 'artist'}
+                      for a_id, a_name in artists]
+    album_id = "al" + hashlib.md5(album.encode()).hexdigest()[:12]
+    return {
+        'id': track_id,
+        'name': name,
+        'uri': f'spotify:track:{track_id}',
+        'type': 'track',
+        'duration_ms': duration_ms,
+        'artists': artist_objects,
+        'album': {
+            'id': album_id,
+            'name': album,
+            'release_date': release_date,
+            'artists': artist_objects[:1],
+            'images': [
+                {'url': f'https://i.scdn.co/image/{album_id}-640', 'height': 640, 'width': 640},
+                {'url': f'https://i.scdn.co/image/{album_id}-300', 'height': 300, 'width': 300},
+                {'url': f'https://i.scdn.co/image/{album_id}-64', 'height': 64, 'width': 64},
+            ]
+        }
+    }
+
+def generate_catalog(track_count=500, artist_count=60, seed=1):
+    """Generate a synthetic catalog of tracks, including multi-artist features"""
+    rng = random.Random(seed)
+    artists = [(f'ar{i:04d}', f'Artist {i}') for i in range(artist_count)]
+    artists.append(('ar_tyler', 'Tyler, The Creator'))  # Names can contain commas
+    tracks = []
+    for i in range(track_count):
+        credited = [rng.choice(artists)]
+        if rng.random() < 0.25:
+            credited.append(rng.choice(artists))
+        album = f"Album {i // 10} by {credited[0][1]}"
+        tracks.append(make_track(f'tr{i:05d}', f'Track {i}', credited, album,
+                                 rng.randint(120, 320) * 1000, f'{rng.randint(1970, 2025)}-01-01'))
+    return tracks
+
+DEFAULT_DEVICES = [
+    {'id': 'dev-laptop', 'name': 'Laptop', 'type': 'Computer'},
+    {'id': 'dev-phone', 'name': 'Phone', 'type': 'Smartphone'},
+    {'id': 'dev-speaker', 'name': 'Living Room', 'type': 'Speaker'},
+]
+
+def generate_day_script(seed=1, catalog=None):
+    """Script a day of listening: a few sessions with skips, pauses and device switches"""
+    rng = random.Random(seed)
+    catalog = catalog or generate_catalog(seed=seed)
+    events = []
+    for start_hour in sorted(rng.sample(range(7, 23), 5)):
+        at = start_hour * 3600 + rng.randint(0, 1800)
+        events.append({'at': at, 'action': 'play', 'track': rng.choice(catalog)['id'],
+                       'device': rng.choice(DEFAULT_DEVICES)['id']})
+        session_end = at + rng.randint(1800, 3 * 3600)
+        t = at
+        while True:
+            t += rng.randint(60, 600)
+            if t >= session_end:
+                break
+            action = rng.choices(['skip', 'pause', 'transfer'], weights=[6, 2, 1])[0]
+            if action == 'pause':
+                events.append({'at': t, 'action': 'pause'})
+                t += rng.randint(10, 300)
+                events.append({'at': t, 'action': 'resume'})
+            elif action == 'transfer':
+                events.append({'at': t, 'action': 'transfer', 'device': rng.choice(DEFAULT_DEVICES)['id']})
+            else:
+                events.append({'at': t, 'action': 'skip'})
+        events.append({'at': session_end, 'action': 'stop'})
+    return {'devices': DEFAULT_DEVICES, 'events': events, 'seed': seed}
+
+class ScriptedPlayer:
+    """Player state driven by a script of timed events.
+
+    Between events the queue simply plays on: when a track ends the next
+    catalog track starts, until the script pauses or stops playback.
+    """
+
+    def __init__(self, script, catalog=None, epoch=None):
+        self.catalog = catalog or script.get('tracks') or generate_catalog(seed=script.get('seed', 1))
+        self.by_id = {t['id']: t for t in self.catalog}
+        self.by_uri = {t['uri']: t for t in self.catalog}
+        self.devices = script.get('devices') or DEFAULT_DEVICES
+        self.events = sorted(script.get('events', []), key=lambda e: e['at'])
+        self.next_event = 0
+        self.epoch = epoch if epoch is not None else time.time()
+        self.index = None  # Position in the catalog of the current track
+        self.device = self.devices[0]
+        self.is_playing = False
+        self.position_ms = 0.0
+        self.anchor = 0.0  # Virtual time at which position_ms was recorded
+        self.rate_limited_until = 0.0
+        self.lock = threading.Lock()
+
+    def _position(self, now):
+        if self.is_playing:
+            return self.position_ms + (now - self.anchor) * 1000
+        return self.position_ms
+
+    def _start(self, index, at):
+        self.index = index % len(self.catalog)
+        self.position_ms = 0.0
+        self.anchor = at
+        self.is_playing = True
+
+    def _play_on(self, until):
+        """Let the queue play until `until`, starting the next track whenever one ends"""
+        while self.index is not None and self.is_playing:
+            duration = self.catalog[self.index]['duration_ms']
+            ends_at = self.anchor + (duration - self.position_ms) / 1000
+            if ends_at > until:
+                return
+            self._start(self.index + 1, ends_at)
+
+    def _apply(self, event, at):
+        action = event['action']
+        if action == 'play':
+            track = self.by_id.get(event.get('track')) or self.by_uri.get(event.get('uri'))
+            index = self.catalog.index(track) if track else (self.index or 0) + 1
+            self._transfer(event.get('device'))
+            self._start(index, at)
+        elif action == 'pause' and self.index is not None:
+            self.position_ms = self._position(at)
+            self.anchor = at
+            self.is_playing = False
+        elif action == 'resume' and self.index is not None:
+            self.anchor = at
+            self.is_playing = True
+        elif action == 'skip' and self.index is not None:
+            self._start(self.index + 1, at)
+        elif action == 'seek' and self.index is not None:
+            self.position_ms = float(event.get('position_ms', 0))
+            self.anchor = at
+        elif action == 'transfer':
+            self._transfer(event.get('device'))
+        elif action == 'stop':
+            self.index = None
+            self.is_playing = False
+        elif action == 'rate_limit':
+            self.rate_limited_until = at + event.get('seconds', 30)
+
+    def _transfer(self, device_id):
+        if device_id:
+            self.device = next((d for d in self.devices if d['id'] == device_id), self.device)
+
+    def sync(self, now):
+        """Apply every scripted event up to `now`"""
+        while self.next_event < len(self.events) and self.events[self.next_event]['at'] <= now:
+            event = self.events[self.next_event]
+            self._play_on(event['at'])
+            self._apply(event, event['at'])
+            self.next_event += 1
+        self._play_on(now)
+
+    def command(self, event, now):
+        """Apply a command received through the API (play, pause, ...)"""
+        with self.lock:
+            self.sync(now)
+            self._apply(event, now)
+
+    def retry_after(self, now):
+        """Seconds until an injected rate limit ends, or None"""
+        if now < self.rate_limited_until:
+            return int(self.rate_limited_until - now) + 1
+        return None
+
+    def playback(self, now):
+        """The `current_playback()` response at virtual time `now`"""
+        with self.lock:
+            self.sync(now)
+            if self.index is None:
+                return None
+            track = self.catalog[self.index]
+            return {
+                'device': dict(self.device, is_active=True, is_private_session=False,
+                               is_restricted=False, volume_percent=70),
+                'shuffle_state': False,
+                'repeat_state': 'off',
+                'timestamp': int((self.epoch + now) * 1000),
+                'context': None,
+                'progress_ms': int(min(self._position(now), track['duration_ms'])),
+                'item': track,
+                'currently_playing_type': 'track',
+                'actions': {'disallows': {}},
+                'is_playing': self.is_playing
+            }
+
+    def active_device_id(self):
+        return self.device['id'] if self.index is not None else None
+
+def load_trace(path):
+    """Load a recorded trace: one JSON object per line with `t` (seconds) and `playback`"""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda e: e['t'])
+    return entries
+
+class TracePlayer(ScriptedPlayer):
+    """Replays a recorded `current_playback` trace, extrapolating progress between samples"""
+
+    def __init__(self, entries, epoch=None):
+        catalog = []
+        seen = set()
+        for entry in entries:
+            item = (entry.get('playback') or {}).get('item')
+            if item and item['id'] not in seen:
+                seen.add(item['id'])
+                catalog.append(item)
+        devices = []
+        for entry in entries:
+            device = (entry.get('playback') or {}).get('device')
+            if device and device.get('id') not in [d['id'] for d in devices]:
+                devices.append({k: device.get(k) for k in ('id', 'name', 'type')})
+        super().__init__({'devices': devices or DEFAULT_DEVICES}, catalog=catalog or generate_catalog(), epoch=epoch)
+        self.entries = entries
+        self.times = [e['t'] for e in entries]
+
+    def playback(self, now):
+        i = bisect.bisect_right(self.times, now) - 1
+        if i < 0 or not self.entries[i].get('playback'):
+            return None
+        entry = self.entries[i]
+        playback = json.loads(json.dumps(entry['playback']))
+        if playback.get('is_playing') and playback.get('item'):
+            progress = playback.get('progress_ms', 0) + (now - entry['t']) * 1000
+            playback['progress_ms'] = int(min(progress, playback['item']['duration_ms']))
+        playback['timestamp'] = int((self.epoch + now) * 1000)
+        return playback
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, player, clock):
+        super().__init__(address, FakeSpotifyHandler)
+        self.player = player
+        self.clock = clock
+        self.request_counts = {}
+        self.counts_lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self.counts_lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this keep-alive
+    # requests stall on Nagle's algorithm and delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message):
+        self._send(status, {'error': {'status': status, 'message': message}})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _route(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        now = server.clock.now()
+        player = server.player
+        server.count(f"{method} {path}")
+
+        if path.startswith('/_fake'):
+            return self._control(method, path, query)
+
+        retry_after = player.retry_after(now)
+        if retry_after is not None:
+            return self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                              {'Retry-After': retry_after})
+
+        if method == 'GET' and path in ('/v1/me/player', '/v1/me/player/currently-playing'):
+            playback = player.playback(now)
+            return self._send(200, playback) if playback else self._send(204)
+        if method == 'GET' and path == '/v1/me/player/devices':
+            active = player.active_device_id()
+            return self._send(200, {'devices': [dict(d, is_active=d['id'] == active, volume_percent=70)
+                                                for d in player.devices]})
+        if method == 'PUT' and path == '/v1/me/player/play':
+            body = self._body()
+            uris = body.get('uris') or []
+            event = {'action': 'play', 'uri': uris[0], 'device': query.get('device_id')} if uris else {'action': 'resume'}
+            player.command(event, now)
+            return self._send(204)
+        if method == 'PUT' and path == '/v1/me/player/pause':
+            player.command({'action': 'pause'}, now)
+            return self._send(204)
+        if method == 'POST' and path == '/v1/me/player/next':
+            player.command({'action': 'skip'}, now)
+            return self._send(204)
+        if method == 'PUT' and path == '/v1/me/player':
+            device_ids = self._body().get('device_ids') or []
+            player.command({'action': 'transfer', 'device': device_ids[0] if device_ids else None}, now)
+            return self._send(204)
+        if method == 'GET' and path == '/v1/search':
+            return self._send(200, self._search(query))
+        if method == 'GET' and path.startswith('/v1/artists/'):
+            artist = self._artist(path.rsplit('/', 1)[1])
+            return self._send(200, artist) if artist else self._error(404, 'non existing id')
+        if method == 'GET' and path == '/v1/artists':
+            ids = query.get('ids', '').split(',')
+            return self._send(200, {'artists': [self._artist(i) for i in ids]})
+        if method == 'GET' and path == '/v1/me':
+            return self._send(200, {'id': 'fake-user', 'display_name': 'Fake User', 'type': 'user'})
+        return self._error(404, 'Service not found')
+
+    def _artists(self):
+        artists = {}
+        for track in self.server.player.catalog:
+            for artist in track['artists']:
+                artists.setdefault(artist['id'], artist)
+        return artists
+
+    def _artist(self, artist_id):
+        artist = self._artists().get(artist_id)
+        if not artist:
+            return None
+        return dict(artist, popularity=50, genres=[], followers={'total': 1000},
+                    images=[{'url': f'https://i.scdn.co/image/{artist_id}-640', 'height': 640, 'width': 640}])
+
+    def _search(self, query):
+        q = query.get('q', '').replace('"', '').lower()
+        for prefix in ('track:', 'artist:'):
+            q = q.replace(prefix, '')
+        terms = q.split()
+        limit = int(query.get('limit', 10))
+        types = query.get('type', 'track').split(',')
+        result = {}
+        if 'track' in types:
+            matches = [t for t in self.server.player.catalog
+                       if all(term in (t['name'] + ' ' + ' '.join(a['name'] for a in t['artists'])).lower()
+                              for term in terms)]
+            result['tracks'] = {'items': matches[:limit], 'total': len(matches), 'limit': limit, 'offset': 0}
+        if 'artist' in types:
+            matches = [self._artist(a_id) for a_id, a in self._artists().items()
+                       if all(term in a['name'].lower() for term in terms)]
+            result['artists'] = {'items': matches[:limit], 'total': len(matches), 'limit': limit, 'offset': 0}
+        return result
+
+    def _control(self, method, path, query):
+        """Endpoints for driving the fake server itself"""
+        server = self.server
+        if path == '/_fake/stats':
+            return self._send(200, {'virtual_time': server.clock.now(), 'requests': server.request_counts})
+        if path == '/_fake/advance' and method == 'POST':
+            server.clock.advance(float(query.get('seconds', 0)))
+            return self._send(200, {'virtual_time': server.clock.now()})
+        if path == '/_fake/command' and method == 'POST':
+            server.player.command(self._body(), server.clock.now())
+            return self._send(204)
+        return self._error(404, 'Unknown control endpoint')
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_POST(self):
+        self._route('POST')
+
+def start_server(player, clock, host='127.0.0.1', port=DEFAULT_PORT):
+    """Start a fake API server on a background thread and return it"""
+    server = FakeSpotifyServer((host, port), player, clock)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def build_player(args, epoch=None):
+    if args.trace:
+        return TracePlayer(load_trace(args.trace), epoch=epoch)
+    if args.script:
+        with open(args.script) as f:
+            return ScriptedPlayer(json.load(f), epoch=epoch)
+    return ScriptedPlayer(generate_day_script(seed=args.seed), epoch=epoch)
+
+def simulate(args):
+    """Run the real PlayTracker and PollScheduler against the fake API on a
+    virtual clock, so a day of listening takes seconds instead of a day"""
+    # The simulation writes to its own database unless told otherwise
+    db_path = os.path.join(tempfile.mkdtemp(prefix='spotify-sim-'), 'simulation.db')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{db_path}')
+
+    local_tz = pytz.timezone(os.getenv('TIMEZONE', 'Europe/Berlin'))
+    midnight = local_tz.localize(datetime.combine(datetime.now(local_tz).date() - timedelta(days=1), datetime.min.time()))
+    clock = ManualClock()
+    player = build_player(args, epoch=midnight.timestamp())
+    server = start_server(player, clock, port=0)
+    os.environ['SPOTIFY_API_URL'] = server.api_url
+
+    # Imported here so DATABASE_URL is set before the engine is created
+    from spotify_client import create_spotify
+    from tracker import PlayTracker
+    from scheduler import PollScheduler
+    from models import Session, SongPlay
+
+    sp = create_spotify()
+    tracker = PlayTracker(clock=clock.now, wall_clock=lambda: midnight + timedelta(seconds=clock.now()))
+    scheduler = PollScheduler(clock=clock.now, rng=random.Random(args.seed).random)
+
+    end = args.hours * 3600
+    started = time.perf_counter()
+    while clock.now() < end:
+        try:
+            playback = sp.current_playback()
+            tracker.handle_playback(playback)
+            delay = scheduler.after_playback(playback)
+        except Exception as e:
+            delay = scheduler.after_error(e)
+        clock.advance(delay)
+    tracker.checkpoint()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    session = Session()
+    try:
+        plays = session.query(SongPlay).count()
+        completed = session.query(SongPlay).filter(SongPlay.is_completed == True).count()
+    finally:
+        session.close()
+
+    stats = scheduler.stats()
+    print(f"Simulated {args.hours}h of listening in {elapsed:.2f}s ({end / elapsed:.0f}x real time)")
+    print(f"API calls:       {stats['calls']} (fixed 5s loop: {stats['baseline_calls']}, saved {stats['saved_percentage']}%)")
+    print(f"Database writes: {tracker.writes}")
+    print(f"Plays recorded:  {plays} ({completed} completed)")
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+def serve(args):
+    clock = VirtualClock(speed=args.speed)
+    player = build_player(args)
+    server = start_server(player, clock, host=args.host, port=args.port)
+    print(f"Fake Spotify API running at {server.api_url} ({args.speed}x real time)")
+    print(f"Start the tracker or web app with SPOTIFY_API_URL={server.api_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def record(args):
+    """Record the real `current_playback()` responses into a trace file"""
+    from spotify_client import create_spotify
+    sp = create_spotify()
+    started = time.monotonic()
+    with open(args.output, 'a') as f:
+        while time.monotonic() - started < args.duration:
+            t = time.monotonic() - started
+            try:
+                f.write(json.dumps({'t': round(t, 3), 'playback': sp.current_playback()}) + '\n')
+                f.flush()
+            except Exception as e:
+                logger.error(f"❌ Error recording playback: {e}")
+            time.sleep(args.interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Spotify Web API for testing and load-testing")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('serve', 'simulate'):
+        command = commands.add_parser(name)
+        source = command.add_mutually_exclusive_group()
+        source.add_argument('--script', help="JSON listening script (devices, tracks, timed events)")
+        source.add_argument('--trace', help="Recorded current_playback trace (JSON lines)")
+        command.add_argument('--seed', type=int, default=1, help="Seed of the generated day when no script is given")
+    commands.choices['serve'].add_argument('--host', default='127.0.0.1')
+    commands.choices['serve'].add_argument('--port', type=int, default=DEFAULT_PORT)
+    commands.choices['serve'].add_argument('--speed', type=float, default=1.0, help="Virtual seconds per real second")
+    commands.choices['simulate'].add_argument('--hours', type=float, default=24)
+
+    record_command = commands.add_parser('record')
+    record_command.add_argument('output')
+    record_command.add_argument('--interval', type=float, default=5)
+    record_command.add_argument('--duration', type=float, default=3600)
+
+    args = parser.parse_args(argv)
+    {'serve': serve, 'simulate': simulate, 'record': record}[args.command](args)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Pages of the listening history
+
+The history table shows one row per track, album and local day: the plays of
+a track on one day are grouped with GROUP BY, taking the device, times and
+duration of the newest play (SQLite takes bare columns from the row that
+max() picked). `page` returns one page of those groups, sorted and filtered
+in SQL, and an opaque cursor for the next page.
+
+Sorted by time or date, pages are read from windows of days going back from
+the cursor, doubling in length until a page is full, so a page costs the
+same in a month-old history as in a ten-year-old one; only the partitions of
+the window's months are attached. Other sorts group every play of their
+range on each page, so their range is at most MAX_SORTED_DAYS days: the last
+ones of the history unless `from`/`to` pick others.
+
+`changed_songs` returns only the groups whose plays were inserted or
+updated after a change sequence number (see migrations.add_change_sequence),
+so clients that hold the history can keep it current with small deltas.
+
+Run this file with `--benchmark` to time pages on a large synthetic history.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+
+# Page size when a request asks for none, and the largest one allowed
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Length of the first window of days read for a page sorted by time
+FIRST_WINDOW_DAYS = 7
+# Most days a delta of changed groups is built for; beyond that (e.g. after
+# an import) clients reload the history
+MAX_CHANGED_DAYS = 31
+# Most days a page sorted by something other than time covers
+MAX_SORTED_DAYS = 366
+
+ARTIST_SEPARATOR = '\x1f'
+
+# Sort expression of each sortable column, on the grouped rows
+SORTS = {
+    'timestamp': 'timestamp_ms',
+    'date': 'local_date',
+    'track_name': 'lower(group_track)',
+    'album_name': 'lower(group_album)',
+    'artist_name': "lower(coalesce(artist_name, ''))",
+    'device_name': "lower(coalesce(device_name, ''))",
+    'device_type': "lower(coalesce(device_type, ''))",
+    'start_time': "coalesce(start_time, '')",
+    'end_time': "coalesce(end_time, '')",
+    'played_duration_ms': 'coalesce(played_duration_ms, 0)'
+}
+# Sorts whose order follows the local date, which are read in windows of days
+BY_DAY = ('timestamp', 'date')
+
+GROUPS = """
+    SELECT * FROM (
+        SELECT {sort} AS sort_key, * FROM (
+            SELECT max(song_plays.timestamp_ms) AS timestamp_ms, song_plays.local_date,
+                   coalesce(song_plays.track_name, '') AS group_track,
+                   coalesce(song_plays.album_name, '') AS group_album,
+                   song_plays.track_name, song_plays.album_name, song_plays.artist_name,
+                   song_plays.device_name, song_plays.device_type, song_plays.album_cover_url,
+                   song_plays.track_uri, song_plays.played_duration_ms, song_plays.track_duration_ms,
+                   song_plays.is_completed, song_plays.start_time, song_plays.end_time, count(*) AS plays
+            FROM {schema}.song_plays AS song_plays
+            WHERE {where}
+            GROUP BY song_plays.local_date, group_track, group_album
+        )
+    )
+    {after}
+    ORDER BY sort_key {direction}, local_date {direction}, group_track {direction}, group_album {direction}
+    {limit}"""
+
+# Artists of every play of a group, newest play first, in the order Spotify lists them
+GROUP_ARTISTS = """
+    SELECT group_concat(name, '{separator}') FROM (
+        SELECT artists.name FROM {schema}.song_plays AS song_plays
+        JOIN {schema}.play_artists AS play_artists ON play_artists.play_id = song_plays.id
+        JOIN main.artists ON artists.id = play_artists.artist_id
+        WHERE song_plays.local_date = :local_date AND coalesce(song_plays.track_name, '') = :group_track
+        AND coalesce(song_plays.album_name, '') = :group_album
+        ORDER BY song_plays.timestamp_ms DESC, play_artists.position)"""
+
+# Artists of the plays matching {where}, by group, in the order of GROUP_ARTISTS
+ALL_ARTISTS = """
+    SELECT song_plays.local_date, coalesce(song_plays.track_name, ''), coalesce(song_plays.album_name, ''),
+           artists.name
+    FROM {schema}.song_plays AS song_plays
+    JOIN {schema}.play_artists AS play_artists ON play_artists.play_id = song_plays.id
+    JOIN main.artists ON artists.id = play_artists.artist_id
+    WHERE {where}
+    ORDER BY song_plays.timestamp_ms DESC, play_artists.position"""
+
+def encode_cursor(row):
+    key = [row['sort_key'], row['local_date'], row['group_track'], row['group_album']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != 4:
+        raise ValueError("Invalid cursor")
+    return key
+
+def contains(value):
+    """LIKE pattern matching `value` anywhere, with its wildcards escaped"""
+    return '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def play_filters(first_day=None, last_day=None, artist=None, album=None, device=None, completed=None, query=None):
+    """WHERE conditions on song_plays and their parameters; {schema} in them
+    is the schema the plays are read from"""
+    conditions, params = ['song_plays.local_date IS NOT NULL'], {}
+    if first_day:
+        conditions.append('song_plays.local_date >= :first_day')
+        params['first_day'] = first_day
+    if last_day:
+        conditions.append('song_plays.local_date <= :last_day')
+        params['last_day'] = last_day
+    if artist:
+        # Any artist of the play, featured ones included
+        conditions.append("(song_plays.artist_name LIKE :artist ESCAPE '\\' OR EXISTS ("
+                          "SELECT 1 FROM {schema}.play_artists AS play_artists "
+                          "JOIN main.artists ON artists.id = play_artists.artist_id "
+                          "WHERE play_artists.play_id = song_plays.id AND artists.name LIKE :artist ESCAPE '\\'))")
+        params['artist'] = contains(artist)
+    if album:
+        conditions.append("song_plays.album_name LIKE :album ESCAPE '\\'")
+        params['album'] = contains(album)
+    if device:
+        conditions.append('song_plays.device_name = :device')
+        params['device'] = device
+    if completed is not None:
+        conditions.append('song_plays.is_completed = :completed')
+        params['completed'] = bool(completed)
+    if query:
+        conditions.append('(' + ' OR '.join(f"song_plays.{column} LIKE :query ESCAPE '\\'" for column in (
+            'track_name', 'artist_name', 'album_name', 'device_name', 'device_type', 'local_date')) + ')')
+        params['query'] = contains(query)
+    return conditions, params
+
+def date_bounds(conn):
+    """First and last local date with plays, in the main database or a partition"""
+    from partitions import shift_month
+    # Two subqueries, so each is a single index lookup
+    first_day, last_day = conn.execute(text(
+        'SELECT (SELECT min(local_date) FROM song_plays), (SELECT max(local_date) FROM song_plays)')).one()
+    first_month, last_month = conn.execute(text(
+        'SELECT min(month), max(month) FROM play_partitions WHERE dropped_at IS NULL')).one()
+    if first_month:
+        first_day = min(filter(None, [first_day, f'{first_month}-01']))
+        last_day = max(filter(None, [last_day, (date.fromisoformat(f'{shift_month(last_month, 1)}-01')
+                                                - timedelta(days=1)).isoformat()]))
+    return first_day, last_day
+
+def sorted_range(conn, sort, first_day=None, last_day=None):
+    """First and last local date of the plays a page sorted by `sort` covers
+
+    Sorted by time or date, that is first_day..last_day. Other sorts cover at
+    most MAX_SORTED_DAYS days of the history, the last ones unless first_day
+    is given; a longer range raises ValueError.
+    """
+    if sort in BY_DAY:
+        return first_day, last_day
+    history_first, history_last = date_bounds(conn)
+    if not history_first:
+        return first_day, last_day
+    last = min(last_day or history_last, history_last)
+    first = max(first_day or history_first, history_first)
+    if first > last:
+        return first_day, last_day
+    earliest = (date.fromisoformat(last) - timedelta(days=MAX_SORTED_DAYS - 1)).isoformat()
+    if first_day and first < earliest:
+        raise ValueError(f"Sorted by {sort}, the history covers at most {MAX_SORTED_DAYS} days; "
+                         f"narrow the range with from/to")
+    return max(first, earliest), last
+
+def windows(first_day, last_day, descending, start=None):
+    """(first, last) day ranges from `start` towards the end of first_day..last_day
+    in the direction of the sort, each twice as long as the one before"""
+    first, last = date.fromisoformat(first_day), date.fromisoformat(last_day)
+    if start:
+        start = date.fromisoformat(start)
+        first, last = (first, min(last, start)) if descending else (max(first, start), last)
+    length = FIRST_WINDOW_DAYS
+    while first <= last:
+        if descending:
+            window_first = max(first, last - timedelta(days=length - 1))
+            yield window_first.isoformat(), last.isoformat()
+            last = window_first - timedelta(days=1)
+        else:
+            window_last = min(last, first + timedelta(days=length - 1))
+            yield first.isoformat(), window_last.isoformat()
+            first = window_last + timedelta(days=1)
+        length *= 2
+
+def groups(conn, sort, descending, conditions, params, after=None, limit=None):
+    """Groups matching `conditions` in every schema of their date range,
+    sorted, after the cursor key `after`, at most `limit` of them"""
+    from partitions import routed
+
+    direction = 'DESC' if descending else 'ASC'
+    params = dict(params)
+    after_condition = ''
+    if after:
+        after_condition = (f"WHERE (sort_key, local_date, group_track, group_album) "
+                           f"{'<' if descending else '>'} (:after0, :after1, :after2, :after3)")
+        params.update({f'after{index}': value for index, value in enumerate(after)})
+    rows = {}
+    for schema in routed(conn, params.get('first_day'), params.get('last_day')):
+        where = ' AND '.join(conditions).format(schema=schema)
+        sql = GROUPS.format(sort=SORTS[sort], schema=schema, where=where, after=after_condition,
+                            direction=direction, limit=f'LIMIT {int(limit)}' if limit else '')
+        found = [dict(row) for row in conn.execute(text(sql), params).mappings()]
+        if limit:
+            for row in found:
+                row['artists'] = conn.execute(text(GROUP_ARTISTS.format(separator=ARTIST_SEPARATOR, schema=schema)),
+                                              row).scalar()
+        else:
+            # All groups of the range: their artists in one pass over it
+            artists = {}
+            for key in conn.execute(text(ALL_ARTISTS.format(schema=schema, where=where)), params):
+                artists.setdefault(tuple(key[:3]), []).append(key[3])
+            for row in found:
+                row['artists'] = ARTIST_SEPARATOR.join(
+                    artists.get((row['local_date'], row['group_track'], row['group_album']), []))
+        for row in found:
+            key = (row['local_date'], row['group_track'], row['group_album'])
+            # A day whose plays were only partly moved to a partition
+            if key in rows:
+                newer, older = sorted([rows[key], row], key=lambda group: -(group['timestamp_ms'] or 0))
+                newer['plays'] += older['plays']
+                newer['artists'] = ARTIST_SEPARATOR.join(filter(None, [newer['artists'], older['artists']]))
+                row = newer
+            rows[key] = row
+    ordered = sorted(rows.values(), key=lambda row: (row['sort_key'], row['local_date'], row['group_track'],
+                                                     row['group_album']), reverse=descending)
+    return ordered[:limit] if limit else ordered
+
+def song(row):
+    """A group as the history API returns it"""
+    from models import LOCAL_TZ
+
+    artists = list(dict.fromkeys((row['artists'] or '').split(ARTIST_SEPARATOR))) if row['artists'] else []
+    if not artists and row['artist_name']:
+        artists = [row['artist_name']]
+    timestamp = datetime.fromtimestamp(row['timestamp_ms'] / 1000, LOCAL_TZ) if row['timestamp_ms'] else None
+    return {
+        'track_name': row['track_name'],
+        'artist_name': ', '.join(artists),
+        'artists': artists,
+        'album_name': row['album_name'],
+        'device_name': row['device_name'],
+        'device_type': row['device_type'],
+        'timestamp': timestamp,  # serialized to ISO 8601 by the JSON provider
+        'date': row['local_date'],
+        'album_cover': row['album_cover_url'],
+        'track_uri': row['track_uri'],
+        'played_duration_ms': row['played_duration_ms'],
+        'track_duration_ms': row['track_duration_ms'],
+        'is_completed': bool(row['is_completed']),
+        'start_time': row['start_time'].replace(' ', 'T') if row['start_time'] else None,
+        'end_time': row['end_time'].replace(' ', 'T') if row['end_time'] else None,
+        'plays': row['plays']
+    }
+
+def page(session, limit=DEFAULT_PAGE_SIZE, cursor=None, sort='timestamp', direction='desc', **filters):
+    """One page of the grouped history, the cursor of the next page (None
+    after the last one) and the first and last local date the page covers
+
+    `filters` are those of `play_filters`; sorts other than by time only
+    cover the range of `sorted_range`. Raises ValueError for an unknown sort
+    column or direction, an invalid date or range, or an invalid cursor.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    if direction not in ('asc', 'desc'):
+        raise ValueError(f"Unknown sort direction '{direction}'")
+    for bound in ('first_day', 'last_day'):
+        if filters.get(bound):
+            try:
+                # Compared as YYYY-MM-DD strings in SQL
+                filters[bound] = date.fromisoformat(filters[bound]).isoformat()
+            except ValueError:
+                raise ValueError(f"Invalid date '{filters[bound]}', use YYYY-MM-DD")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    descending = direction == 'desc'
+    after = decode_cursor(cursor) if cursor else None
+    conn = session.connection()
+    filters['first_day'], filters['last_day'] = sorted_range(conn, sort, filters.get('first_day'),
+                                                             filters.get('last_day'))
+    conditions, params = play_filters(**filters)
+
+    # One extra group tells whether there is a next page
+    wanted = limit + 1
+    if sort in BY_DAY:
+        first_day, last_day = date_bounds(conn)
+        found = []
+        if first_day:
+            first_day = max(first_day, filters.get('first_day') or first_day)
+            last_day = min(last_day, filters.get('last_day') or last_day)
+            for window_first, window_last in windows(first_day, last_day, descending, after[1] if after else None):
+                found.extend(groups(conn, sort, descending, conditions + [
+                    'song_plays.local_date BETWEEN :window_first AND :window_last'],
+                    dict(params, first_day=window_first, last_day=window_last,
+                         window_first=window_first, window_last=window_last), after, wanted - len(found)))
+                if len(found) >= wanted:
+                    break
+    else:
+        found = groups(conn, sort, descending, conditions, params, after, wanted)
+
+    rows = found[:limit]
+    next_cursor = encode_cursor(rows[-1]) if len(found) > limit else None
+    return [song(row) for row in rows], next_cursor, (filters.get('first_day'), filters.get('last_day'))
+
+def all_songs(session, first_day=None):
+    """Every group since `first_day`, newest first"""
+    conditions, params = play_filters(first_day=first_day)
+    return [song(row) for row in groups(session.connection(), 'timestamp', True, conditions, params)]
+
+def version(conn):
+    """(change sequence, dropped partitions) - changes whenever a group of the
+    history does, for the ETag of /api/history"""
+    return conn.execute(text(
+        'SELECT (SELECT value FROM change_sequence), '
+        '(SELECT count(*) FROM play_partitions WHERE dropped_at IS NOT NULL)')).one()
+
+def changed_songs(session, since, first_day=None):
+    """The groups with a play inserted or updated after the change sequence
+    `since`, newest first, or None if they span more than MAX_CHANGED_DAYS days
+
+    Only plays of the main database change; their groups are read from every
+    schema, like those of `all_songs`.
+    """
+    conn = session.connection()
+    keys = set(tuple(key) for key in conn.execute(text(
+        "SELECT DISTINCT local_date, coalesce(track_name, ''), coalesce(album_name, '') FROM song_plays "
+        'WHERE change_seq > :since AND local_date >= :first_day'), {'since': since, 'first_day': first_day or ''}))
+    days = sorted({key[0] for key in keys})
+    if len(days) > MAX_CHANGED_DAYS:
+        return None
+    if not days:
+        return []
+    conditions, params = play_filters(first_day=days[0], last_day=days[-1])
+    conditions.append(f"song_plays.local_date IN ({', '.join(f':day{index}' for index in range(len(days)))})")
+    params.update({f'day{index}': day for index, day in enumerate(days)})
+    return [song(row) for row in groups(conn, 'timestamp', True, conditions, params)
+            if (row['local_date'], row['group_track'], row['group_album']) in keys]
+
+def benchmark(plays, pages=50):
+    """Time the first and later pages of each sort on `plays` synthetic plays"""
+    directory = tempfile.mkdtemp(prefix='spotify-history-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from models import engine, ReadSession
+    from synthetic import generate_history
+
+    with engine.begin() as conn:
+        last = generate_history(conn, plays)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('ANALYZE')
+    print(f"Generated {plays} plays")
+
+    session = ReadSession()
+    try:
+        for sort, filters in [('timestamp', {}), ('timestamp', {'artist': 'Artist 7'}),
+                              ('track_name', {}), ('track_name', {'first_day': last['start_time'].strftime('%Y-%m-01')})]:
+            timings, cursor = [], None
+            for _ in range(pages):
+                started = time.perf_counter()
+                songs, cursor, _ = page(session, 50, cursor, sort, **filters)
+                timings.append((time.perf_counter() - started) * 1000)
+                if not cursor:
+                    break
+            first = timings[0]
+            timings.sort()
+            print(f"{sort:<12} {json.dumps(filters):<28} first page {first:7.1f}ms, "
+                  f"median {timings[len(timings) // 2]:7.1f}ms over {len(timings)} pages")
+    finally:
+        session.close()
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pages of the listening history")
+    parser.add_argument('--benchmark', action='store_true', help="Time pages on a synthetic history")
+    parser.add_argument('--plays', type=int, default=1000000, help="Plays generated by the benchmark")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_usage()
+        sys.exit(1)
+    benchmark(args.plays)
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Import of Spotify's extended streaming history
+
+Spotify's data export ("Extended streaming history") contains
+Streaming_History_Audio_*.json files, each a JSON array of plays. They are
+read with an incremental parser, so even an export of several GB never sits in
+memory, and inserted in large batches, IMPORT_TRANSACTION_SIZE plays per
+transaction. Plays that are already in the database, recorded by the tracker
+or by an earlier import, are skipped.
+
+    python import_history.py my_spotify_data.zip
+    python import_history.py "Spotify Extended Streaming History" --account alice
+    python import_history.py --benchmark --records 1000000
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import glob
+import fnmatch
+import time
+import random
+import logging
+import zipfile
+import argparse
+import functools
+import tempfile
+from datetime import datetime, timedelta
+import pytz
+from sqlalchemy import text
+from search import index_tracks
+import rollups
+
+logger = logging.getLogger('import_history')
+
+# Plays inserted per executemany
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 10000))
+# Records per transaction; the tracker waits for the database while one commits
+IMPORT_TRANSACTION_SIZE = int(os.getenv('IMPORT_TRANSACTION_SIZE', 100000))
+# Page cache of the import's connection (KiB when negative); the indexes of
+# song_plays are updated in random order, so they should fit in it
+IMPORT_CACHE_SIZE = int(os.getenv('IMPORT_CACHE_SIZE', -256000))
+# A play of the tracker of the same track starting this close to a record of
+# the export is the same play (the tracker's start times are only as exact as
+# its polling); plays imported before must match a record exactly
+DUPLICATE_WINDOW_MS = 15 * 1000
+
+HISTORY_FILES = 'Streaming_History_Audio_*.json'
+
+# Device types for the platform strings of the export ("Android OS 9 API 28 (...)", "windows", ...)
+PLATFORM_TYPES = [
+    ('android', 'Smartphone'), ('ios', 'Smartphone'), ('iphone', 'Smartphone'),
+    ('windows', 'Computer'), ('os x', 'Computer'), ('osx', 'Computer'), ('linux', 'Computer'),
+    ('web_player', 'Computer'), ('cast', 'CastAudio'), ('sonos', 'Speaker'), ('partner', 'Speaker'),
+    ('tv', 'TV'), ('playstation', 'GameConsole'), ('xbox', 'GameConsole')
+]
+
+_WHITESPACE = re.compile(r'[\s,]*')
+
+def iter_json_array(stream, chunk_size=1 << 20):
+    """Yield the elements of a JSON array read from a text stream, one at a
+    time, keeping at most about `chunk_size` characters in memory"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while '[' not in buffer:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buffer += chunk
+    position = buffer.index('[') + 1
+    eof = False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            element, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The element continues in the next chunk
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield element
+
+def history_files(path):
+    """Yield (name, text stream) for every history file in a file, directory or zip export"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(archive.namelist()):
+                if fnmatch.fnmatch(os.path.basename(name), HISTORY_FILES):
+                    with archive.open(name) as member:
+                        yield name, io.TextIOWrapper(member, encoding='utf-8')
+    elif os.path.isdir(path):
+        for name in sorted(glob.glob(os.path.join(path, '**', HISTORY_FILES), recursive=True)):
+            with open(name, encoding='utf-8') as stream:
+                yield name, stream
+    else:
+        with open(path, encoding='utf-8') as stream:
+            yield path, stream
+
+@functools.lru_cache(maxsize=None)
+def device_type(platform):
+    platform = (platform or '').lower()
+    for keyword, kind in PLATFORM_TYPES:
+        if keyword in platform:
+            return kind
+    return None
+
+EPOCH = datetime(1970, 1, 1)
+HOUR_MS = 3600 * 1000
+
+@functools.lru_cache(maxsize=100000)
+def utc_offset(hour):
+    """Offset of TIMEZONE from UTC during an hour since the epoch; looked up
+    once per hour of history instead of once per play"""
+    from models import LOCAL_TZ
+    return pytz.utc.localize(EPOCH + timedelta(hours=hour)).astimezone(LOCAL_TZ).utcoffset()
+
+@functools.lru_cache(maxsize=100000)
+def catalog_id(*names):
+    """`models.local_id`, computed once per artist and album of the export"""
+    from models import local_id
+    return local_id(*names)
+
+def stored(moment):
+    """A datetime as SQLAlchemy stores DateTime columns in SQLite"""
+    return moment.isoformat(' ', 'microseconds')
+
+def play_fields(record, user_id=None):
+    """SongPlay fields of a history record, or None for podcast episodes and
+    other records without a track"""
+    track_name = record.get('master_metadata_track_name')
+    if not track_name:
+        return None
+    album_name = record.get('master_metadata_album_album_name')
+    artist_name = record.get('master_metadata_album_artist_name')
+    uri = record.get('spotify_track_uri')
+    played_ms = record.get('ms_played') or 0
+    # `ts` is when the play ended, in UTC
+    ended = datetime.fromisoformat(record['ts'].rstrip('Z'))
+    started = ended - timedelta(milliseconds=played_ms)
+    timestamp_ms = (started - EPOCH) // timedelta(milliseconds=1)
+    local_start = started + utc_offset(timestamp_ms // HOUR_MS)
+    return {
+        'user_id': user_id,
+        'track_name': track_name,
+        'artist_name': artist_name,
+        'album_name': album_name,
+        'device_name': record.get('platform'),
+        'device_type': device_type(record.get('platform')),
+        'track_uri': uri,
+        'track_id': uri[14:] if uri and uri.startswith('spotify:track:') else catalog_id(track_name, album_name),
+        'album_id': catalog_id(artist_name, album_name),
+        'artist_id': catalog_id(artist_name) if artist_name else None,
+        'timestamp': stored(started),
+        'start_time': stored(local_start),
+        'end_time': stored(ended + utc_offset((timestamp_ms + played_ms) // HOUR_MS)),
+        'played_duration_ms': played_ms,
+        'is_completed': record.get('reason_end') == 'trackdone',
+        'timestamp_ms': timestamp_ms,
+        'local_date': local_start.date().isoformat(),
+        'local_hour': local_start.hour
+    }
+
+def existing_plays(conn, plays):
+    """Plays already stored per track around the starts of `plays`, as
+    {track_id: {play_id: (timestamp_ms, played_duration_ms, from_tracker)}}
+
+    Imported plays have no track duration (the export has none); the
+    tracker's always do.
+    """
+    from partitions import cold_months, partition_connection
+
+    conn.execute(text('DELETE FROM temp.import_keys'))
+    conn.exec_driver_sql('INSERT INTO temp.import_keys (track_id, timestamp_ms) VALUES (?, ?)',
+                         [(play['track_id'], play['timestamp_ms']) for play in plays])
+    # One index range lookup on the start time per play, whatever order the
+    # export is in; left to itself SQLite scans all of song_plays by track
+    # for the batch, or walks every play of a track for each of its plays
+    params = {'window': DUPLICATE_WINDOW_MS, 'user_id': plays[0]['user_id']}
+    rows = conn.execute(text("""
+        SELECT DISTINCT song_plays.id, song_plays.track_id, song_plays.timestamp_ms, song_plays.played_duration_ms,
+        song_plays.track_duration_ms IS NOT NULL FROM temp.import_keys AS batch
+        CROSS JOIN song_plays INDEXED BY ix_song_plays_timestamp_ms
+        WHERE song_plays.timestamp_ms BETWEEN batch.timestamp_ms - :window AND batch.timestamp_ms + :window
+        AND song_plays.track_id = batch.track_id AND song_plays.user_id IS :user_id"""), params).fetchall()
+
+    # Plays of months moved to partitions (see partitions.py)
+    first_day = min(play['local_date'] for play in plays)
+    last_day = max(play['local_date'] for play in plays)
+    for month in cold_months(conn, first_day, last_day):
+        with partition_connection(month) as partition:
+            rows.extend(partition.execute(text(
+                'SELECT id, track_id, timestamp_ms, played_duration_ms, track_duration_ms IS NOT NULL '
+                'FROM song_plays WHERE timestamp_ms BETWEEN :first AND :last AND user_id IS :user_id'),
+                {'first': min(play['timestamp_ms'] for play in plays) - DUPLICATE_WINDOW_MS,
+                 'last': max(play['timestamp_ms'] for play in plays) + DUPLICATE_WINDOW_MS,
+                 'user_id': params['user_id']}))
+
+    stored_plays = {}
+    for play_id, track_id, timestamp_ms, played_ms, from_tracker in rows:
+        stored_plays.setdefault(track_id, {})[play_id] = (timestamp_ms, played_ms, bool(from_tracker))
+    return stored_plays
+
+def stored_match(play, candidates):
+    """Id of the stored play among `candidates` (see existing_plays) that is
+    this record of the export, or None
+
+    A play imported before has the record's start and duration; a play of the
+    tracker is the one starting closest to it within DUPLICATE_WINDOW_MS.
+    """
+    best, best_distance = None, None
+    for play_id, (timestamp_ms, played_ms, from_tracker) in candidates.items():
+        distance = abs(play['timestamp_ms'] - timestamp_ms)
+        if not from_tracker:
+            if distance == 0 and played_ms == play['played_duration_ms']:
+                return play_id
+        elif distance <= DUPLICATE_WINDOW_MS and (best is None or distance < best_distance):
+            best, best_distance = play_id, distance
+    return best
+
+PLAY_COLUMNS = ['id', 'user_id', 'track_name', 'artist_name', 'album_name', 'device_name', 'device_type',
+                'track_uri', 'track_id', 'timestamp', 'start_time', 'end_time', 'played_duration_ms',
+                'is_completed', 'timestamp_ms', 'local_date', 'local_hour']
+
+def insert_batch(conn, plays, next_id):
+    """Insert the plays that are not stored yet with ids from `next_id` on;
+    returns the number inserted"""
+    from models import next_change_seq
+    stored_plays = existing_plays(conn, plays)
+    new_plays = []
+    for play in plays:
+        # Records of the export are never duplicates of each other (a skip and
+        # a replay are two plays); each stored play stands for one record
+        candidates = stored_plays.get(play['track_id'], {})
+        match = stored_match(play, candidates)
+        if match is not None:
+            del candidates[match]
+            continue
+        play['id'] = next_id + len(new_plays)
+        new_plays.append(play)
+    if not new_plays:
+        return 0
+
+    # The inserts go through the driver: binding the named parameters of a
+    # million rows in SQLAlchemy would take longer than inserting them
+
+    # Tracks played for the first time go into the catalog and the search index
+    new_tracks = {track_id for track_id, in conn.execute(text(
+        'SELECT DISTINCT track_id FROM temp.import_keys WHERE track_id NOT IN (SELECT id FROM tracks)'))}
+    new_tracks = list({play['track_id']: play for play in new_plays if play['track_id'] in new_tracks}.values())
+    conn.exec_driver_sql('INSERT OR IGNORE INTO artists (id, name) VALUES (?, ?)',
+                         list({(play['artist_id'], play['artist_name']) for play in new_plays if play['artist_id']}))
+    conn.exec_driver_sql('INSERT OR IGNORE INTO albums (id, name) VALUES (?, ?)',
+                         list({(play['album_id'], play['album_name']) for play in new_plays}))
+    if new_tracks:
+        conn.exec_driver_sql('INSERT INTO tracks (id, name, album_id, uri) VALUES (?, ?, ?, ?)',
+                             [(play['track_id'], play['track_name'], play['album_id'], play['track_uri'])
+                              for play in new_tracks])
+        index_tracks(conn, [(play['track_id'], play['track_name'], [play['artist_name']] if play['artist_name'] else [],
+                             play['album_name']) for play in new_tracks])
+
+    last_seq = next_change_seq(conn, len(new_plays))
+    conn.exec_driver_sql(
+        f"INSERT INTO song_plays ({', '.join(PLAY_COLUMNS)}, change_seq, rolled_up) "
+        f"VALUES ({', '.join('?' * len(PLAY_COLUMNS))}, ?, 0)",
+        [tuple(play[column] for column in PLAY_COLUMNS) + (last_seq - len(new_plays) + index + 1,)
+         for index, play in enumerate(new_plays)])
+    # The export only names the album artist of a track
+    conn.exec_driver_sql('INSERT INTO play_artists (play_id, artist_id, position) VALUES (?, ?, 0)',
+                         [(play['id'], play['artist_id']) for play in new_plays if play['artist_id']])
+    return len(new_plays)
+
+def import_history(engine, paths, user_id=None):
+    """Import the history files found in `paths`; returns a summary dict"""
+    from storage import SQLITE_CACHE_SIZE
+    summary = {'records': 0, 'imported': 0, 'duplicates': 0, 'skipped': 0}
+    started = time.perf_counter()
+
+    def batches():
+        batch = []
+        for path in paths:
+            for name, stream in history_files(path):
+                logger.info(f"📥 Reading {name}")
+                for record in iter_json_array(stream):
+                    summary['records'] += 1
+                    fields = play_fields(record, user_id)
+                    if fields is None:
+                        summary['skipped'] += 1
+                        continue
+                    batch.append(fields)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f'PRAGMA cache_size = {IMPORT_CACHE_SIZE}')
+        conn.execute(text('CREATE TEMP TABLE IF NOT EXISTS import_keys (track_id VARCHAR, timestamp_ms BIGINT)'))
+        conn.commit()
+        first_id = None
+
+        def commit():
+            # The plays of a transaction are added to the rollups together, so
+            # each bucket is updated once per transaction instead of per batch
+            rollups.roll_up(conn, 'song_plays.id >= :first_id', {'first_id': first_id})
+            conn.commit()
+            elapsed = time.perf_counter() - started
+            logger.info(f"📥 {summary['records']} records, {summary['imported']} imported "
+                        f"({summary['records'] / elapsed:.0f} records/s)")
+
+        for batch in batches():
+            if first_id is None:
+                # Holds the write lock until the commit, so every play from
+                # first_id on is one of ours
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+                first_id = (conn.execute(text('SELECT max(id) FROM song_plays')).scalar() or 0) + 1
+                next_id, in_transaction = first_id, 0
+            imported = insert_batch(conn, batch, next_id)
+            next_id += imported
+            summary['imported'] += imported
+            summary['duplicates'] += len(batch) - imported
+            in_transaction += len(batch)
+            if in_transaction >= IMPORT_TRANSACTION_SIZE:
+                commit()
+                first_id = None
+        if first_id is not None:
+            commit()
+        conn.exec_driver_sql(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+
+    summary['seconds'] = time.perf_counter() - started
+    summary['records_per_second'] = summary['records'] / summary['seconds'] if summary['seconds'] else 0
+    return summary
+
+def write_sample_export(directory, records, per_file=15000):
+    """Write a synthetic export of `records` plays over the last ten years"""
+    rng = random.Random(1)
+    artists = [f'Artist {index}' for index in range(3000)]
+    tracks = [(f'Track {index}', rng.choice(artists), f'Album {index // 10}', f'spotify:track:{index:022d}')
+              for index in range(60000)]
+    platforms = ['Android OS 13 API 33 (Google, Pixel 7)', 'windows', 'OS X 14.1.0 [arm 2]', 'ios', 'web_player']
+    moment = datetime(2015, 1, 1)
+    for number, offset in enumerate(range(0, records, per_file)):
+        with open(os.path.join(directory, f'Streaming_History_Audio_{number}.json'), 'w', encoding='utf-8') as out:
+            entries = []
+            for _ in range(offset, min(records, offset + per_file)):
+                moment += timedelta(seconds=rng.randint(30, 600))
+                name, artist, album, uri = rng.choice(tracks)
+                completed = rng.random() < 0.6
+                entries.append({
+                    'ts': moment.strftime('%Y-%m-%dT%H:%M:%SZ'), 'platform': rng.choice(platforms),
+                    'ms_played': rng.randint(150000, 240000) if completed else rng.randint(0, 60000),
+                    'conn_country': 'DE', 'master_metadata_track_name': name,
+                    'master_metadata_album_artist_name': artist, 'master_metadata_album_album_name': album,
+                    'spotify_track_uri': uri, 'episode_name': None, 'reason_start': 'trackdone',
+                    'reason_end': 'trackdone' if completed else 'fwdbtn', 'shuffle': False, 'skipped': not completed
+                })
+            json.dump(entries, out, indent=2)
+
+def print_summary(summary):
+    print(f"Records:         {summary['records']} ({summary['skipped']} without a track)")
+    print(f"Imported:        {summary['imported']} ({summary['duplicates']} already stored)")
+    print(f"Time:            {summary['seconds']:.1f}s ({summary['records_per_second']:.0f} records/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import Spotify's extended streaming history")
+    parser.add_argument('paths', nargs='*', help="History files, directories or the export's zip file")
+    parser.add_argument('--account', help="Account id to store the plays under, as in multi_tracker.py")
+    parser.add_argument('--benchmark', action='store_true', help="Import a synthetic export into a temporary database")
+    parser.add_argument('--records', type=int, default=1000000, help="Plays in the synthetic export")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        directory = tempfile.mkdtemp(prefix='spotify-import-')
+        write_sample_export(directory, args.records)
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        from models import engine
+        print_summary(import_history(engine, [directory]))
+        print(f"Database:        {os.environ['DATABASE_URL']}")
+    elif args.paths:
+        from models import engine
+        print_summary(import_history(engine, args.paths, args.account))
+    else:
+        parser.print_usage()
+        sys.exit(1)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Database migrations for the Spotify Tracker
+
+Migrations are applied in order when `models` is imported. The versions that
+have been applied are recorded in the `schema_migrations` table, so each one
+runs exactly once per database. Run this file directly to apply pending
+migrations, or with `--explain` to check that the queries of the web app use
+their indexes.
+"""
+
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import text
+import rollups
+import search
+
+logger = logging.getLogger('migrations')
+
+# Columns of song_plays added over time, before migrations were versioned
+LEGACY_COLUMNS = [
+    ('user_id', 'VARCHAR'),
+    ('device_type', 'VARCHAR'),
+    ('album_cover_url', 'VARCHAR'),
+    ('track_uri', 'VARCHAR'),
+    ('track_duration_ms', 'INTEGER'),
+    ('played_duration_ms', 'INTEGER'),
+    ('is_completed', 'BOOLEAN'),
+    ('start_time', 'DATETIME'),
+    ('end_time', 'DATETIME'),
+    ('timestamp_ms', 'BIGINT'),
+    ('local_date', 'VARCHAR'),
+    ('local_hour', 'INTEGER')
+]
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+
+def add_legacy_columns(conn):
+    """Bring databases created by older versions up to the current song_plays layout"""
+    existing = table_columns(conn, 'song_plays')
+    for name, column_type in LEGACY_COLUMNS:
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE song_plays ADD COLUMN {name} {column_type}'))
+            logger.info(f"✅ Added column {name} to song_plays")
+    for name in ('user_id', 'local_date', 'local_hour'):
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_song_plays_{name} ON song_plays ({name})'))
+
+def backfill_local_time(conn, batch_size=5000):
+    """Compute timestamp_ms/local_date/local_hour for plays stored before they existed"""
+    # Imported here because models runs the migrations while it is being imported
+    from models import local_time_fields
+
+    total = 0
+    while True:
+        rows = conn.execute(text(
+            'SELECT id, timestamp FROM song_plays WHERE timestamp_ms IS NULL AND timestamp IS NOT NULL LIMIT :limit'
+        ), {'limit': batch_size}).fetchall()
+        if not rows:
+            break
+        updates = []
+        for play_id, timestamp in rows:
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            updates.append(dict(local_time_fields(timestamp), id=play_id))
+        conn.execute(text(
+            'UPDATE song_plays SET timestamp_ms = :timestamp_ms, local_date = :local_date, '
+            'local_hour = :local_hour WHERE id = :id'
+        ), updates)
+        total += len(updates)
+    if total:
+        logger.info(f"✅ Backfilled local dates for {total} plays")
+
+def add_query_indexes(conn):
+    """Indexes for the history, stats and artist queries of the web app"""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_timestamp ON song_plays (timestamp)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_timestamp_ms ON song_plays (timestamp_ms)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_artist_name ON song_plays (artist_name)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_track_name ON song_plays (track_name)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_is_completed ON song_plays (is_completed)'))
+    # Covers today's listening time without touching the table
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_song_plays_local_date_duration ON song_plays (local_date, played_duration_ms)'
+    ))
+
+# Artists whose names contain ", ", which otherwise separates the artists in
+# song_plays.artist_name
+KNOWN_COMMA_ARTISTS = ('Tyler, The Creator',)
+
+def split_artist_names(artist_name):
+    """Split a comma-joined artist string, keeping known comma names whole"""
+    placeholders = {}
+    for index, name in enumerate(KNOWN_COMMA_ARTISTS):
+        if name in artist_name:
+            placeholder = f'\x00{index}\x00'
+            placeholders[placeholder] = name
+            artist_name = artist_name.replace(name, placeholder)
+    names = [name.strip() for name in artist_name.split(',') if name.strip()]
+    return [placeholders.get(name, name) for name in names]
+
+def backfill_catalog(conn, batch_size=5000):
+    """Fill the artists, albums, tracks and play_artists tables from the names
+    stored on existing plays"""
+    from models import local_id
+
+    if 'track_id' not in table_columns(conn, 'song_plays'):
+        conn.execute(text('ALTER TABLE song_plays ADD COLUMN track_id VARCHAR REFERENCES tracks (id)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_track_id ON song_plays (track_id)'))
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            'SELECT id, track_name, artist_name, album_name, album_cover_url, track_uri, track_duration_ms '
+            'FROM song_plays WHERE id > :last_id AND track_id IS NULL ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            break
+        artists, albums, tracks, links, plays = {}, {}, {}, [], []
+        for play_id, track_name, artist_name, album_name, cover_url, track_uri, duration_ms in rows:
+            names = split_artist_names(artist_name or '')
+            album_id = local_id(', '.join(names), album_name)
+            if track_uri and track_uri.startswith('spotify:track:'):
+                track_id = track_uri.rsplit(':', 1)[1]
+            else:
+                track_id = local_id(track_name, album_name)
+            albums[album_id] = {'id': album_id, 'name': album_name, 'cover_url': cover_url}
+            tracks[track_id] = {'id': track_id, 'name': track_name, 'album_id': album_id,
+                                'duration_ms': duration_ms, 'uri': track_uri}
+            for position, name in enumerate(dict.fromkeys(names)):
+                artists[local_id(name)] = {'id': local_id(name), 'name': name}
+                links.append({'play_id': play_id, 'artist_id': local_id(name), 'position': position})
+            plays.append({'id': play_id, 'track_id': track_id})
+        if artists:
+            conn.execute(text('INSERT OR IGNORE INTO artists (id, name) VALUES (:id, :name)'), list(artists.values()))
+        conn.execute(text(
+            'INSERT OR IGNORE INTO albums (id, name, cover_url) VALUES (:id, :name, :cover_url)'
+        ), list(albums.values()))
+        conn.execute(text(
+            'INSERT OR IGNORE INTO tracks (id, name, album_id, duration_ms, uri) '
+            'VALUES (:id, :name, :album_id, :duration_ms, :uri)'
+        ), list(tracks.values()))
+        if links:
+            conn.execute(text(
+                'INSERT OR IGNORE INTO play_artists (play_id, artist_id, position) VALUES (:play_id, :artist_id, :position)'
+            ), links)
+        conn.execute(text('UPDATE song_plays SET track_id = :track_id WHERE id = :id'), plays)
+        total += len(plays)
+        last_id = rows[-1][0]
+    if total:
+        logger.info(f"✅ Backfilled artists, albums and tracks of {total} plays")
+
+def add_rollups(conn):
+    """Track which plays are in the rollup tables and fill them from existing plays"""
+    if 'rolled_up' not in table_columns(conn, 'song_plays'):
+        conn.execute(text('ALTER TABLE song_plays ADD COLUMN rolled_up BOOLEAN NOT NULL DEFAULT 0'))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_song_plays_pending_rollup ON song_plays (rolled_up) WHERE rolled_up = 0'
+    ))
+    rollups.rebuild(conn)
+
+def add_search_index(conn):
+    """Full-text index of the track, artist and album names"""
+    search.create_index(conn)
+    search.rebuild(conn)
+
+# Columns of song_plays shown by the history; writing one of them gives the
+# play a new change_seq. rolled_up is left out, rolling a play up changes
+# nothing a client sees.
+CHANGE_COLUMNS = ('track_name', 'artist_name', 'album_name', 'device_name', 'device_type', 'album_cover_url',
+                  'track_uri', 'track_duration_ms', 'played_duration_ms', 'is_completed', 'start_time', 'end_time',
+                  'timestamp_ms', 'local_date')
+
+def add_change_sequence(conn):
+    """Number every insert and update of a play, for the delta sync of /api/history
+
+    The single-row change_sequence table holds the last number handed out.
+    New plays take theirs when they are inserted (models.next_change_seq);
+    updates are numbered by a trigger, which also covers the bulk UPDATEs of
+    the writers. Plays written before have no change_seq; clients start with
+    a full load anyway.
+    """
+    if 'change_seq' not in table_columns(conn, 'song_plays'):
+        conn.execute(text('ALTER TABLE song_plays ADD COLUMN change_seq INTEGER'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_song_plays_change_seq ON song_plays (change_seq)'))
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS change_sequence (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)'
+    ))
+    conn.execute(text('INSERT OR IGNORE INTO change_sequence (id, value) VALUES (1, 0)'))
+    # Not an insert trigger: it costs every row of an import, even with a
+    # WHEN clause that skips it
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS song_plays_updated AFTER UPDATE OF {', '.join(CHANGE_COLUMNS)} ON song_plays "
+        'BEGIN UPDATE change_sequence SET value = value + 1; '
+        'UPDATE song_plays SET change_seq = (SELECT value FROM change_sequence) WHERE id = NEW.id; END'))
+
+# (version, description, upgrade function) - append only, never renumber
+MIGRATIONS = [
+    (1, 'Add columns introduced before versioned migrations', add_legacy_columns),
+    (2, 'Backfill local dates and hours', backfill_local_time),
+    (3, 'Add indexes for history, stats and artist queries', add_query_indexes),
+    (4, 'Add artists, albums, tracks and play_artists tables', backfill_catalog),
+    (5, 'Add hourly, artist and track rollups', add_rollups),
+    (6, 'Add full-text search index of tracks', add_search_index),
+    (7, 'Add change sequence of plays', add_change_sequence),
+    (8, 'Add all-time totals rollup', rollups.reset_total)
+]
+
+def migrate(engine, metadata):
+    """Create missing tables and apply pending migrations
+
+    Safe to call from several processes at once: on SQLite the write lock is
+    taken before the applied versions are read, so run.py starting the
+    tracker and the web app together applies every migration only once.
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        metadata.create_all(conn)
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations '
+            '(version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)'
+        ))
+        applied = {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+        for version, description, upgrade in MIGRATIONS:
+            if version in applied:
+                continue
+            upgrade(conn)
+            conn.execute(text(
+                'INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)'
+            ), {'version': version, 'description': description, 'applied_at': datetime.utcnow()})
+            logger.info(f"✅ Applied migration {version}: {description}")
+        conn.commit()
+
+# Queries the web app runs on every page load, with the index each must use
+HOT_QUERIES = [
+    ('history', 'SELECT * FROM song_plays ORDER BY timestamp_ms DESC', {}),
+    ('today listened', 'SELECT sum(played_duration_ms) FROM song_plays WHERE local_date = :day', {'day': '2024-01-01'}),
+    ('completed songs', 'SELECT count(*) FROM song_plays WHERE is_completed = 1', {}),
+    ('artist plays', 'SELECT * FROM song_plays WHERE artist_name = :name', {'name': 'Artist'}),
+    ('track plays', 'SELECT * FROM song_plays WHERE track_name = :name', {'name': 'Track'}),
+    ('plays since', 'SELECT * FROM song_plays WHERE timestamp >= :since ORDER BY timestamp', {'since': '2024-01-01'}),
+    ('artist by name', 'SELECT id FROM artists WHERE name = :name', {'name': 'Artist'}),
+    ('pending rollup', f'SELECT * FROM song_plays WHERE {rollups.PENDING}', {}),
+    ('plays of artist', 'SELECT song_plays.* FROM song_plays JOIN play_artists ON play_artists.play_id = song_plays.id '
+                        'WHERE play_artists.artist_id IN (:id)', {'id': 'local:0'}),
+    ('plays changed since', 'SELECT * FROM song_plays WHERE change_seq > :since', {'since': 0})
+]
+
+def explain_hot_queries(engine):
+    """Print the query plan of every hot query; returns False if one scans the table"""
+    ok = True
+    with engine.connect() as conn:
+        for name, sql, params in HOT_QUERIES:
+            plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params)]
+            # "SCAN song_plays USING INDEX ..." walks an index in order; a bare
+            # "SCAN song_plays" or a temporary sort means the index is not used
+            full_scan = any(step in ('SCAN song_plays', 'SCAN play_artists', 'SCAN artists') or 'TEMP B-TREE' in step
+                            for step in plan)
+            ok = ok and not full_scan
+            print(f"{'❌' if full_scan else '✅'} {name}: {'; '.join(plan)}")
+    return ok
+
+if __name__ == "__main__":
+    # Importing models applies pending migrations
+    from models import engine
+
+    with engine.connect() as conn:
+        for version, description, applied_at in conn.execute(
+                text('SELECT version, description, applied_at FROM schema_migrations ORDER BY version')):
+            print(f"{version:>3}  {applied_at}  {description}")
+    if '--explain' in sys.argv[1:] and not explain_hot_queries(engine):
+        sys.exit(1)
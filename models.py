@@ -1,32 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean
+from sqlalchemy import event, text, Index, Column, ForeignKey, Integer, BigInteger, String, DateTime, Float, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import logging
+import hashlib
 import pytz
 import os
 from dotenv import load_dotenv
+from migrations import migrate
+from storage import create_database_engine
+from search import index_track
 
-# Configure logging with Berlin timezone
+# Configure logging with the configured timezone
 load_dotenv()
 
+# Timezone used for local dates, hours and log timestamps
+TIMEZONE = os.getenv('TIMEZONE', 'Europe/Berlin')
+LOCAL_TZ = pytz.timezone(TIMEZONE)
+
 # Get log level from environment variable, default to ERROR
 log_level_str = os.getenv('LOG_LEVEL', 'ERROR').upper()
 log_level = getattr(logging, log_level_str, logging.ERROR)
 
-# Create a custom formatter that uses Berlin timezone
-class BerlinTimeFormatter(logging.Formatter):
+# Create a custom formatter that uses the configured timezone
+class LocalTimeFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
-        # Convert to Berlin timezone
-        berlin_tz = pytz.timezone('Europe/Berlin')
-        dt = datetime.fromtimestamp(record.created, berlin_tz)
+        # Convert to the configured timezone
+        dt = datetime.fromtimestamp(record.created, LOCAL_TZ)
         if datefmt:
             return dt.strftime(datefmt)
         else:
             return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 # Configure logging with custom formatter
-formatter = BerlinTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 # Create handlers
 file_handler = logging.FileHandler('output.log')
@@ -47,6 +54,7 @@ Base = declarative_base()
 class SongPlay(Base):
     __tablename__ = 'song_plays'
     id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=True, index=True)  # Spotify account the play belongs to (None = default account)
     track_name = Column(String)
     artist_name = Column(String)
     album_name = Column(String)
@@ -54,6 +62,7 @@ class SongPlay(Base):
     device_type = Column(String)
     album_cover_url = Column(String, nullable=True)
     track_uri = Column(String, nullable=True)  # Spotify track URI for playback
+    track_id = Column(String, ForeignKey('tracks.id'), nullable=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     # New fields for duration tracking
     track_duration_ms = Column(Integer, nullable=True)  # Total track duration in milliseconds
@@ -61,10 +70,190 @@ class SongPlay(Base):
     is_completed = Column(Boolean, default=False)  # Whether the song was played to completion
     start_time = Column(DateTime, nullable=True)  # When the song started playing
     end_time = Column(DateTime, nullable=True)  # When the song stopped playing
+    # When the song started, precomputed at insert time so that day and hour
+    # filters are index lookups instead of per-row timezone conversions
+    timestamp_ms = Column(BigInteger, nullable=True)  # UTC epoch milliseconds
+    local_date = Column(String, nullable=True, index=True)  # YYYY-MM-DD in TIMEZONE
+    local_hour = Column(Integer, nullable=True, index=True)  # 0-23 in TIMEZONE
+    # Whether the play has been added to the rollup tables (see rollups.py)
+    rolled_up = Column(Boolean, default=False, server_default='0', nullable=False)
+    # Position of the play's last insert or update in the change sequence
+    # (see migrations.add_change_sequence), for the delta sync of the history
+    change_seq = Column(Integer, nullable=True)
+
+    # Indexes for the queries of the web app; existing databases get them
+    # through migrations.py
+    __table_args__ = (
+        Index('ix_song_plays_timestamp', 'timestamp'),
+        Index('ix_song_plays_timestamp_ms', 'timestamp_ms'),
+        Index('ix_song_plays_artist_name', 'artist_name'),
+        Index('ix_song_plays_track_name', 'track_name'),
+        Index('ix_song_plays_is_completed', 'is_completed'),
+        Index('ix_song_plays_local_date_duration', 'local_date', 'played_duration_ms'),
+        Index('ix_song_plays_pending_rollup', 'rolled_up', sqlite_where=text('rolled_up = 0')),
+        Index('ix_song_plays_change_seq', 'change_seq'),
+    )
+
+# Catalog of the tracks, albums and artists that were played, keyed by
+# Spotify ID. Local files and plays recorded before the catalog existed have
+# no Spotify IDs; they get a "local:" id derived from their names instead.
+
+class Artist(Base):
+    __tablename__ = 'artists'
+    id = Column(String, primary_key=True)
+    name = Column(String, index=True)
+
+class Album(Base):
+    __tablename__ = 'albums'
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    cover_url = Column(String, nullable=True)
+    release_date = Column(String, nullable=True)
+
+class Track(Base):
+    __tablename__ = 'tracks'
+    id = Column(String, primary_key=True)
+    name = Column(String)
+    album_id = Column(String, ForeignKey('albums.id'), nullable=True, index=True)
+    duration_ms = Column(Integer, nullable=True)
+    uri = Column(String, nullable=True)
+
+class PlayArtist(Base):
+    """The artists of a play, in the order Spotify lists them"""
+    __tablename__ = 'play_artists'
+    play_id = Column(Integer, ForeignKey('song_plays.id'), primary_key=True)
+    artist_id = Column(String, ForeignKey('artists.id'), primary_key=True)
+    position = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index('ix_play_artists_artist_id', 'artist_id', 'play_id'),
+    )
+
+# Listening stats per bucket, maintained by rollups.py as plays are closed so
+# that stats cost O(buckets) instead of O(plays). Missing devices and tracks
+# are stored as '' so that they still share a bucket.
+
+class HourlyRollup(Base):
+    __tablename__ = 'hourly_rollups'
+    local_date = Column(String, primary_key=True)
+    local_hour = Column(Integer, primary_key=True)
+    device_name = Column(String, primary_key=True)
+    plays = Column(Integer, default=0)
+    listened_ms = Column(BigInteger, default=0)
+    completed = Column(Integer, default=0)
+
+class ArtistRollup(Base):
+    __tablename__ = 'artist_rollups'
+    local_date = Column(String, primary_key=True)
+    artist_id = Column(String, primary_key=True, index=True)
+    plays = Column(Integer, default=0)
+    listened_ms = Column(BigInteger, default=0)
+    completed = Column(Integer, default=0)
+
+class TrackRollup(Base):
+    __tablename__ = 'track_rollups'
+    local_date = Column(String, primary_key=True)
+    track_id = Column(String, primary_key=True, index=True)
+    plays = Column(Integer, default=0)
+    listened_ms = Column(BigInteger, default=0)
+    completed = Column(Integer, default=0)
+
+class TotalRollup(Base):
+    """All-time totals in a single row (id 1), so they cost the same for any history"""
+    __tablename__ = 'total_rollups'
+    id = Column(Integer, primary_key=True)
+    plays = Column(Integer, default=0)
+    listened_ms = Column(BigInteger, default=0)
+    completed = Column(Integer, default=0)
+
+class PlayPartition(Base):
+    """A month whose plays were moved out of song_plays into a cold partition"""
+    __tablename__ = 'play_partitions'
+    month = Column(String, primary_key=True)  # YYYY-MM, local time
+    plays = Column(Integer, default=0)
+    updated_at = Column(DateTime)
+    dropped_at = Column(DateTime)  # Raw plays deleted by the retention policy; only the rollups remain
+
+def local_id(*names):
+    """Stable id for catalog entries that have no Spotify ID"""
+    return 'local:' + hashlib.md5('\x1f'.join(name or '' for name in names).encode()).hexdigest()
+
+def add_play(session, fields, track=None):
+    """Add a play to the session and flush it so that its id is assigned
+
+    `track` is the Spotify track object of the play; its track, album and
+    artists are stored in the catalog and the artists linked to the play.
+    """
+    play = SongPlay(**fields)
+    artist_ids = []
+    if track:
+        album = track.get('album') or {}
+        artists = track.get('artists') or []
+        images = album.get('images') or []
+        album_id = album.get('id') or local_id(', '.join(a['name'] for a in artists), album.get('name'))
+        play.track_id = track.get('id') or local_id(track.get('name'), album.get('name'))
+        if session.get(Track, play.track_id) is None:
+            # First play of the track: add it to the search index
+            index_track(session.connection(), play.track_id, track.get('name'),
+                        list(dict.fromkeys(a['name'] for a in artists)), album.get('name'))
+
+        session.merge(Album(id=album_id, name=album.get('name'),
+                            cover_url=images[0]['url'] if images else None,
+                            release_date=album.get('release_date')))
+        session.merge(Track(id=play.track_id, name=track.get('name'), album_id=album_id,
+                            duration_ms=track.get('duration_ms'), uri=track.get('uri')))
+        for artist in artists:
+            artist_id = artist.get('id') or local_id(artist['name'])
+            if artist_id not in artist_ids:
+                session.merge(Artist(id=artist_id, name=artist['name']))
+                artist_ids.append(artist_id)
+
+    session.add(play)
+    session.flush()
+    for position, artist_id in enumerate(artist_ids):
+        session.add(PlayArtist(play_id=play.id, artist_id=artist_id, position=position))
+    return play
+
+def local_time_fields(moment):
+    """Epoch milliseconds, local date and local hour of a datetime
+
+    Naive datetimes are taken to be UTC, like `SongPlay.timestamp`.
+    """
+    if moment.tzinfo is None:
+        moment = pytz.utc.localize(moment)
+    local = moment.astimezone(LOCAL_TZ)
+    return {
+        'timestamp_ms': int(moment.timestamp() * 1000),
+        'local_date': local.strftime('%Y-%m-%d'),
+        'local_hour': local.hour
+    }
+
+@event.listens_for(SongPlay, 'before_insert')
+def set_local_time_fields(mapper, connection, play):
+    """Fill in timestamp_ms/local_date/local_hour for every new play"""
+    if play.timestamp_ms is None:
+        moment = play.start_time or play.timestamp or datetime.utcnow()
+        if moment.tzinfo is None and play.start_time is not None:
+            moment = LOCAL_TZ.localize(moment)  # start_time is local time
+        for key, value in local_time_fields(moment).items():
+            setattr(play, key, value)
+
+def next_change_seq(conn, count=1):
+    """Take `count` numbers of the change sequence; returns the last one"""
+    return conn.exec_driver_sql('UPDATE change_sequence SET value = value + ? RETURNING value', (count,)).scalar()
+
+@event.listens_for(SongPlay, 'before_insert')
+def set_change_seq(mapper, connection, play):
+    """Number every new play in the change sequence (updates are numbered by a trigger)"""
+    if play.change_seq is None:
+        play.change_seq = next_change_seq(connection)
 
 logger.info("🔧 Initializing database connection...")
-engine = create_engine('sqlite:///songs.db')
-Base.metadata.create_all(engine)
+engine = create_database_engine()
+migrate(engine, Base.metadata)
 logger.info("✅ Database tables created/verified")
 Session = sessionmaker(bind=engine)
+# Separate pool of read-only connections for the web app
+read_engine = create_database_engine(read_only=True)
+ReadSession = sessionmaker(bind=read_engine)
 logger.info("✅ Database session factory created")
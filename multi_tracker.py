@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Multi-account Spotify Tracker
+Tracks several Spotify accounts concurrently from a single process
+"""
+
+import os
+import sys
+import signal
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from tracker import PlayTracker
+from rollups import roll_up_play
+from scheduler import PollScheduler
+from spotify_client import create_spotify, create_http_session
+from models import SongPlay, Session, add_play
+from notify import Publisher, playback_snapshot
+
+logger = logging.getLogger('multi_tracker')
+
+# Comma-separated ids of the accounts to track, e.g. "alice,bob"
+SPOTIFY_ACCOUNTS = os.getenv('SPOTIFY_ACCOUNTS', '')
+# Maximum number of Spotify API calls in flight at once; also the size of
+# the shared HTTP connection pool
+ENGINE_MAX_CONCURRENCY = int(os.getenv('ENGINE_MAX_CONCURRENCY', 32))
+# How often (in seconds) queued writes of all accounts are committed together
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', 1))
+
+def token_cache_path(user_id):
+    """Path of the OAuth token cache of an account"""
+    return f".cache-{user_id}"
+
+class PendingPlay:
+    """Handle of a play queued for insertion; `id` is set once it is written"""
+
+    def __init__(self):
+        self.id = None
+
+class BatchWriter:
+    """Collects the writes of all accounts and commits them in one transaction
+    every `flush_interval` seconds"""
+
+    def __init__(self, publisher, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.publisher = publisher
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.batches = 0
+        self.rows = 0
+
+    def insert(self, fields, track=None):
+        handle = PendingPlay()
+        self.pending.append(('insert', handle, fields, track))
+        return handle
+
+    def update(self, handle, fields):
+        self.pending.append(('update', handle, fields, None))
+        return True
+
+    def take(self):
+        """Take all queued writes, in the order they were made"""
+        ops, self.pending = self.pending, []
+        return ops
+
+    def write(self, ops):
+        """Write a batch of queued operations in a single transaction
+
+        If the batch fails, its plays are written again one at a time, so a
+        single bad play can't take the others of the batch down with it.
+        """
+        if not ops:
+            return
+        try:
+            inserted, updated = self.commit(ops)
+            self.batches += 1
+        except Exception as db_error:
+            logger.error(f"Database error writing batch of {len(ops)} operations, "
+                         f"retrying play by play: {db_error}")
+            inserted, updated = self.retry(ops)
+        if inserted or updated:
+            self.publisher.publish({'event': 'plays', 'inserted': inserted, 'updated': updated})
+
+    def commit(self, ops):
+        """Write operations in one transaction; returns the ids of the plays
+        inserted and closed, or raises after rolling it back"""
+        session = None
+        inserted, updated = [], []
+        try:
+            session = Session()
+            for op, handle, fields, track in ops:
+                if op == 'insert':
+                    # Flushed, so the id is assigned and later updates in this batch can use it
+                    play = add_play(session, fields, track)
+                    handle.id = play.id
+                    inserted.append(play.id)
+                elif handle.id is not None:
+                    session.query(SongPlay).filter_by(id=handle.id).update(fields)
+                    if 'end_time' in fields:
+                        roll_up_play(session, handle.id)
+                        updated.append(handle.id)
+            session.commit()
+            self.rows += len(ops)
+            return inserted, updated
+        except Exception:
+            if session:
+                session.rollback()
+            # Inserts of a failed transaction were never committed
+            for op, handle, fields, track in ops:
+                if op == 'insert':
+                    handle.id = None
+            raise
+        finally:
+            if session:
+                session.close()
+
+    def retry(self, ops):
+        """Write the operations of a failed batch play by play, each play in
+        its own transaction, dropping (and logging) only the plays that fail again"""
+        plays = {}
+        for entry in ops:
+            plays.setdefault(entry[1], []).append(entry)
+        inserted, updated = [], []
+        for handle, play_ops in plays.items():
+            try:
+                play_inserted, play_updated = self.commit(play_ops)
+                inserted += play_inserted
+                updated += play_updated
+            except Exception as db_error:
+                fields = next((fields for op, _, fields, _ in play_ops if op == 'insert'), None)
+                play = (f"{fields.get('track_name')} of {fields.get('user_id')} at {fields.get('start_time')}"
+                        if fields else f"play {handle.id}")
+                logger.error(f"🗑️ Dropped {len(play_ops)} writes of {play}: {db_error}")
+        return inserted, updated
+
+    async def run(self, db_executor):
+        """Flush queued writes periodically on the single database thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(db_executor, self.write, self.take())
+
+class Account:
+    """One tracked Spotify account with its own token cache and poll schedule"""
+
+    def __init__(self, user_id, http_session, writer):
+        self.user_id = user_id
+        self.sp = create_spotify(cache_path=token_cache_path(user_id),
+                                 requests_session=http_session, open_browser=False)
+        self.tracker = PlayTracker(writer=writer, user_id=user_id)
+        self.scheduler = PollScheduler()
+
+async def poll_account(account, api_executor, publisher):
+    """Poll one account forever, sleeping as long as its scheduler says"""
+    loop = asyncio.get_running_loop()
+    # Spread the first polls out so accounts don't all hit the API at once
+    await asyncio.sleep(random.random() * account.scheduler.idle_interval)
+    while True:
+        try:
+            playback = await loop.run_in_executor(api_executor, account.sp.current_playback)
+            publisher.publish(playback_snapshot(playback, account.user_id))
+            account.tracker.handle_playback(playback)
+            delay = account.scheduler.after_playback(playback)
+        except Exception as e:
+            logger.error(f"❌ [{account.user_id}] Error in track loop: {e}")
+            delay = account.scheduler.after_error(e)
+        await asyncio.sleep(delay)
+
+async def run_accounts(user_ids):
+    """Track all given accounts until cancelled"""
+    api_executor = ThreadPoolExecutor(max_workers=ENGINE_MAX_CONCURRENCY, thread_name_prefix='spotify')
+    db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+    http_session = create_http_session(pool_size=ENGINE_MAX_CONCURRENCY)
+    publisher = Publisher()
+    writer = BatchWriter(publisher)
+    accounts = [Account(user_id, http_session, writer) for user_id in user_ids]
+
+    # Cancel cleanly on SIGTERM (sent by run.py on shutdown)
+    main_task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except NotImplementedError:
+        pass  # Not supported on Windows
+
+    logger.info(f"🎵 Tracking {len(accounts)} Spotify accounts: {', '.join(user_ids)}")
+    tasks = [asyncio.create_task(poll_account(account, api_executor, publisher)) for account in accounts]
+    tasks.append(asyncio.create_task(writer.run(db_executor)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Don't lose the progress made since the last checkpoint on shutdown
+        for account in accounts:
+            account.tracker.checkpoint()
+        # On the database thread, after any batch still in flight there, so
+        # the updates find the ids of the plays that batch inserts
+        db_executor.submit(writer.write, writer.take()).result()
+        api_executor.shutdown(wait=False)
+        db_executor.shutdown(wait=True)
+
+        calls = sum(account.scheduler.stats()['calls'] for account in accounts)
+        saved = sum(account.scheduler.stats()['saved_calls'] for account in accounts)
+        logger.info(f"📉 {calls} API calls made, {saved} saved compared with fixed 5s polling")
+        logger.info(f"💾 {writer.rows} writes committed in {writer.batches} batches")
+
+def authorize(user_id):
+    """Run the OAuth flow for one account and store its token cache"""
+    sp = create_spotify(cache_path=token_cache_path(user_id))
+    user = sp.current_user()
+    logger.info(f"✅ Authorized account {user_id} ({user.get('display_name') or user.get('id')})")
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--authorize':
+        authorize(sys.argv[2])
+        return
+
+    user_ids = sys.argv[1:] or [u.strip() for u in SPOTIFY_ACCOUNTS.split(',') if u.strip()]
+    if not user_ids:
+        logger.error("❌ No accounts configured - set SPOTIFY_ACCOUNTS or pass account ids as arguments")
+        sys.exit(1)
+
+    missing = [u for u in user_ids if not os.path.exists(token_cache_path(u))]
+    if missing:
+        logger.warning(f"⚠️  No token cache for {', '.join(missing)} - run: python multi_tracker.py --authorize <account>")
+
+    try:
+        asyncio.run(run_accounts(user_ids))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    logger.info("✅ Multi-account tracker stopped")
+
+if __name__ == "__main__":
+    logger.info("🚀 Starting multi-account Spotify Tracker...")
+    main()
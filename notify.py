@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+logger = logging.getLogger('notify')
+
+# Local UDP port the tracker publishes to and the web app listens on.
+# UDP on the loopback interface works on every platform, and a message that
+# nobody is listening for is simply dropped, so the tracker never blocks on
+# the web app.
+NOTIFY_HOST = '127.0.0.1'
+NOTIFY_PORT = int(os.getenv('NOTIFY_PORT', 5055))
+MAX_MESSAGE_SIZE = 65507
+# Channel of the message queue on which the web app worker that receives the
+# notifications passes them on to the other workers (see serve.py)
+RELAY_CHANNEL = 'spotify-tracker-notifications'
+
+def playback_snapshot(playback, user_id=None, fetched_at=None):
+    """Reduce a `current_playback()` response to what the web app displays"""
+    fetched_at = fetched_at if fetched_at is not None else time.time()
+    if not playback or not playback.get('item'):
+        return {'event': 'playback', 'user_id': user_id, 'fetched_at': fetched_at, 'track': None}
+
+    track = playback['item']
+    images = track['album'].get('images') or []
+    # Use the medium size image (300x300) when available
+    album_cover = (images[1]['url'] if len(images) > 1 else images[0]['url']) if images else None
+    release_date = track['album'].get('release_date')
+    device = playback.get('device') or {}
+    return {
+        'event': 'playback',
+        'user_id': user_id,
+        'fetched_at': fetched_at,
+        'track': track['name'],
+        'track_id': track.get('id'),
+        'track_uri': track.get('uri'),
+        'artist': ', '.join([a['name'] for a in track['artists']]),
+        'artists': [a['name'] for a in track['artists']],
+        'album': track['album']['name'],
+        'device': device.get('name'),
+        'device_type': device.get('type'),
+        'album_cover': album_cover,
+        'progress_ms': playback.get('progress_ms') or 0,
+        'duration_ms': track.get('duration_ms') or 0,
+        'is_playing': playback.get('is_playing', False),
+        'release_year': release_date[:4] if release_date else None
+    }
+
+class Publisher:
+    """Sends notifications to the web app; never raises and never blocks"""
+
+    def __init__(self, host=NOTIFY_HOST, port=NOTIFY_PORT):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, message):
+        try:
+            data = json.dumps(message, default=str).encode()
+            if len(data) > MAX_MESSAGE_SIZE:
+                logger.warning(f"Notification of {len(data)} bytes is too large, dropped")
+                return
+            self.sock.sendto(data, self.address)
+        except OSError as e:
+            logger.debug(f"Could not publish notification: {e}")
+
+def dispatch(handlers, message):
+    """Call the handlers of a notification's event"""
+    for handler in handlers.get(message.get('event'), []):
+        try:
+            handler(message)
+        except Exception as e:
+            logger.error(f"❌ Error handling {message.get('event')} notification: {e}")
+
+class Listener:
+    """Receives notifications on a background thread and dispatches them by event name"""
+
+    def __init__(self, host=NOTIFY_HOST, port=NOTIFY_PORT):
+        self.address = (host, port)
+        self.handlers = {}
+        self.sock = None
+        self.thread = None
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def start(self):
+        """Bind the socket and start listening; returns False if the port is taken"""
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(self.address)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not listen for notifications on port {self.address[1]}: {e}")
+            self.sock = None
+            return False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        logger.info(f"👂 Listening for tracker notifications on port {self.address[1]}")
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(MAX_MESSAGE_SIZE)
+                message = json.loads(data)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Invalid notification received: {e}")
+                continue
+            dispatch(self.handlers, message)
+
+class Relay:
+    """Passes notifications between the worker processes of the web app
+    through a Redis message queue: the worker whose Listener receives them
+    publishes them, the others subscribe and dispatch them to their handlers"""
+
+    def __init__(self, url, channel=RELAY_CHANNEL):
+        if redis is None:
+            raise RuntimeError("Relaying notifications between workers needs redis - run: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.handlers = {}
+        self.thread = None
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def publish(self, message):
+        """Send a notification to the other workers; never raises"""
+        try:
+            self.client.publish(self.channel, json.dumps(message, default=str))
+        except redis.RedisError as e:
+            logger.warning(f"Could not relay notification: {e}")
+
+    def start(self):
+        """Subscribe and dispatch relayed notifications on a background thread"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        logger.info(f"👂 Listening for relayed notifications on '{self.channel}'")
+
+    def _run(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                for item in pubsub.listen():
+                    try:
+                        message = json.loads(item['data'])
+                    except ValueError as e:
+                        logger.warning(f"Invalid relayed notification received: {e}")
+                        continue
+                    dispatch(self.handlers, message)
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Lost the message queue, reconnecting: {e}")
+                time.sleep(1)
+            finally:
+                pubsub.close()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Monthly partitions of the listening history
+
+song_plays and play_artists in the main database hold the plays of the last
+HOT_MONTHS months. Older months are moved to one SQLite file per month under
+PARTITION_DIR, which is made read-only and only attached to a connection
+while a query that touches its month runs; the play_partitions table lists
+them. Listening stats are read from the rollup tables, which keep covering
+every month.
+
+Queries that read raw plays loop over `routed`, which yields the schema to
+query for the main database and for each partition in the query's date
+range. With RETENTION_MONTHS set, the raw plays of partitions older than that
+are deleted and only their rollups remain.
+
+Run this file (e.g. daily from cron) to move finished months out of the main
+database and apply the retention policy, or with `--list` to show the
+partitions.
+"""
+
+import os
+import sys
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import create_engine, text, MetaData
+from sqlalchemy.orm import aliased
+from models import SongPlay, PlayArtist, LOCAL_TZ
+import rollups
+
+logger = logging.getLogger('partitions')
+
+# Directory of the cold partitions, one plays-YYYY-MM.db per month
+PARTITION_DIR = os.getenv('PARTITION_DIR', 'partitions')
+# Months whose plays stay in the main database, including the current one
+HOT_MONTHS = max(1, int(os.getenv('HOT_MONTHS', 2)))
+# Months after which the raw plays of a partition are deleted (0 keeps them forever)
+RETENTION_MONTHS = int(os.getenv('RETENTION_MONTHS', 0))
+
+# Name a partition is attached under; partitions are attached one at a time
+COLD = 'cold'
+PARTITIONED_TABLES = ('song_plays', 'play_artists')
+
+# SongPlay and PlayArtist mapped onto the tables of an attached partition
+_cold_metadata = MetaData()
+ColdSongPlay = aliased(SongPlay, SongPlay.__table__.to_metadata(_cold_metadata, schema=COLD), adapt_on_names=True)
+ColdPlayArtist = aliased(PlayArtist, PlayArtist.__table__.to_metadata(_cold_metadata, schema=COLD), adapt_on_names=True)
+
+def play_entities(schema):
+    """(SongPlay, PlayArtist) entities to query the plays of a schema yielded by `routed`"""
+    return (SongPlay, PlayArtist) if schema == 'main' else (ColdSongPlay, ColdPlayArtist)
+
+def partition_path(month):
+    return os.path.join(PARTITION_DIR, f'plays-{month}.db')
+
+def shift_month(month, months):
+    """The month (YYYY-MM) `months` months after `month`"""
+    year, number = map(int, month.split('-'))
+    index = year * 12 + number - 1 + months
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+def current_month():
+    return datetime.now(LOCAL_TZ).strftime('%Y-%m')
+
+def cold_months(conn, first_day=None, last_day=None):
+    """Months with a partition whose plays overlap first_day..last_day (local dates), newest first"""
+    conditions = ['dropped_at IS NULL']
+    if first_day:
+        conditions.append('month >= substr(:first_day, 1, 7)')
+    if last_day:
+        conditions.append('month <= substr(:last_day, 1, 7)')
+    return [month for month, in conn.execute(text(
+        f"SELECT month FROM play_partitions WHERE {' AND '.join(conditions)} ORDER BY month DESC"),
+        {'first_day': first_day, 'last_day': last_day})]
+
+@contextmanager
+def attached(conn, month):
+    """Attach the partition of a month to `conn` (outside of a write transaction)"""
+    conn.exec_driver_sql(f'ATTACH DATABASE ? AS {COLD}', (partition_path(month),))
+    try:
+        yield COLD
+    finally:
+        conn.exec_driver_sql(f'DETACH DATABASE {COLD}')
+
+def routed(conn, first_day=None, last_day=None):
+    """Yield 'main', then attach the partition of every month between
+    first_day and last_day in turn and yield its schema
+
+    Queries run for each yielded schema, on `{schema}.song_plays` or on the
+    entities of `play_entities(schema)`, and combine the results.
+    """
+    months = routed_months(conn, first_day, last_day)
+    try:
+        for _, schema in months:
+            yield schema
+    finally:
+        # Detaches the partition when the caller stops early
+        months.close()
+
+def routed_months(conn, first_day=None, last_day=None):
+    """Like `routed`, yielding (month, schema) pairs; the month of 'main' is None"""
+    yield None, 'main'
+    for month in cold_months(conn, first_day, last_day):
+        if not os.path.exists(partition_path(month)):
+            # ATTACH would create an empty database instead
+            logger.error(f"❌ Partition of {month} is missing: {partition_path(month)}")
+            continue
+        with attached(conn, month) as schema:
+            yield month, schema
+
+@contextmanager
+def partition_connection(month):
+    """A connection of its own to the partition of a month"""
+    engine = create_engine(f'sqlite:///{partition_path(month)}')
+    try:
+        with engine.connect() as partition:
+            yield partition
+    finally:
+        engine.dispose()
+
+def partition_connections(conn):
+    """Yield a connection to every partition in turn, e.g. for rollups.rebuild"""
+    for month in cold_months(conn):
+        with partition_connection(month) as partition:
+            yield partition
+
+def create_partition(conn, path):
+    """Create a partition database with the tables and indexes of the main database
+
+    The change_seq trigger stays behind: partitions are never written to
+    after their plays are moved.
+    """
+    schema = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE tbl_name IN ('song_plays', 'play_artists') AND sql IS NOT NULL "
+        "AND type IN ('table', 'index') ORDER BY type = 'index'")).fetchall()
+    engine = create_engine(f'sqlite:///{path}')
+    try:
+        with engine.begin() as partition:
+            for sql, in schema:
+                partition.exec_driver_sql(sql)
+    finally:
+        engine.dispose()
+
+def move_month(conn, month, newest_id):
+    """Move the closed plays of a month to its partition; returns the number moved"""
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    path = partition_path(month)
+    if not os.path.exists(path):
+        create_partition(conn, path)
+    os.chmod(path, 0o644)
+
+    # The newest play stays, so SQLite keeps assigning ids above those of
+    # the moved plays; it is moved with the rest of a later month
+    where = ('song_plays.local_date >= :first_day AND song_plays.local_date < :next_month '
+             'AND song_plays.rolled_up = 1 AND song_plays.id < :newest_id')
+    params = {'first_day': f'{month}-01', 'next_month': f'{shift_month(month, 1)}-01', 'newest_id': newest_id}
+    with attached(conn, month) as schema:
+        # Copied first and deleted in a second transaction: after a crash in
+        # between, the next run copies the plays again (replacing them) and
+        # deletes them
+        for table in PARTITIONED_TABLES:
+            columns = ', '.join(row[1] for row in conn.execute(text(f'PRAGMA {schema}.table_info({table})')))
+            plays = f'SELECT song_plays.id FROM main.song_plays WHERE {where}'
+            source = (f'SELECT {columns} FROM main.song_plays AS song_plays WHERE {where}' if table == 'song_plays'
+                      else f'SELECT {columns} FROM main.play_artists WHERE play_id IN ({plays})')
+            conn.execute(text(f'INSERT OR REPLACE INTO {schema}.{table} ({columns}) {source}'), params)
+        conn.commit()
+
+        conn.execute(text(f'DELETE FROM main.play_artists WHERE play_id IN '
+                          f'(SELECT song_plays.id FROM main.song_plays WHERE {where})'), params)
+        moved = conn.execute(text(f'DELETE FROM main.song_plays WHERE {where}'), params).rowcount
+        conn.execute(text(
+            'INSERT INTO play_partitions (month, plays, updated_at) VALUES (:month, :plays, :now) '
+            'ON CONFLICT (month) DO UPDATE SET plays = excluded.plays, updated_at = excluded.updated_at'
+        ), {'month': month, 'now': datetime.utcnow(),
+            'plays': conn.execute(text(f'SELECT count(*) FROM {schema}.song_plays')).scalar()})
+        conn.commit()
+    os.chmod(path, 0o444)
+    return moved
+
+def roll_over(engine, month=None):
+    """Move the plays of the months before the hot window to their partitions;
+    returns the number of plays moved"""
+    first_hot_month = shift_month(month or current_month(), 1 - HOT_MONTHS)
+    moved = 0
+    with engine.connect() as conn:
+        # Plays that were never closed are rolled up like rollups.rebuild does,
+        # so every moved play is in the rollups
+        cutoff_ms = int((time.time() - rollups.ABANDONED_PLAY_AGE.total_seconds()) * 1000)
+        rollups.roll_up(conn, 'song_plays.local_date < :first_day AND song_plays.timestamp_ms < :cutoff_ms',
+                        {'first_day': f'{first_hot_month}-01', 'cutoff_ms': cutoff_ms})
+        conn.commit()
+
+        newest_id = conn.execute(text('SELECT max(id) FROM song_plays')).scalar()
+        months = [cold_month for cold_month, in conn.execute(text(
+            'SELECT DISTINCT substr(local_date, 1, 7) FROM song_plays WHERE local_date < :first_day ORDER BY 1'
+        ), {'first_day': f'{first_hot_month}-01'})]
+        conn.commit()
+        for cold_month in months:
+            count = move_month(conn, cold_month, newest_id)
+            if count:
+                logger.info(f"📦 Moved {count} plays of {cold_month} to {partition_path(cold_month)}")
+            moved += count
+    return moved
+
+def apply_retention(engine, month=None):
+    """Delete the raw plays of partitions older than RETENTION_MONTHS, keeping
+    their rollups; returns the months dropped"""
+    if RETENTION_MONTHS <= 0:
+        return []
+    oldest_kept = shift_month(month or current_month(), -RETENTION_MONTHS)
+    with engine.begin() as conn:
+        months = [cold_month for cold_month in cold_months(conn) if cold_month < oldest_kept]
+        for dropped in months:
+            conn.execute(text('UPDATE play_partitions SET dropped_at = :now WHERE month = :month'),
+                         {'now': datetime.utcnow(), 'month': dropped})
+    for dropped in months:
+        if os.path.exists(partition_path(dropped)):
+            os.remove(partition_path(dropped))
+        logger.info(f"🗑️ Dropped the raw plays of {dropped}; its rollups remain")
+    return months
+
+if __name__ == "__main__":
+    from models import engine
+
+    if sys.argv[1:] == ['--list']:
+        with engine.connect() as conn:
+            for month, plays, updated_at, dropped_at in conn.execute(text(
+                    'SELECT month, plays, updated_at, dropped_at FROM play_partitions ORDER BY month')):
+                state = f'dropped {dropped_at}' if dropped_at else partition_path(month)
+                print(f"{month}  {plays:>8} plays  {state}")
+            hot = conn.execute(text('SELECT count(*) FROM song_plays')).scalar()
+            print(f"hot      {hot:>8} plays  song_plays")
+        sys.exit(0)
+    if sys.argv[1:]:
+        print("Usage: python partitions.py [--list]")
+        sys.exit(1)
+
+    moved = roll_over(engine)
+    dropped = apply_retention(engine)
+    print(f"Moved {moved} plays to {PARTITION_DIR}" + (f", dropped {', '.join(dropped)}" if dropped else ''))
@@ -0,0 +1,78 @@
+"""
+In-process cache of the JSON responses of read endpoints
+
+Responses are keyed on the endpoint, its arguments and the version of the
+database they were computed from (see `history.version`: every play the
+tracker inserts or updates takes the next number of the change sequence in
+the same transaction), so the dashboard's periodic refreshes reuse them until
+the data actually changes and entries of older versions simply stop being
+used. Bodies are kept as sent, compressed in the content encoding they were
+sent with (see responses.py), so a hit costs neither serialization nor
+compression. The cache holds at most RESPONSE_CACHE_MB of response bodies and evicts
+the least recently used ones beyond that.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Size of the response bodies the cache holds, in megabytes (0 disables it)
+RESPONSE_CACHE_MB = float(os.getenv('RESPONSE_CACHE_MB', 64))
+
+class ResponseCache:
+    """LRU cache of response bodies (bytes, with their content encoding)
+    bounded by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """(body, content encoding) cached under `key`, or None (counted as a miss)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, encoding=None):
+        """Cache `body` (in content `encoding`) under `key`, evicting the least
+        recently used bodies to make room"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._entries[key] = (body, encoding)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Serialization and compression of the web app's responses
+
+JSON responses and Socket.IO events are written by the serializer named by
+JSON_SERIALIZER: orjson, which serializes dicts, lists and datetimes
+natively and is used when it is installed, or the json module. Either way datetimes come out in
+ISO 8601 and keys keep their order. Responses of at least COMPRESS_MIN_SIZE
+bytes are compressed with brotli or gzip, whichever the client prefers in
+Accept-Encoding (brotli needs the optional brotli package); the cover URLs,
+artist and album names repeated across a history make it shrink several
+times over.
+
+Run this file with `--benchmark` to compare serializers and encodings on a
+100k-row history.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import date, datetime
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON serializer of the responses: orjson (the default when installed) or json
+JSON_SERIALIZER = os.getenv('JSON_SERIALIZER', 'orjson' if orjson else 'json')
+# Smallest response body that is compressed (bytes)
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# Compression levels: fast enough for each cache miss, most of the size gain
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'text/javascript',
+                      'application/javascript')
+
+def default(value):
+    """JSON value of the types the serializers don't handle themselves"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(payload):
+    return json.dumps(payload, default=default, separators=(',', ':'), ensure_ascii=False).encode()
+
+def dumps_orjson(payload):
+    return orjson.dumps(payload, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+SERIALIZERS = {'json': dumps_json}
+if orjson is not None:
+    SERIALIZERS['orjson'] = dumps_orjson
+
+if JSON_SERIALIZER not in SERIALIZERS:
+    raise RuntimeError(f"Unknown or unavailable JSON_SERIALIZER '{JSON_SERIALIZER}', "
+                       f"use one of: {', '.join(SERIALIZERS)}")
+dumps = SERIALIZERS[JSON_SERIALIZER]
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (app.json) that writes with `dumps`"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+class SocketIOJSON:
+    """JSON module of the Socket.IO packets (SocketIO(json=...)) that writes
+    with `dumps`, so pushed events serialize like the responses"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return dumps(obj).decode()
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return json.loads(data)
+
+def encodings():
+    """Content encodings this server can write, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate(accept_encodings):
+    """The content encoding to send to a client with these (werkzeug)
+    accept_encodings, or None for the identity"""
+    return accept_encodings.best_match(encodings())
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def compress_response(response, accept_encodings):
+    """Compress a response of at least COMPRESS_MIN_SIZE bytes with the
+    encoding the client prefers (for app.after_request)
+
+    Streamed responses and files are left alone. The ETag of an encoded
+    response is made weak, as its bytes differ from the identity's.
+    """
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    if not response.content_encoding:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(accept_encodings)
+        if not encoding:
+            return response
+        response.set_data(compress(body, encoding))
+        response.content_encoding = encoding
+    if response.content_encoding in encodings():
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+    return response
+
+def benchmark(rows=100000):
+    """Serialization time and bytes on the wire of a `rows`-row history"""
+    import synthetic
+
+    songs = [{
+        'track_name': play['track_name'], 'artist_name': play['artist_name'],
+        'artists': play['artist_name'].split(', '), 'album_name': play['album_name'],
+        'device_name': play['device_name'], 'device_type': play['device_type'],
+        'timestamp': play['start_time'].astimezone(), 'date': play['local_date'],
+        'album_cover': play['album_cover_url'], 'track_uri': play['track_uri'],
+        'played_duration_ms': play['played_duration_ms'], 'track_duration_ms': play['track_duration_ms'],
+        'is_completed': play['is_completed'], 'start_time': play['start_time'].strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        'end_time': play['end_time'].strftime('%Y-%m-%dT%H:%M:%S.%f'), 'plays': 1
+    } for play in synthetic.plays(rows)]
+    payload = {'songs': songs, 'change_seq': rows, 'full': True}
+    print(f"History of {rows} rows")
+
+    def timed(function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        return result, (time.perf_counter() - started) * 1000
+
+    for name, serializer in SERIALIZERS.items():
+        body, elapsed = timed(serializer, payload)
+        print(f"{name:<8} {elapsed:8.1f}ms  {len(body) / 1e6:6.2f} MB")
+    # Stock jsonify: datetimes turned into strings first, then sorted keys
+    started = time.perf_counter()
+    stock = json.dumps({**payload, 'songs': [dict(song, timestamp=song['timestamp'].isoformat()) for song in songs]},
+                       sort_keys=True).encode()
+    print(f"{'stock':<8} {(time.perf_counter() - started) * 1000:8.1f}ms  {len(stock) / 1e6:6.2f} MB")
+
+    body = dumps(payload)
+    for encoding in encodings():
+        compressed, elapsed = timed(compress, body, encoding)
+        print(f"{encoding:<8} {elapsed:8.1f}ms  {len(compressed) / 1e6:6.2f} MB on the wire "
+              f"({len(body) / len(compressed):.1f}x smaller)")
+    if brotli is None:
+        print("brotli   not installed (pip install brotli)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serialization and compression of the web app's responses")
+    parser.add_argument('--benchmark', action='store_true', help="Compare serializers and encodings")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows of the benchmark's history")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_usage()
+        sys.exit(1)
+    benchmark(args.rows)
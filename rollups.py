@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Rollup tables of listening stats
+
+Plays are added to the hourly, artist and track rollups and to the all-time
+totals in the same transaction that closes them, so stats can be read from a
+few buckets per day instead of from every play ever recorded. Plays that are
+not rolled up yet (the song playing right now, or plays whose tracker stopped
+before closing them) are read from song_plays and added on top.
+
+Run this file with `--rebuild` to recompute the rollups from the raw plays.
+"""
+
+import sys
+import time
+import logging
+from datetime import timedelta
+from sqlalchemy import text
+
+logger = logging.getLogger('rollups')
+
+# Plays that were never closed are rolled up by a rebuild once they are this old
+ABANDONED_PLAY_AGE = timedelta(hours=24)
+
+# (table, columns, query, conflict target) adding the plays matching {where} to a rollup
+ROLLUPS = [
+    ('hourly_rollups', 'local_date, local_hour, device_name, plays, listened_ms, completed',
+     """SELECT local_date, local_hour, coalesce(device_name, ''), count(*),
+               coalesce(sum(played_duration_ms), 0), coalesce(sum(is_completed), 0)
+        FROM song_plays WHERE {where}
+        GROUP BY local_date, local_hour, coalesce(device_name, '')""",
+     'local_date, local_hour, device_name'),
+    ('artist_rollups', 'local_date, artist_id, plays, listened_ms, completed',
+     """SELECT local_date, play_artists.artist_id, count(*),
+               coalesce(sum(played_duration_ms), 0), coalesce(sum(is_completed), 0)
+        FROM song_plays JOIN play_artists ON play_artists.play_id = song_plays.id WHERE {where}
+        GROUP BY local_date, play_artists.artist_id""",
+     'local_date, artist_id'),
+    ('track_rollups', 'local_date, track_id, plays, listened_ms, completed',
+     """SELECT local_date, coalesce(track_id, ''), count(*),
+               coalesce(sum(played_duration_ms), 0), coalesce(sum(is_completed), 0)
+        FROM song_plays WHERE {where}
+        GROUP BY local_date, coalesce(track_id, '')""",
+     'local_date, track_id')
+]
+
+# Adds the plays matching {where} to the single row of all-time totals
+TOTAL = """
+    INSERT INTO total_rollups (id, plays, listened_ms, completed)
+    SELECT 1, count(*), coalesce(sum(played_duration_ms), 0), coalesce(sum(is_completed), 0)
+    FROM song_plays WHERE {where}
+    ON CONFLICT (id) DO UPDATE SET plays = plays + excluded.plays,
+        listened_ms = listened_ms + excluded.listened_ms, completed = completed + excluded.completed"""
+
+UPSERT = """
+        ON CONFLICT ({target}) DO UPDATE SET plays = plays + excluded.plays,
+            listened_ms = listened_ms + excluded.listened_ms, completed = completed + excluded.completed"""
+
+# Plays that are not in the rollups; matches the partial index ix_song_plays_pending_rollup
+PENDING = 'song_plays.rolled_up = 0'
+
+# Rollup rows of months whose raw plays were deleted by the retention policy
+# (see partitions.py) can't be recomputed, so a rebuild keeps them
+DROPPED = 'substr(local_date, 1, 7) IN (SELECT month FROM play_partitions WHERE dropped_at IS NOT NULL)'
+
+def roll_up(conn, where, params=None):
+    """Add the plays matching `where` that are not rolled up yet to the rollups;
+    returns the number of plays added"""
+    where = f'{PENDING} AND song_plays.local_date IS NOT NULL AND ({where})'
+    for table, columns, query, target in ROLLUPS:
+        conn.execute(text(f'INSERT INTO {table} ({columns}) {query.format(where=where)}' + UPSERT.format(target=target)),
+                     params or {})
+    conn.execute(text(TOTAL.format(where=where)), params or {})
+    return conn.execute(text(f'UPDATE song_plays SET rolled_up = 1 WHERE {where}'), params or {}).rowcount
+
+def roll_up_play(session, play_id):
+    """Add a play that was just closed to the rollups, in the session's transaction"""
+    roll_up(session.connection(), 'song_plays.id = :play_id', {'play_id': play_id})
+
+def add_partition(conn, partition):
+    """Add all plays of a cold partition (a connection to its database) to the rollups"""
+    for table, columns, query, target in ROLLUPS:
+        rows = partition.execute(text(query.format(where='song_plays.local_date IS NOT NULL'))).fetchall()
+        if rows:
+            names = [f'c{index}' for index in range(len(rows[0]))]
+            conn.execute(text(f"INSERT INTO {table} ({columns}) VALUES ({', '.join(':' + name for name in names)})"
+                              + UPSERT.format(target=target)), [dict(zip(names, row)) for row in rows])
+
+def reset_total(conn):
+    """Recompute the all-time totals from the hourly rollups, which also hold
+    the months whose raw plays were dropped"""
+    conn.execute(text('DELETE FROM total_rollups'))
+    conn.execute(text(
+        'INSERT INTO total_rollups (id, plays, listened_ms, completed) '
+        'SELECT 1, coalesce(sum(plays), 0), coalesce(sum(listened_ms), 0), coalesce(sum(completed), 0) '
+        'FROM hourly_rollups'))
+
+def rebuild(conn, partitions=()):
+    """Recompute all rollups from the raw plays in song_plays and in `partitions`
+    (connections to the cold partitions)"""
+    for table, _, _, _ in ROLLUPS:
+        conn.execute(text(f'DELETE FROM {table} WHERE NOT {DROPPED}'))
+    conn.execute(text('UPDATE song_plays SET rolled_up = 0 WHERE rolled_up = 1'))
+    cutoff_ms = int((time.time() - ABANDONED_PLAY_AGE.total_seconds()) * 1000)
+    plays = roll_up(conn, 'song_plays.end_time IS NOT NULL OR song_plays.timestamp_ms < :cutoff_ms',
+                    {'cutoff_ms': cutoff_ms})
+    for partition in partitions:
+        add_partition(conn, partition)
+    reset_total(conn)
+    logger.info(f"✅ Rolled up {plays} plays")
+    return plays
+
+def totals(session, local_date=None):
+    """Plays, listened milliseconds and completed plays, overall or of one day"""
+    if local_date is None:
+        return listening_totals(session, '')['all_time']
+    return listening_totals(session, local_date)['today']
+
+def listening_totals(session, local_date):
+    """All-time totals and those of `local_date`, in one query
+
+    All-time totals are read from the single row of total_rollups, which
+    rolling a play up increments, and today's from the day's hourly rollups,
+    so the query reads the same few rows however long the history is. Plays
+    that are not rolled up yet are added to both.
+    """
+    row = session.execute(text(f"""
+        SELECT coalesce(sum(all_time * plays), 0), coalesce(sum(all_time * listened_ms), 0),
+               coalesce(sum(all_time * completed), 0),
+               coalesce(sum(CASE WHEN local_date = :day THEN plays END), 0),
+               coalesce(sum(CASE WHEN local_date = :day THEN listened_ms END), 0),
+               coalesce(sum(CASE WHEN local_date = :day THEN completed END), 0) FROM (
+            SELECT 1 AS all_time, NULL AS local_date, plays, listened_ms, completed FROM total_rollups
+            UNION ALL
+            SELECT 0, local_date, plays, listened_ms, completed FROM hourly_rollups WHERE local_date = :day
+            UNION ALL
+            SELECT 1, local_date, 1, coalesce(played_duration_ms, 0), coalesce(is_completed, 0) FROM song_plays
+            WHERE {PENDING}
+        )"""), {'day': local_date}).one()
+    keys = ('plays', 'listened_ms', 'completed')
+    return {'all_time': dict(zip(keys, row[:3])), 'today': dict(zip(keys, row[3:]))}
+
+def catalog_counts(session):
+    """Artists and albums ever played: the catalog only gains them from
+    plays, and keeps those of dropped months like the totals do"""
+    row = session.execute(text('SELECT (SELECT count(*) FROM artists), (SELECT count(*) FROM albums)')).one()
+    return {'artists': row[0], 'albums': row[1]}
+
+def chart_stats(session, first_day, top=10):
+    """Plays per hour of the day, per day since `first_day`, per device and of
+    the `top` artists"""
+    hourly = [0] * 24
+    for hour, plays in session.execute(text(f"""
+            SELECT local_hour, sum(plays) FROM (
+                SELECT local_hour, plays FROM hourly_rollups
+                UNION ALL
+                SELECT local_hour, 1 FROM song_plays WHERE {PENDING} AND local_hour IS NOT NULL
+            ) GROUP BY local_hour""")):
+        hourly[hour] = plays
+
+    daily = dict(session.execute(text(f"""
+        SELECT local_date, sum(plays) FROM (
+            SELECT local_date, plays FROM hourly_rollups WHERE local_date >= :first_day
+            UNION ALL
+            SELECT local_date, 1 FROM song_plays WHERE {PENDING} AND local_date >= :first_day
+        ) GROUP BY local_date"""), {'first_day': first_day}).all())
+
+    devices = dict(session.execute(text(f"""
+        SELECT device, sum(plays) FROM (
+            SELECT coalesce(nullif(device_name, ''), 'Unknown') AS device, plays FROM hourly_rollups
+            UNION ALL
+            SELECT coalesce(nullif(device_name, ''), 'Unknown'), 1 FROM song_plays WHERE {PENDING}
+        ) GROUP BY device""")).all())
+
+    # Grouped by name: an artist can have a Spotify ID and a "local:" id
+    top_artists = [list(row) for row in session.execute(text(f"""
+        SELECT artists.name, sum(plays) AS total FROM (
+            SELECT artist_id, plays FROM artist_rollups
+            UNION ALL
+            SELECT play_artists.artist_id, 1 FROM song_plays
+            JOIN play_artists ON play_artists.play_id = song_plays.id WHERE {PENDING}
+        ) AS counts JOIN artists ON artists.id = counts.artist_id
+        GROUP BY artists.name ORDER BY total DESC LIMIT :top"""), {'top': top})]
+
+    return {'hourly': hourly, 'daily': daily, 'devices': devices, 'top_artists': top_artists}
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ['--rebuild']:
+        print("Usage: python rollups.py --rebuild")
+        sys.exit(1)
+    from models import engine
+    from partitions import partition_connections
+
+    with engine.begin() as conn:
+        plays = rebuild(conn, partition_connections(conn))
+    print(f"Rolled up {plays} plays")
@@ -24,19 +24,21 @@ load_dotenv()
 log_level_str = os.getenv('LOG_LEVEL', 'ERROR').upper()
 log_level = getattr(logging, log_level_str, logging.ERROR)
 
-# Create a custom formatter that uses Berlin timezone
-class BerlinTimeFormatter(logging.Formatter):
+# Timezone used for log timestamps (and by the app for local dates)
+local_tz = pytz.timezone(os.getenv('TIMEZONE', 'Europe/Berlin'))
+
+# Create a custom formatter that uses the configured timezone
+class LocalTimeFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
-        # Convert to Berlin timezone
-        berlin_tz = pytz.timezone('Europe/Berlin')
-        dt = datetime.fromtimestamp(record.created, berlin_tz)
+        # Convert to the configured timezone
+        dt = datetime.fromtimestamp(record.created, local_tz)
         if datefmt:
             return dt.strftime(datefmt)
         else:
             return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 # Configure logging with custom formatter
-formatter = BerlinTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 # Create handlers
 file_handler = logging.FileHandler('output.log')
@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import logging
+import requests
+from spotipy.exceptions import SpotifyException
+
+logger = logging.getLogger('scheduler')
+
+# Interval of the old fixed polling loop, used as the baseline for the
+# "API calls saved" statistic
+BASELINE_INTERVAL = 5
+
+# Polling bounds (seconds), configurable through the environment
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', 1))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 15))  # Longest sleep while a song plays
+POLL_IDLE_INTERVAL = float(os.getenv('POLL_IDLE_INTERVAL', 5))  # First sleep once playback stops
+POLL_IDLE_MAX_INTERVAL = float(os.getenv('POLL_IDLE_MAX_INTERVAL', 120))
+POLL_ERROR_MAX_INTERVAL = float(os.getenv('POLL_ERROR_MAX_INTERVAL', 300))
+
+class PollScheduler:
+    """Decides when the tracker should call `current_playback()` next.
+
+    While a song is playing the next poll is placed relative to the expected
+    end of the track: sparse in the middle of a song, dense right before it
+    ends. While nothing is playing the interval backs off exponentially, and
+    API errors back off exponentially as well (or wait for `Retry-After`).
+    """
+
+    def __init__(self,
+                 min_interval=POLL_MIN_INTERVAL,
+                 max_interval=POLL_MAX_INTERVAL,
+                 idle_interval=POLL_IDLE_INTERVAL,
+                 idle_max_interval=POLL_IDLE_MAX_INTERVAL,
+                 error_max_interval=POLL_ERROR_MAX_INTERVAL,
+                 end_grace=1.0,
+                 jitter=0.1,
+                 clock=time.monotonic,
+                 rng=random.random):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.idle_max_interval = idle_max_interval
+        self.error_max_interval = error_max_interval
+        self.end_grace = end_grace
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = rng
+
+        self.started_at = clock()
+        self.calls = 0
+        self.idle_polls = 0
+        self.errors = 0
+
+    def _jittered(self, delay):
+        """Spread polls out a little so several trackers don't line up"""
+        factor = 1 + self.jitter * (2 * self.rng() - 1)
+        return max(self.min_interval, delay * factor)
+
+    def after_playback(self, playback):
+        """Return the delay in seconds until the next poll after a successful call"""
+        self.calls += 1
+        self.errors = 0
+
+        if playback and playback.get('item') and playback.get('is_playing'):
+            self.idle_polls = 0
+            progress_ms = playback.get('progress_ms') or 0
+            duration_ms = playback['item'].get('duration_ms') or 0
+            remaining = max(0.0, (duration_ms - progress_ms) / 1000)
+
+            if remaining <= self.max_interval:
+                # The track ends before the next regular poll would happen;
+                # poll just after the expected end to catch the next track.
+                # No jitter here - the point is to be on time.
+                return max(self.min_interval, remaining + self.end_grace)
+
+            # Halve the remaining time so polls get denser towards the end,
+            # but never sleep so long that a skip goes unnoticed for too long
+            return self._jittered(min(self.max_interval, remaining / 2))
+
+        # Paused or nothing playing: back off exponentially
+        delay = min(self.idle_max_interval, self.idle_interval * (2 ** self.idle_polls))
+        self.idle_polls += 1
+        return self._jittered(delay)
+
+    def after_error(self, error):
+        """Return the delay in seconds until the next poll after a failed call"""
+        self.calls += 1
+        self.errors += 1
+
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            logger.warning(f"🚫 Spotify API rate limit - retrying after {retry_after}s")
+            return retry_after + self.rng()
+
+        if isinstance(error, SpotifyException) and error.http_status == 401:
+            logger.error("🔐 Spotify authentication error - check your credentials")
+        elif isinstance(error, requests.exceptions.Timeout):
+            logger.warning("⏰ Spotify API timeout - waiting longer before retry")
+
+        delay = min(self.error_max_interval, BASELINE_INTERVAL * (2 ** (self.errors - 1)))
+        return self._jittered(delay)
+
+    @staticmethod
+    def retry_after(error):
+        """Return the `Retry-After` header of a rate-limited response in seconds, if any"""
+        headers = getattr(error, 'headers', None)
+        if headers is None:
+            response = getattr(error, 'response', None)
+            headers = getattr(response, 'headers', None)
+        if not headers:
+            return None
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self):
+        """API calls made vs. what the fixed 5 second loop would have made"""
+        elapsed = self.clock() - self.started_at
+        baseline = int(elapsed / BASELINE_INTERVAL) + 1
+        saved = max(0, baseline - self.calls)
+        return {
+            'calls': self.calls,
+            'baseline_calls': baseline,
+            'saved_calls': saved,
+            'saved_percentage': round(saved / baseline * 100, 1) if baseline else 0.0
+        }
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Full-text search over the tracks of the listening history
+
+track_search is an SQLite FTS5 table with one row per track: its name, its
+artists and its album, indexed for prefix queries. A track is added when its
+first play is stored, so /api/search can answer as the user types instead of
+the browser filtering the whole history.
+
+Run this file with `--rebuild` to refill the index from the catalog, or with
+`--benchmark` to measure per-keystroke latency on synthetic tracks.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+import unicodedata
+import tempfile
+import itertools
+from sqlalchemy import text
+from rollups import PENDING
+
+logger = logging.getLogger('search')
+
+# Matches of a query that are ranked, the best by bm25 or, for a single one or
+# two letter prefix, the most recently added; more rank better but slower
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 200))
+# Separates the artist names in track_search.artists; the tokenizer treats it as whitespace
+ARTIST_SEPARATOR = '\x1f'
+
+def create_index(conn):
+    """Create the index; words of up to 6 typed characters are looked up in prefix indexes"""
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS track_search USING fts5("
+        "track_id UNINDEXED, track_name, artists, album_name, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3 4 5 6')"
+    ))
+
+def index_track(conn, track_id, track_name, artists, album_name):
+    """Add a track to the index"""
+    index_tracks(conn, [(track_id, track_name, artists, album_name)])
+
+def index_tracks(conn, tracks):
+    """Add (track_id, track_name, artists, album_name) tuples to the index in one statement"""
+    conn.exec_driver_sql(
+        'INSERT INTO track_search (track_id, track_name, artists, album_name) VALUES (?, ?, ?, ?)',
+        [(track_id, track_name or '', ARTIST_SEPARATOR.join(artists), album_name or '')
+         for track_id, track_name, artists, album_name in tracks])
+
+# Artist ids of the first play of every track, in the order Spotify lists them
+TRACK_ARTISTS = """
+    SELECT song_plays.track_id, play_artists.artist_id FROM song_plays
+    JOIN play_artists ON play_artists.play_id = song_plays.id
+    WHERE song_plays.id IN (SELECT min(id) FROM song_plays WHERE track_id IS NOT NULL GROUP BY track_id)
+    ORDER BY song_plays.track_id, play_artists.position"""
+
+def rebuild(conn, partitions=(), batch_size=5000):
+    """Refill the index from the tracks, albums and artists; the artists of
+    tracks whose plays were all moved to partitions are read from
+    `partitions` (connections to them)"""
+    track_artists = {}
+    for source in itertools.chain([conn], partitions):
+        found = {}
+        for track_id, artist_id in source.execute(text(TRACK_ARTISTS)):
+            if track_id not in track_artists:
+                found.setdefault(track_id, []).append(artist_id)
+        track_artists.update(found)
+    names = dict(conn.execute(text('SELECT id, name FROM artists')).all())
+
+    conn.execute(text('DELETE FROM track_search'))
+    tracks = conn.execute(text(
+        'SELECT tracks.id, tracks.name, albums.name FROM tracks LEFT JOIN albums ON albums.id = tracks.album_id'
+    )).fetchall()
+    for offset in range(0, len(tracks), batch_size):
+        conn.execute(text(
+            'INSERT INTO track_search (track_id, track_name, artists, album_name) '
+            'VALUES (:track_id, :track_name, :artists, :album_name)'
+        ), [{'track_id': track_id, 'track_name': track_name or '', 'album_name': album_name or '',
+             'artists': ARTIST_SEPARATOR.join(names.get(artist_id, '') for artist_id in track_artists.get(track_id, []))}
+            for track_id, track_name, album_name in tracks[offset:offset + batch_size]])
+    conn.execute(text("INSERT INTO track_search (track_search) VALUES ('optimize')"))
+    logger.info(f"✅ Indexed {len(tracks)} tracks for search")
+    return len(tracks)
+
+def words(value):
+    """Lowercase words of a name without diacritics, as the index tokenizes them"""
+    value = value or ''
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+    return re.findall(r'\w+', ''.join(char for char in value if not unicodedata.combining(char)).lower())
+
+def match_query(query):
+    """FTS5 query matching tracks that contain a word starting with each typed word"""
+    return ' '.join(f'"{word}"*' for word in words(query))
+
+# Weight of a typed word found in the track name, its artists and its album
+COLUMN_WEIGHTS = (10, 5, 2)
+
+# Longest single typed word whose matches are too many to rank them all
+SHORT_PREFIX = 2
+
+def score(typed, columns):
+    """Relevance of a track: for every typed word, the weight of the best
+    column containing a word it is a prefix of, doubled for whole words"""
+    total = 0
+    for word in typed:
+        total += max([weight * (2 if word in names else 1)
+                      for weight, names in zip(COLUMN_WEIGHTS, columns)
+                      if any(name.startswith(word) for name in names)] or [0])
+    return total
+
+def search(session, query, limit=10):
+    """Tracks matching `query`, best match first, with their number of plays"""
+    match = match_query(query)
+    if not match:
+        return []
+    typed = words(query)
+    if len(typed) == 1 and len(typed[0]) <= SHORT_PREFIX:
+        # Ranking every match of a prefix like "a" costs time proportional to
+        # the size of the index, so only the SEARCH_CANDIDATES most recently
+        # added matches are ranked; walking the index by rowid stops after them
+        order = 'rowid DESC'
+    else:
+        # Longer queries match few enough tracks for bm25 to rank them all,
+        # with the columns weighted like `score` weights them
+        order = f"bm25(track_search, 0, {', '.join(map(str, COLUMN_WEIGHTS))})"
+    candidates = session.execute(text(
+        'SELECT track_id, track_name, artists, album_name FROM track_search '
+        f'WHERE track_search MATCH :match ORDER BY {order} LIMIT :candidates'
+    ), {'match': match, 'candidates': SEARCH_CANDIDATES}).fetchall()
+    hits = sorted(candidates, key=lambda row: -score(typed, [words(value) for value in row[1:]]))[:limit]
+    if not hits:
+        return []
+
+    track_ids = {f't{index}': row[0] for index, row in enumerate(hits)}
+    details = {row[0]: row[1:] for row in session.execute(text(f"""
+        SELECT tracks.id, tracks.uri, albums.cover_url,
+               coalesce((SELECT sum(plays) FROM track_rollups WHERE track_rollups.track_id = tracks.id), 0) +
+               (SELECT count(*) FROM song_plays WHERE {PENDING} AND song_plays.track_id = tracks.id)
+        FROM tracks LEFT JOIN albums ON albums.id = tracks.album_id
+        WHERE tracks.id IN ({', '.join(':' + name for name in track_ids)})"""), track_ids)}
+    results = []
+    for track_id, track_name, artists, album_name in hits:
+        uri, cover_url, plays = details.get(track_id, (None, None, None))
+        results.append({
+            'track_id': track_id,
+            'track_name': track_name,
+            'artists': artists.split(ARTIST_SEPARATOR) if artists else [],
+            'album_name': album_name,
+            'track_uri': uri,
+            'album_cover': cover_url,
+            'plays': plays or 0
+        })
+    return results
+
+SYLLABLES = ('la ri mo ka se ne to vi ra lu mi ko da be sa no ti ve ga ro '
+             'shi en an or el us ar in om ul').split()
+
+def benchmark(tracks=1000000, queries=200):
+    """Measure search latency per keystroke with `tracks` synthetic tracks"""
+    directory = tempfile.mkdtemp(prefix='spotify-search-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from models import engine, ReadSession
+
+    rng = random.Random(1)
+    # Word frequencies follow a power law, as in real track names; the most
+    # common word is in about one in ten tracks
+    vocabulary = list({''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) for _ in range(50000)})
+    weights = list(itertools.accumulate(1 / (rank + 10) for rank in range(len(vocabulary))))
+    def name(words):
+        return ' '.join(word.capitalize() for word in rng.choices(vocabulary, cum_weights=weights, k=words))
+    artists = [name(2) for _ in range(20000)]
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for offset in range(0, tracks, 50000):
+            rows = [{'track_id': f'track{index}', 'track_name': name(rng.randint(1, 4)),
+                     'artists': ARTIST_SEPARATOR.join(rng.sample(artists, rng.choice((1, 1, 1, 2)))),
+                     'album_name': name(2)} for index in range(offset, min(tracks, offset + 50000))]
+            conn.execute(text(
+                'INSERT INTO track_search (track_id, track_name, artists, album_name) '
+                'VALUES (:track_id, :track_name, :artists, :album_name)'), rows)
+        conn.execute(text("INSERT INTO track_search (track_search) VALUES ('optimize')"))
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    print(f"Indexed {tracks} tracks in {time.perf_counter() - started:.1f}s")
+
+    # Type the first words of random track names, one keystroke at a time
+    keystrokes = []
+    session = ReadSession()
+    try:
+        samples = session.execute(text(
+            'SELECT track_name, artists FROM track_search WHERE rowid IN (SELECT abs(random()) % :tracks + 1 '
+            'FROM track_search LIMIT :queries)'), {'tracks': tracks, 'queries': queries}).fetchall()
+        for track_name, track_artists in samples:
+            typed = f"{track_name.split()[0]} {track_artists.split(ARTIST_SEPARATOR)[0].split()[0]}"
+            for length in range(1, len(typed) + 1):
+                started = time.perf_counter()
+                search(session, typed[:length])
+                keystrokes.append((time.perf_counter() - started) * 1000)
+    finally:
+        session.close()
+
+    keystrokes.sort()
+    p50, p99 = (keystrokes[min(len(keystrokes) - 1, int(len(keystrokes) * p))] for p in (0.5, 0.99))
+    print(f"Keystrokes:      {len(keystrokes)}")
+    print(f"Latency:         p50 {p50:.2f}ms, p99 {p99:.2f}ms, max {keystrokes[-1]:.2f}ms")
+    print(f"Database:        {os.environ['DATABASE_URL']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-text search index of the tracks")
+    parser.add_argument('--rebuild', action='store_true', help="Refill the index from the catalog")
+    parser.add_argument('--benchmark', action='store_true', help="Measure search latency on synthetic tracks")
+    parser.add_argument('--tracks', type=int, default=1000000, help="Tracks indexed by the benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.tracks)
+    elif args.rebuild:
+        from models import engine
+        from partitions import partition_connections
+
+        with engine.begin() as conn:
+            print(f"Indexed {rebuild(conn, partition_connections(conn))} tracks")
+    else:
+        parser.print_usage()
+        sys.exit(1)
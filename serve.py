@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Production server of the web app: several worker processes behind one port
+
+Runs app.py under gunicorn with `--workers` processes of `--threads` threads
+each; WebSockets are served by the threads through simple-websocket. This
+file is also the gunicorn config module, so the same settings apply to
+`gunicorn -c serve.py app:app`.
+
+With more than one worker:
+- the workers' Socket.IO emits go through the message queue named by
+  SOCKETIO_MESSAGE_QUEUE (a Redis URL, or `python fake_broker.py` for tests)
+  and so reach the clients connected to any of them
+- clients can only connect over WebSocket, as the workers don't share
+  Socket.IO sessions and long polling would need sticky sessions
+- the one worker that binds NOTIFY_PORT receives the tracker's notifications
+  and is the only one watching the database; it relays the playback
+  snapshots to the others through the message queue. When it exits, the
+  worker that gunicorn starts in its place takes over.
+
+    python serve.py --workers 4 --threads 50
+    python serve.py --benchmark                 # requests per second with 1, 2 and 4 workers
+
+gunicorn runs on Unix only and is optional: pip install gunicorn redis
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker processes and threads per worker of `python serve.py`
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 50))
+
+# gunicorn settings, read from this module by `gunicorn -c serve.py`
+bind = f"0.0.0.0:{int(os.getenv('PORT', 5000))}"
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_class = 'gthread'
+# Seconds a worker may go without notifying the master; WebSockets don't count
+timeout = 60
+
+def on_starting(server):
+    """Check that several workers can share their Socket.IO clients"""
+    if server.cfg.workers > 1:
+        if not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+            server.log.error("❌ Several workers need SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) "
+                             "to reach each other's Socket.IO clients")
+            sys.exit(1)
+        os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+
+def post_worker_init(worker):
+    """Elect the monitor when the worker starts rather than on its first client"""
+    import app
+    app.start_background_task()
+
+def serve(workers_count, threads_count, port):
+    """Run the web app under gunicorn (does not return)"""
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:
+        sys.exit("❌ The production server needs gunicorn - run: pip install gunicorn")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sys.argv = ['gunicorn', '--config', os.path.join(directory, 'serve.py'), '--pythonpath', directory,
+                '--workers', str(workers_count), '--threads', str(threads_count), '--bind', f'0.0.0.0:{port}',
+                'app:app']
+    run()
+
+# Requests of the load test; the response cache is disabled, so each one is computed
+LOAD_MIX = ['/api/history?limit=50', '/api/listening-stats', '/api/charts/plays?days=30',
+            '/api/artist?name=Artist%203', '/api/history?limit=50&sort=track_name', '/api/charts/top-artists?days=30']
+
+def generate_history(database_url, plays):
+    """Write `plays` synthetic plays (and their rollups) to a new database"""
+    os.environ['DATABASE_URL'] = database_url
+    from models import engine
+    import synthetic
+
+    with engine.begin() as conn:
+        synthetic.generate_history(conn, plays, artists=500)
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(port, timeout_seconds=60):
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/listening-stats')
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def load_client(port, duration, offset):
+    """Send the LOAD_MIX requests one at a time for `duration` seconds;
+    returns the latencies of the answered ones (milliseconds)"""
+    latencies = []
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    deadline = time.monotonic() + duration
+    index = offset
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request('GET', LOAD_MIX[index % len(LOAD_MIX)])
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                latencies.append((time.perf_counter() - started) * 1000)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        index += 1
+    return latencies
+
+def benchmark(worker_counts, plays=100000, clients=8, duration=10, threads_count=8):
+    """Requests per second of the LOAD_MIX for each number of workers"""
+    from fake_broker import start_broker
+
+    directory = tempfile.mkdtemp(prefix='spotify-serve-')
+    database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    # The schema is created by the generator, not by several workers at once
+    subprocess.run([sys.executable, __file__, '--generate', database_url, '--plays', str(plays)], cwd=directory,
+                   check=True)
+    print(f"Generated {plays} plays, {clients} clients, {os.cpu_count()} CPU(s)")
+
+    broker = start_broker(port=0)
+    env = dict(os.environ, DATABASE_URL=database_url, SOCKETIO_MESSAGE_QUEUE=broker.url, RESPONSE_CACHE_MB='0',
+               SPOTIFY_API_URL='http://127.0.0.1:9/v1', NOTIFY_PORT=str(free_port(socket.SOCK_DGRAM)),
+               LOG_LEVEL='ERROR')
+    baseline = None
+    for workers_count in worker_counts:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, '--workers', str(workers_count), '--threads',
+                                   str(threads_count), '--port', str(port)], env=env, cwd=directory,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_until_up(port):
+                print(f"{workers_count} worker(s): server did not start")
+                continue
+            with multiprocessing.Pool(clients) as pool:
+                results = pool.starmap(load_client, [(port, duration, index) for index in range(clients)])
+            latencies = sorted(latency for result in results for latency in result)
+            throughput = len(latencies) / duration
+            baseline = baseline or throughput
+            print(f"{workers_count} worker(s): {throughput:7.1f} requests/s ({throughput / baseline:.2f}x), "
+                  f"median {latencies[len(latencies) // 2]:6.1f}ms, p95 {latencies[int(len(latencies) * 0.95)]:6.1f}ms")
+        finally:
+            server.terminate()
+            server.wait()
+    broker.shutdown()
+    print(f"Database:        {database_url}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Production server of the web app")
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS, help="Worker processes")
+    parser.add_argument('--threads', type=int, default=WEB_THREADS, help="Threads per worker")
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5000)))
+    parser.add_argument('--benchmark', action='store_true', help="Load-test 1, 2 and 4 workers on a synthetic history")
+    parser.add_argument('--plays', type=int, default=100000, help="Plays generated by the benchmark")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients of the benchmark")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of load per worker count")
+    parser.add_argument('--generate', metavar='DATABASE_URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_history(args.generate, args.plays)
+    elif args.benchmark:
+        benchmark([1, 2, 4], args.plays, args.clients, args.duration)
+    else:
+        serve(args.workers, args.threads, args.port)
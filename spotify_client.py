@@ -0,0 +1,50 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy import Spotify
+from spotipy.cache_handler import CacheFileHandler
+from spotipy.oauth2 import SpotifyOAuth
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCOPE = 'user-read-playback-state user-read-currently-playing user-modify-playback-state'
+
+def create_http_session(pool_size=10):
+    """Create a requests session whose connection pool can be shared by many clients"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def create_spotify(cache_path=None, requests_session=True, open_browser=True):
+    """Create a Spotify client for one account.
+
+    `cache_path` selects the OAuth token cache of the account (spotipy's
+    default `.cache` file when omitted), `requests_session` lets several
+    clients share one connection pool.
+    """
+    # Configurable timeout, default 30 seconds
+    spotify_timeout = int(os.getenv('SPOTIFY_TIMEOUT', 30))
+
+    # Base URL of a stand-in API such as fake_spotify.py; no OAuth is needed
+    # there and rate limits are left to the caller instead of being retried
+    api_url = os.getenv('SPOTIFY_API_URL')
+    if api_url:
+        sp = Spotify(auth='fake-token', requests_timeout=spotify_timeout,
+                     requests_session=requests_session, retries=0, status_retries=0)
+        sp.prefix = api_url.rstrip('/') + '/'
+        return sp
+
+    auth_manager = SpotifyOAuth(
+        client_id=os.getenv('SPOTIPY_CLIENT_ID'),
+        client_secret=os.getenv('SPOTIPY_CLIENT_SECRET'),
+        redirect_uri=os.getenv('SPOTIPY_REDIRECT_URI'),
+        scope=SCOPE,
+        cache_handler=CacheFileHandler(cache_path=cache_path) if cache_path else None,
+        requests_session=requests_session,
+        open_browser=open_browser
+    )
+    return Spotify(auth_manager=auth_manager, requests_timeout=spotify_timeout,
+                   requests_session=requests_session)
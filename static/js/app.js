@@ -1,5 +1,7 @@
-let allSongs = [];
 let socket;
+// Whether the socket was connected before; on reconnecting, whatever was
+// pushed while it was down is fetched over HTTP once
+let socketConnectedBefore = false;
 
 function initializeWebSocket() {
     console.log('🔌 Initializing WebSocket connection...');
@@ -13,6 +15,11 @@ function initializeWebSocket() {
         console.log('✅ Connected to Spotify Tracker WebSocket');
         console.log('🔗 Socket ID:', socket.id);
         showNotification('Connected to real-time updates', 'success');
+        if (socketConnectedBefore) {
+            console.log('🔄 Catching up on changes missed while disconnected...');
+            refreshData();
+        }
+        socketConnectedBefore = true;
     });
     
     socket.on('disconnect', function() {
@@ -20,26 +27,19 @@ function initializeWebSocket() {
         showNotification('Disconnected from real-time updates', 'warning');
     });
     
-    socket.on('new_songs_detected', function(data) {
-        console.log('🎵 New songs detected event received:', data);
-        console.log('🔄 Triggering data refresh...');
-        // showNotification('New songs detected! Refreshing data...', 'info');
-        
-        // Force immediate refresh - no delay
-        console.log('🔄 Executing refreshData() immediately...');
-        refreshData();
-        
-        // Update Recent Activity height to match Now Playing
-        setTimeout(() => {
-            updateRecentActivityHeight();
-        }, 100);
-        
-        // Also force a second refresh after a short delay to ensure data is loaded
-        setTimeout(() => {
-            console.log('🔄 Executing second refreshData() to ensure data is loaded...');
-            refreshData();
-            updateRecentActivityHeight();
-        }, 500);
+    // The history groups of added or closed plays, applied without a request
+    socket.on('history_delta', function(data) {
+        console.log('🎵 History delta received:', data.songs ? data.songs.length : 'reload', data);
+        applyHistoryDelta(data);
+    });
+    
+    // The playback changed (track, device, play state or a seek); the
+    // progress is interpolated from it until the next one
+    socket.on('playback', function(data) {
+        // Only the default account is shown
+        if (data.user_id != null) return;
+        console.log('🎵 Playback received:', data);
+        displayCurrentSong(data);
     });
     
     socket.on('connected', function(data) {
@@ -75,6 +75,18 @@ function initializeWebSocket() {
     socket.on('reconnect_attempt', function(attemptNumber) {
         console.log('🔄 WebSocket reconnection attempt:', attemptNumber);
     });
+    
+    // Artist pictures are looked up in the background when the artist page
+    // is opened; show it if that artist is still open
+    socket.on('artist_image', function(data) {
+        console.log('🎤 Artist image received:', data.artist_name);
+        if (currentArtist && data.artist_name === currentArtist) {
+            const artistImage = document.getElementById('artistImage');
+            artistImage.src = data.artist_image;
+            artistImage.style.display = 'block';
+            document.getElementById('artistImagePlaceholder').style.display = 'none';
+        }
+    });
 }
 
 function showNotification(message, type = 'info') {
@@ -119,131 +131,146 @@ function loadCurrentSong() {
         .then(response => response.json())
         .then(data => {
             console.log('🎵 Current song data received:', data);
-            const songDiv = document.getElementById('song');
-            if (data.track) {
-                const albumCover = data.album_cover ? 
-                    `<img src="${data.album_cover}" alt="Album Cover" class="album-cover">` :
-                    `<div class="album-cover-placeholder"><i class="fas fa-music"></i></div>`;
-                
-                // Determine initial time display based on stored preference
-                const timeDisplay = songDiv.dataset.timeDisplay || 'duration';
-                const initialTime = timeDisplay === 'remaining' ? 
-                    formatTimeRemaining(data.progress_ms, data.duration_ms) : 
-                    data.duration_time;
-                
-                // Create progress bar HTML
-                const progressBar = `
-                    <div class="progress-container">
-                        <div class="progress-bar">
-                            <div class="progress-fill" style="width: ${data.progress_percentage}%"></div>
-                        </div>
-                        <div class="progress-time">
-                            <span class="current-time">${data.progress_time}</span>
-                            <span class="total-time clickable" data-showing="${timeDisplay}" data-duration="${data.duration_time}" data-remaining="${formatTimeRemaining(data.progress_ms, data.duration_ms)}">${initialTime}</span>
-                        </div>
-                    </div>
-                `;
-                
-                // Add play/pause indicator
-                const playStatus = data.is_playing ? 
-                    '<i class="fas fa-play-circle play-indicator"></i>' : 
-                    '<i class="fas fa-pause-circle play-indicator paused"></i>';
-                
-                songDiv.innerHTML = `
-                    <div class="song-main-content">
-                    ${albumCover}
-                    <div class="song-details">
-                        <div class="song-title">${playStatus} ${data.track}</div>
-                        <div class="song-artist">${makeArtistClickable(data.artist)}</div>
-                        <div class="song-album">${data.album}</div>
-                        ${progressBar}
+            if (data.error) throw new Error(data.error);
+            displayCurrentSong(data);
+        })
+        .catch(error => {
+            console.error('❌ Error loading current song:', error);
+            document.getElementById('song').innerHTML = '<div class="no-data"><i class="fas fa-exclamation-triangle"></i><div>Error loading current song</div></div>';
+        });
+}
+
+// A pushed playback is expected soon after the track ends; without one
+// (e.g. no tracker is running) the current song is fetched once
+const TRACK_END_GRACE_MS = 5000;
+let trackEndTimer = null;
+
+// Show a playback from /api/current-song or the playback event; its progress
+// is the anchor the progress bar interpolates from
+function displayCurrentSong(data) {
+    clearTimeout(trackEndTimer);
+    trackEndTimer = null;
+    const songDiv = document.getElementById('song');
+    if (data.track) {
+        const albumCover = data.album_cover ? 
+            `<img src="${data.album_cover}" alt="Album Cover" class="album-cover">` :
+            `<div class="album-cover-placeholder"><i class="fas fa-music"></i></div>`;
+        
+        // Determine initial time display based on stored preference
+        const timeDisplay = songDiv.dataset.timeDisplay || 'duration';
+        const initialTime = timeDisplay === 'remaining' ? 
+            formatTimeRemaining(data.progress_ms, data.duration_ms) : 
+            data.duration_time;
+        
+        // Create progress bar HTML
+        const progressBar = `
+            <div class="progress-container">
+                <div class="progress-bar">
+                    <div class="progress-fill" style="width: ${data.progress_percentage}%"></div>
+                </div>
+                <div class="progress-time">
+                    <span class="current-time">${data.progress_time}</span>
+                    <span class="total-time clickable" data-showing="${timeDisplay}" data-duration="${data.duration_time}" data-remaining="${formatTimeRemaining(data.progress_ms, data.duration_ms)}">${initialTime}</span>
+                </div>
+            </div>
+        `;
+        
+        // Add play/pause indicator
+        const playStatus = data.is_playing ? 
+            '<i class="fas fa-play-circle play-indicator"></i>' : 
+            '<i class="fas fa-pause-circle play-indicator paused"></i>';
+        
+        songDiv.innerHTML = `
+            <div class="song-main-content">
+            ${albumCover}
+            <div class="song-details">
+                <div class="song-title">${playStatus} ${data.track}</div>
+                <div class="song-artist">${makeArtistClickable(data.artists || data.artist)}</div>
+                <div class="song-album">${data.album}</div>
+                ${progressBar}
+                </div>
+            </div>
+            <div class="song-additional-info">
+                <div class="info-grid">
+                    <div class="info-item">
+                        <i class="fas fa-calendar-alt"></i>
+                        <div class="info-content">
+                            <div class="info-label">Release Year</div>
+                            <div class="info-value">${data.release_year || 'Unknown'}</div>
                         </div>
                     </div>
-                    <div class="song-additional-info">
-                        <div class="info-grid">
-                            <div class="info-item">
-                                <i class="fas fa-calendar-alt"></i>
-                                <div class="info-content">
-                                    <div class="info-label">Release Year</div>
-                                    <div class="info-value">${data.release_year || 'Unknown'}</div>
-                                </div>
-                            </div>
-                            <div class="info-item">
-                                <i class="fas fa-${getDeviceIcon(data.type)}"></i>
-                                <div class="info-content">
-                                    <div class="info-label">Device</div>
-                                    <div class="info-value">${data.device}</div>
-                                </div>
-                            </div>
+                    <div class="info-item">
+                        <i class="fas fa-${getDeviceIcon(data.type)}"></i>
+                        <div class="info-content">
+                            <div class="info-label">Device</div>
+                            <div class="info-value">${data.device}</div>
                         </div>
                     </div>
-                `;
-                
-                // Add click handler to progress bar for seeking (future feature)
-                const progressBarElement = songDiv.querySelector('.progress-bar');
-                if (progressBarElement) {
-                    progressBarElement.addEventListener('click', function(e) {
-                        const rect = this.getBoundingClientRect();
-                        const clickX = e.clientX - rect.left;
-                        const percentage = (clickX / rect.width) * 100;
-                        console.log('🎯 Progress bar clicked at:', percentage.toFixed(1) + '%');
-                        // TODO: Implement seeking when Spotify API permissions are available
-                    });
-                }
-                
-                // Add click handler for time toggle
-                const totalTimeElement = songDiv.querySelector('.total-time.clickable');
-                if (totalTimeElement) {
-                    totalTimeElement.addEventListener('click', function() {
-                        const currentlyShowing = this.dataset.showing;
-                        const duration = this.dataset.duration;
-                        const remaining = this.dataset.remaining;
-                        
-                        if (currentlyShowing === 'duration') {
-                            this.textContent = remaining;
-                            this.dataset.showing = 'remaining';
-                            songDiv.dataset.timeDisplay = 'remaining';
-                        } else {
-                            this.textContent = duration;
-                            this.dataset.showing = 'duration';
-                            songDiv.dataset.timeDisplay = 'duration';
-                        }
-                    });
-                }
-                
-                // Restore or set the display preference
-                const existingPreference = songDiv.dataset.timeDisplay;
-                if (!existingPreference) {
-                    songDiv.dataset.timeDisplay = 'duration';
-                }
-                
-                // Store progress data for real-time updates
-                songDiv.dataset.progressMs = data.progress_ms;
-                songDiv.dataset.durationMs = data.duration_ms;
-                songDiv.dataset.isPlaying = data.is_playing;
-                songDiv.dataset.lastUpdate = Date.now();
-                
-                // Update Recent Activity height to match Now Playing
-                updateRecentActivityHeight();
+                </div>
+            </div>
+        `;
+        
+        // Add click handler to progress bar for seeking (future feature)
+        const progressBarElement = songDiv.querySelector('.progress-bar');
+        if (progressBarElement) {
+            progressBarElement.addEventListener('click', function(e) {
+                const rect = this.getBoundingClientRect();
+                const clickX = e.clientX - rect.left;
+                const percentage = (clickX / rect.width) * 100;
+                console.log('🎯 Progress bar clicked at:', percentage.toFixed(1) + '%');
+                // TODO: Implement seeking when Spotify API permissions are available
+            });
+        }
+        
+        // Add click handler for time toggle
+        const totalTimeElement = songDiv.querySelector('.total-time.clickable');
+        if (totalTimeElement) {
+            totalTimeElement.addEventListener('click', function() {
+                const currentlyShowing = this.dataset.showing;
+                const duration = this.dataset.duration;
+                const remaining = this.dataset.remaining;
                 
-                // Update background based on album cover
-                if (data.album_cover) {
-                    updateBackgroundFromAlbumCover(data.album_cover);
+                if (currentlyShowing === 'duration') {
+                    this.textContent = remaining;
+                    this.dataset.showing = 'remaining';
+                    songDiv.dataset.timeDisplay = 'remaining';
                 } else {
-                    resetBackgroundToDefault();
+                    this.textContent = duration;
+                    this.dataset.showing = 'duration';
+                    songDiv.dataset.timeDisplay = 'duration';
                 }
-                
-                console.log('🎵 Current song updated in UI');
-            } else {
-                songDiv.innerHTML = '<div class="no-data"><i class="fas fa-music"></i><div>No song currently playing</div></div>';
-                resetBackgroundToDefault();
-                console.log('🎵 No song currently playing');
-            }
-        })
-        .catch(error => {
-            console.error('❌ Error loading current song:', error);
-            document.getElementById('song').innerHTML = '<div class="no-data"><i class="fas fa-exclamation-triangle"></i><div>Error loading current song</div></div>';
-        });
+            });
+        }
+        
+        // Restore or set the display preference
+        const existingPreference = songDiv.dataset.timeDisplay;
+        if (!existingPreference) {
+            songDiv.dataset.timeDisplay = 'duration';
+        }
+        
+        // Store progress data for real-time updates
+        songDiv.dataset.progressMs = data.progress_ms;
+        songDiv.dataset.durationMs = data.duration_ms;
+        songDiv.dataset.isPlaying = data.is_playing;
+        songDiv.dataset.lastUpdate = Date.now();
+        
+        // Update Recent Activity height to match Now Playing
+        updateRecentActivityHeight();
+        
+        // Update background based on album cover
+        if (data.album_cover) {
+            updateBackgroundFromAlbumCover(data.album_cover);
+        } else {
+            resetBackgroundToDefault();
+        }
+        
+        console.log('🎵 Current song updated in UI');
+    } else {
+        songDiv.innerHTML = '<div class="no-data"><i class="fas fa-music"></i><div>No song currently playing</div></div>';
+        delete songDiv.dataset.progressMs;
+        resetBackgroundToDefault();
+        console.log('🎵 No song currently playing');
+    }
 }
 
 // Function to update progress bar in real-time
@@ -280,10 +307,10 @@ function updateProgressBar() {
     
     if (currentProgress >= duration) {
         currentProgress = duration;
-        // Song finished, trigger a refresh to get new song
-        setTimeout(() => {
-            loadCurrentSong();
-        }, 1000);
+        // Song finished: the next one is pushed, or fetched if it isn't in time
+        if (trackEndTimer === null) {
+            trackEndTimer = setTimeout(loadCurrentSong, TRACK_END_GRACE_MS);
+        }
     }
     
     // Update the progress bar
@@ -610,30 +637,101 @@ function resetBackgroundToDefault() {
     console.log('🎨 Starting background transition to default blue');
 }
 
-function loadHistory() {
-    console.log('📜 Loading history...');
-    return fetch('/api/history')
+// The newest groups of the history, shown as the recent activity, and the
+// change sequence they reflect; pushed deltas are merged into them
+const RECENT_SONGS_LIMIT = 15;
+let recentSongs = [];
+let recentChangeSeq = null;
+
+// Groups of the history are keyed by day, track and album, like on the server
+function songKey(song) {
+    return `${song.date}\x1f${song.track_name || ''}\x1f${song.album_name || ''}`;
+}
+
+function mergeSongs(changed) {
+    const keys = new Set(changed.map(songKey));
+    recentSongs = changed.concat(recentSongs.filter(song => !keys.has(songKey(song))));
+    recentSongs.sort((a, b) => (Date.parse(b.timestamp) || 0) - (Date.parse(a.timestamp) || 0));
+    recentSongs = recentSongs.slice(0, RECENT_SONGS_LIMIT);
+}
+
+// The first page of the history; the dashboard never loads more of it
+function loadRecentSongs() {
+    console.log('📜 Loading recent songs...');
+    return fetch(`/api/history?limit=${RECENT_SONGS_LIMIT}`)
         .then(response => response.json())
         .then(data => {
-            console.log('📜 History data received:', data.songs?.length, 'songs');
-            allSongs = data.songs || [];
-            updateHistoryDisplay();
-            updateStats();
-            console.log('📜 History updated in UI');
+            if (data.error) throw new Error(data.error);
+            console.log('📜 Recent songs received:', data.songs?.length);
+            recentSongs = data.songs || [];
+            recentChangeSeq = data.change_seq;
             return data;
         })
         .catch(error => {
-            console.error('❌ Error loading history:', error);
-            document.getElementById('history').innerHTML = '<div class="no-data"><i class="fas fa-exclamation-triangle"></i><div>Error loading history</div></div>';
+            console.error('❌ Error loading recent songs:', error);
             throw error;
         });
 }
 
-// Pagination variables
+// Pagination variables; the server sorts, filters and pages the history
 let currentPage = 1;
 let itemsPerPage = 25;
 let currentSort = { column: 'timestamp', direction: 'desc' };
-let filteredSongs = [];
+let historyPage = [];
+// Cursor of every page visited so far (null for the first one) and of the next page
+let pageCursors = [null];
+let nextPageCursor = null;
+// Days the current page covers; sorts other than by time cover at most a year
+let historyRange = {from: null, to: null};
+let historyRequest = 0;
+
+// Query string of the current page of the history table
+function historyQuery() {
+    const params = new URLSearchParams({
+        limit: itemsPerPage,
+        sort: currentSort.column,
+        direction: currentSort.direction
+    });
+    const cursor = pageCursors[currentPage - 1];
+    if (cursor) params.set('cursor', cursor);
+    const filters = {
+        q: document.getElementById('globalFilter').value.trim(),
+        artist: document.getElementById('artistFilter').value.trim(),
+        album: document.getElementById('albumFilter').value.trim()
+    };
+    Object.entries(filters).forEach(([name, value]) => {
+        if (value) params.set(name, value);
+    });
+    return params.toString();
+}
+
+function loadHistoryPage() {
+    // Responses of superseded requests (e.g. while typing a filter) are dropped
+    const request = ++historyRequest;
+    return fetch(`/api/history?${historyQuery()}`)
+        .then(response => response.json())
+        .then(data => {
+            if (request !== historyRequest) return;
+            if (data.error) throw new Error(data.error);
+            historyPage = data.songs || [];
+            nextPageCursor = data.next_cursor || null;
+            historyRange = {from: data.from || null, to: data.to || null};
+            updateHistoryDisplay();
+        })
+        .catch(error => {
+            console.error('❌ Error loading history page:', error);
+            document.getElementById('history').innerHTML = '<tr><td colspan="11" class="no-data"><i class="fas fa-exclamation-triangle"></i><div>Error loading history</div></td></tr>';
+        });
+}
+
+// Back to the first page, e.g. when the filters or the sort change
+function resetHistoryPages() {
+    currentPage = 1;
+    pageCursors = [null];
+    nextPageCursor = null;
+    clearTimeout(window.historyFilterTimeout);
+    window.historyFilterTimeout = setTimeout(loadHistoryPage, 250);
+}
 
 // Chart instances
 let topArtistsChart = null;
@@ -653,56 +751,13 @@ let listeningStreakChart = null;
 let topGenresChart = null;
 let completionRateChart = null;
 
+// Aggregated plays per hour, day, device and artist from /api/chart-stats
+let chartStats = null;
+
 function updateHistoryDisplay() {
     const historyBody = document.getElementById('history');
-    const globalFilter = document.getElementById('globalFilter').value.toLowerCase();
-    const artistFilter = document.getElementById('artistFilter').value.toLowerCase();
-    const albumFilter = document.getElementById('albumFilter').value.toLowerCase();
-    
-    // Apply filters
-    filteredSongs = allSongs.filter(song => {
-        const matchesGlobal = !globalFilter || 
-            song.track_name.toLowerCase().includes(globalFilter) ||
-            song.artist_name.toLowerCase().includes(globalFilter) ||
-            song.album_name.toLowerCase().includes(globalFilter) ||
-            song.device_name.toLowerCase().includes(globalFilter) ||
-            (song.device_type && song.device_type.toLowerCase().includes(globalFilter)) ||
-            (song.date && song.date.toLowerCase().includes(globalFilter));
-        
-        const matchesArtist = song.artist_name.toLowerCase().includes(artistFilter);
-        const matchesAlbum = song.album_name.toLowerCase().includes(albumFilter);
-        
-        return matchesGlobal && matchesArtist && matchesAlbum;
-    });
-
-    // Apply sorting
-    filteredSongs.sort((a, b) => {
-        let aValue = a[currentSort.column];
-        let bValue = b[currentSort.column];
-        
-        if (currentSort.column === 'timestamp') {
-            aValue = new Date(aValue);
-            bValue = new Date(bValue);
-        } else if (typeof aValue === 'string') {
-            aValue = aValue.toLowerCase();
-            bValue = bValue.toLowerCase();
-        }
-        
-        if (aValue < bValue) {
-            return currentSort.direction === 'asc' ? -1 : 1;
-        }
-        if (aValue > bValue) {
-            return currentSort.direction === 'asc' ? 1 : -1;
-        }
-        return 0;
-    });
-
-    // Calculate pagination
-    const totalItems = filteredSongs.length;
-    const totalPages = Math.ceil(totalItems / itemsPerPage);
+    const pageItems = historyPage;
     const startIndex = (currentPage - 1) * itemsPerPage;
-    const endIndex = startIndex + itemsPerPage;
-    const pageItems = filteredSongs.slice(startIndex, endIndex);
 
     // Update table content
     if (pageItems.length > 0) {
@@ -747,7 +802,7 @@ function updateHistoryDisplay() {
                 <tr>
                     <td class="album-cover-cell">${albumCover}</td>
                     <td class="track-name">${escapeHtml(song.track_name)}</td>
-                    <td class="artist-name">${makeArtistClickable(song.artist_name)}</td>
+                    <td class="artist-name">${makeArtistClickable(songArtists(song))}</td>
                     <td class="album-name">${escapeHtml(song.album_name)}</td>
                     <td class="device-name">${escapeHtml(song.device_name)}</td>
                     <td class="device-type">${escapeHtml(deviceType)}</td>
@@ -770,7 +825,7 @@ function updateHistoryDisplay() {
     }
 
     // Update pagination info
-    updatePaginationInfo(totalItems, startIndex + 1, Math.min(endIndex, totalItems), totalPages);
+    updatePaginationInfo(startIndex + 1, startIndex + pageItems.length);
     
     // Check for horizontal overflow and add visual indicator
     checkTableOverflow();
@@ -809,14 +864,17 @@ function formatDuration(ms) {
     }
 }
 
-function updatePaginationInfo(total, start, end, totalPages) {
+function updatePaginationInfo(start, end) {
+    // The total is not counted: that would read the whole history
+    let info = end >= start ? `Showing ${start}-${end}` : 'No entries';
+    if (historyRange.from) info += ` from ${historyRange.from} to ${historyRange.to}`;
+    const hasNext = nextPageCursor !== null;
+
     // Update top pagination
-    document.getElementById('paginationInfo').textContent = 
-        `Showing ${start}-${end} of ${total} entries`;
-    document.getElementById('pageIndicator').textContent = 
-        `Page ${currentPage} of ${totalPages}`;
+    document.getElementById('paginationInfo').textContent = info;
+    document.getElementById('pageIndicator').textContent = `Page ${currentPage}`;
     document.getElementById('prevPage').disabled = currentPage <= 1;
-    document.getElementById('nextPage').disabled = currentPage >= totalPages;
+    document.getElementById('nextPage').disabled = !hasNext;
     
     // Update bottom pagination
     const paginationInfoBottom = document.getElementById('paginationInfoBottom');
@@ -825,16 +883,16 @@ function updatePaginationInfo(total, start, end, totalPages) {
     const nextPageBottom = document.getElementById('nextPageBottom');
     
     if (paginationInfoBottom) {
-        paginationInfoBottom.textContent = `Showing ${start}-${end} of ${total} entries`;
+        paginationInfoBottom.textContent = info;
     }
     if (pageIndicatorBottom) {
-        pageIndicatorBottom.textContent = `Page ${currentPage} of ${totalPages}`;
+        pageIndicatorBottom.textContent = `Page ${currentPage}`;
     }
     if (prevPageBottom) {
         prevPageBottom.disabled = currentPage <= 1;
     }
     if (nextPageBottom) {
-        nextPageBottom.disabled = currentPage >= totalPages;
+        nextPageBottom.disabled = !hasNext;
     }
 }
 
@@ -856,26 +914,25 @@ function sortTable(column) {
         currentTh.classList.add(`sort-${currentSort.direction}`);
     }
     
-    currentPage = 1; // Reset to first page when sorting
-    updateHistoryDisplay();
+    resetHistoryPages(); // Reset to first page when sorting
 }
 
 function changePage(direction) {
-    const totalPages = Math.ceil(filteredSongs.length / itemsPerPage);
-    
     if (direction === 'prev' && currentPage > 1) {
         currentPage--;
-    } else if (direction === 'next' && currentPage < totalPages) {
+    } else if (direction === 'next' && nextPageCursor) {
+        pageCursors[currentPage] = nextPageCursor;
         currentPage++;
+    } else {
+        return;
     }
     
-    updateHistoryDisplay();
+    loadHistoryPage();
 }
 
 function changeEntriesPerPage(newValue) {
     itemsPerPage = parseInt(newValue);
-    currentPage = 1; // Reset to first page when changing entries per page
-    updateHistoryDisplay();
+    resetHistoryPages(); // Reset to first page when changing entries per page
 }
 
 // Tab switching functionality
@@ -898,9 +955,16 @@ function switchTab(tabName) {
     
     // Load tab-specific content
     if (tabName === 'home') {
-        // Always refresh data when switching to home tab to ensure recent activity is current
-        console.log('🏠 Switching to home tab, refreshing data...');
-        refreshData();
+        // The recent songs are kept current by the pushed deltas; without the
+        // WebSocket (or before the first load) they are fetched
+        console.log('🏠 Switching to home tab...');
+        if (recentChangeSeq !== null && socket && socket.connected) {
+            updateHistoryViews();
+        } else {
+            refreshData();
+        }
+    } else if (tabName === 'history') {
+        loadHistoryPage();
     } else if (tabName === 'graphs') {
         createDetailedCharts();
     }
@@ -916,11 +980,11 @@ function loadRecentActivity() {
         return;
     }
     
-    console.log('🔄 Updating recent activity with', allSongs?.length || 0, 'total songs');
+    console.log('🔄 Updating recent activity with', recentSongs.length, 'recent songs');
     
     // Filter out the currently playing song (songs without end_time) from recent activity
     // This ensures only completed songs show in the recent activity
-    const completedSongs = allSongs.filter(song => song.end_time !== null);
+    const completedSongs = recentSongs.filter(song => song.end_time !== null);
     
     console.log('🔄 Found', completedSongs.length, 'completed songs for recent activity');
     
@@ -971,7 +1035,7 @@ function loadRecentActivity() {
             const timeAgo = getTimeAgo(songDate);
             const deviceIcon = getDeviceIcon(song.device_type);
             
-            const artistHtml = makeArtistClickable(song.artist_name);
+            const artistHtml = makeArtistClickable(songArtists(song));
             
             return `
                 <div class="activity-item">
@@ -1036,6 +1100,21 @@ function getDeviceIcon(deviceType) {
     }
 }
 
+// One chart aggregated by the server (see charts.py); only its plotted values are sent
+function loadChart(name, params = {}) {
+    return fetch(`/api/charts/${name}?${new URLSearchParams(params)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) throw new Error(data.error);
+            return data;
+        });
+}
+
+// YYYY-MM-DD of a date in the browser's time zone
+function localDay(date) {
+    return `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
+}
+
 // Create simple charts for home tab
 function createSimpleCharts() {
     displayTopArtistToday();
@@ -1046,78 +1125,19 @@ function displayTopArtistToday() {
     const displayDiv = document.getElementById('topArtistDisplay');
     if (!displayDiv) return;
     
-    // Get today's songs using the date field from backend (already timezone-corrected)
-    // The backend uses Europe/Berlin timezone, so we need to match that exactly
-    const now = new Date();
-    
-    // Convert to Berlin timezone (UTC+2 for summer time)
-    // The issue is that we need to add 2 hours to get Berlin time
-    const berlinTime = new Date(now.getTime() + (2 * 60 * 60 * 1000)); // Add 2 hours for Berlin time
-    const today = berlinTime.toISOString().split('T')[0]; // YYYY-MM-DD format
-    
-    console.log('🎵 Top Artist Today - Current date (Berlin timezone):', today);
-    console.log('🎵 Top Artist Today - Total songs in allSongs:', allSongs.length);
-    
-    // Debug: Show all songs and their dates
-    console.log('🎵 Top Artist Today - All songs with dates:');
-    allSongs.slice(0, 10).forEach(song => {
-        console.log(`  ${song.track_name} by ${song.artist_name} - date: ${song.date}`);
-    });
-    
-    const todaysSongs = allSongs.filter(song => {
-        const isToday = song.date === today;
-        const hasMinimumDuration = song.played_duration_ms && song.played_duration_ms >= 60000; // At least 1 minute
-        
-        if (isToday) {
-            const artists = song.artist_name.split(',').map(artist => artist.trim());
-            console.log(`🎵 Today's song: ${song.track_name} by ${song.artist_name} (split into: [${artists.join(', ')}]) (date: ${song.date}, duration: ${song.played_duration_ms}ms, meets threshold: ${hasMinimumDuration})`);
-        }
-        return isToday && hasMinimumDuration;
-    });
-    
-    console.log('🎵 Top Artist Today - Songs found for today (with ≥1m listening time):', todaysSongs.length);
-    
-    if (todaysSongs.length === 0) {
-        displayDiv.innerHTML = '<div class="no-artist-today">No songs played today<br><small>(with ≥1m listening time)</small></div>';
-        console.log('🎵 Top Artist Today - No songs found for today with ≥1m listening time');
-        return;
-    }
-    
-    // Count artists - split by commas to handle multiple artists
-    const artistCounts = {};
-    todaysSongs.forEach(song => {
-        // Handle special case for "Tyler, The Creator" - treat as single artist
-        let artistName = song.artist_name;
-        if (artistName === 'Tyler, The Creator') {
-            artistCounts[artistName] = (artistCounts[artistName] || 0) + 1;
-        } else {
-            // Split artist names by comma and trim whitespace
-            const artists = artistName.split(',').map(artist => artist.trim());
-            
-            // Count each individual artist
-            artists.forEach(artist => {
-                artistCounts[artist] = (artistCounts[artist] || 0) + 1;
-            });
+    // "Today" is the server's local day
+    loadChart('top-artists', { days: 1, top: 1 }).then(chart => {
+        if (!chart.labels.length) {
+            displayDiv.innerHTML = '<div class="no-artist-today">No songs played today</div>';
+            return;
         }
-    });
-    
-    console.log('🎵 Top Artist Today - Artist counts (after splitting):', artistCounts);
-    
-    // Get top artist
-    const topArtist = Object.entries(artistCounts)
-        .sort(([,a], [,b]) => b - a)[0];
-    
-    if (topArtist) {
-        const [artistName, playCount] = topArtist;
-        console.log(`🎵 Top Artist Today - Top artist: ${artistName} with ${playCount} plays`);
+        const artistName = chart.labels[0];
+        const playCount = chart.values[0];
         displayDiv.innerHTML = `
             <div class="top-artist-name clickable-artist" onclick="openArtistPage('${escapeHtml(artistName)}')">${escapeHtml(artistName)}</div>
             <div class="top-artist-plays">${playCount} ${playCount === 1 ? 'play' : 'plays'}</div>
         `;
-    } else {
-        displayDiv.innerHTML = '<div class="no-artist-today">No artists found</div>';
-        console.log('🎵 Top Artist Today - No top artist found');
-    }
+    }).catch(error => console.error('❌ Error loading top artist today:', error));
 }
 
 // Add a manual refresh function for debugging
@@ -1128,6 +1148,8 @@ function refreshTopArtistToday() {
 
 // Artist Page Functions
 let currentArtist = null;
+// Cursor of the next page of each artist page list, null once it's complete
+let artistCursors = {};
 
 function openArtistPage(artistName) {
     console.log(`🎤 Opening artist page for: ${artistName}`);
@@ -1223,7 +1245,13 @@ function displayArtistData(data) {
     // Update section counts
     document.getElementById('soloCount').textContent = data.solo_songs;
     document.getElementById('featureCount').textContent = data.feature_songs;
-    document.getElementById('historyCount').textContent = data.full_history_list ? data.full_history_list.length : 0;
+    document.getElementById('historyCount').textContent = data.total_songs;
+    
+    artistCursors = {
+        solo: data.solo_songs_cursor,
+        feature: data.feature_songs_cursor,
+        history: data.full_history_cursor
+    };
     
     // Display solo songs
     displaySoloSongs(data.solo_songs_list);
@@ -1235,11 +1263,76 @@ function displayArtistData(data) {
     displayFullHistory(data.full_history_list);
 }
 
-function displaySoloSongs(songs) {
+// Display functions of the artist page lists and the containers they fill
+const artistLists = {
+    solo: { container: 'soloSongsList', display: songs => displaySoloSongs(songs, true) },
+    feature: { container: 'featureSongsList', display: songs => displayFeatureSongs(songs, true) },
+    history: { container: 'fullHistoryList', display: songs => displayFullHistory(songs, true) }
+};
+
+// Show a "Load more" button below an artist page list while it has more pages
+function updateLoadMoreButton(listName) {
+    const container = document.getElementById(artistLists[listName].container);
+    let button = container.parentNode.querySelector('.load-more-btn');
+    
+    if (!artistCursors[listName]) {
+        if (button) {
+            button.remove();
+        }
+        return;
+    }
+    
+    if (!button) {
+        button = document.createElement('button');
+        button.className = 'pagination-btn load-more-btn';
+        button.innerHTML = '<i class="fas fa-chevron-down"></i> Load more';
+        button.addEventListener('click', () => loadMoreArtistSongs(listName));
+        container.after(button);
+    }
+    button.disabled = false;
+}
+
+async function loadMoreArtistSongs(listName) {
+    const artistName = currentArtist;
+    const cursor = artistCursors[listName];
+    if (!artistName || !cursor) {
+        return;
+    }
+    
+    const button = document.getElementById(artistLists[listName].container).parentNode.querySelector('.load-more-btn');
+    if (button) {
+        button.disabled = true;
+    }
+    
+    try {
+        const params = new URLSearchParams({ name: artistName, list: listName, cursor: cursor });
+        const response = await fetch(`/api/artist/songs?${params}`);
+        const data = await response.json();
+        
+        // The user may have opened another artist in the meantime
+        if (artistName !== currentArtist) {
+            return;
+        }
+        
+        if (response.ok) {
+            artistCursors[listName] = data.next_cursor;
+            artistLists[listName].display(data.songs);
+        } else {
+            console.error('❌ Error loading more artist songs:', data.error);
+            showNotification('Error loading more songs', 'error');
+        }
+    } catch (error) {
+        console.error('❌ Error fetching more artist songs:', error);
+        showNotification('Error loading more songs', 'error');
+    }
+    updateLoadMoreButton(listName);
+}
+
+function displaySoloSongs(songs, append = false) {
     const container = document.getElementById('soloSongsList');
     const section = container.closest('.artist-section');
     
-    if (!songs || songs.length === 0) {
+    if (!append && (!songs || songs.length === 0)) {
         if (section.parentNode) {
             section.remove();
         }
@@ -1251,7 +1344,7 @@ function displaySoloSongs(songs) {
         document.querySelector('.artist-sections').appendChild(section);
     }
     section.style.display = 'block';
-    container.innerHTML = songs.map(song => `
+    const html = songs.map(song => `
         <div class="song-item">
             <div class="album-cover-container">
                 ${song.album_cover ? 
@@ -1269,15 +1362,21 @@ function displaySoloSongs(songs) {
             </div>
         </div>
     `).join('');
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    updateLoadMoreButton('solo');
 }
 
-function displayFeatureSongs(songs) {
+function displayFeatureSongs(songs, append = false) {
     const container = document.getElementById('featureSongsList');
     const section = container.closest('.artist-section');
     
     console.log('🎤 Displaying feature songs:', songs?.length || 0, 'songs');
     
-    if (!songs || songs.length === 0) {
+    if (!append && (!songs || songs.length === 0)) {
         console.log('🎤 No feature songs, removing section');
         if (section.parentNode) {
             section.remove();
@@ -1290,7 +1389,7 @@ function displayFeatureSongs(songs) {
         document.querySelector('.artist-sections').appendChild(section);
     }
     section.style.display = 'block';
-    container.innerHTML = songs.map(song => `
+    const html = songs.map(song => `
         <div class="song-item">
             <div class="album-cover-container">
                 ${song.album_cover ? 
@@ -1309,13 +1408,19 @@ function displayFeatureSongs(songs) {
             </div>
         </div>
     `).join('');
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    updateLoadMoreButton('feature');
 }
 
-function displayFullHistory(songs) {
+function displayFullHistory(songs, append = false) {
     const container = document.getElementById('fullHistoryList');
     const section = container.closest('.artist-section');
     
-    if (!songs || songs.length === 0) {
+    if (!append && (!songs || songs.length === 0)) {
         if (section.parentNode) {
             section.remove();
         }
@@ -1327,7 +1432,7 @@ function displayFullHistory(songs) {
         document.querySelector('.artist-sections').appendChild(section);
     }
     section.style.display = 'block';
-    container.innerHTML = songs.map(song => `
+    const html = songs.map(song => `
         <div class="song-item">
             <div class="album-cover-container">
                 ${song.album_cover ? 
@@ -1345,6 +1450,12 @@ function displayFullHistory(songs) {
             </div>
         </div>
     `).join('');
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    updateLoadMoreButton('history');
 }
 
 function restoreArtistSections() {
@@ -1376,8 +1487,27 @@ function restoreArtistSections() {
     console.log('🎤 Artist sections restored');
 }
 
-// Helper function to make artist names clickable
+// Individual artists of a song; the history API lists them, other responses
+// only have the comma-joined name
+function songArtists(song) {
+    if (song.artists && song.artists.length) {
+        return song.artists;
+    }
+    if (song.artist_name === 'Tyler, The Creator') {
+        return [song.artist_name];
+    }
+    return song.artist_name.split(',').map(artist => artist.trim());
+}
+
+// Helper function to make artist names clickable; accepts a list of artists
+// or a comma-joined name
 function makeArtistClickable(artistName) {
+    if (Array.isArray(artistName)) {
+        return artistName.map(artist => 
+            `<span class="clickable-artist" data-artist="${escapeHtml(artist)}">${escapeHtml(artist)}</span>`
+        ).join(', ');
+    }
+    
     // Handle special case for "Tyler, The Creator" - treat as single artist
     if (artistName === 'Tyler, The Creator') {
         return `<span class="clickable-artist" data-artist="${escapeHtml(artistName)}">${escapeHtml(artistName)}</span>`;
@@ -1426,13 +1556,13 @@ function debugTimezone() {
     console.log('Berlin time:', berlinTime.toISOString());
     console.log('Berlin date:', berlinTime.toISOString().split('T')[0]);
     
-    // Show all unique dates in the dataset
-    const uniqueDates = [...new Set(allSongs.map(song => song.date))].sort();
+    // Show all unique dates of the recent songs
+    const uniqueDates = [...new Set(recentSongs.map(song => song.date))].sort();
     console.log('All dates in dataset:', uniqueDates);
     
     // Show songs for each date
     uniqueDates.forEach(date => {
-        const songsForDate = allSongs.filter(song => song.date === date);
+        const songsForDate = recentSongs.filter(song => song.date === date);
         console.log(`Date ${date}: ${songsForDate.length} songs`);
         songsForDate.forEach(song => {
             console.log(`  - ${song.track_name} by ${song.artist_name}`);
@@ -1444,92 +1574,91 @@ function createListeningActivityChart() {
     const ctx = document.getElementById('listeningActivityChart');
     if (!ctx) return;
     
-    // Get current week (Monday to Sunday)
-    const currentWeek = [];
-    const dayCounts = {};
-    
-    // Get the current date
-    const today = new Date();
-    
-    // Find the most recent Monday (or today if it's Monday)
-    const dayOfWeek = today.getDay(); // 0 = Sunday, 1 = Monday, ..., 6 = Saturday
-    const daysSinceMonday = dayOfWeek === 0 ? 6 : dayOfWeek - 1; // Days since last Monday
-    
-    // Generate the 7 days of the current week (Monday to Sunday)
-    for (let i = 0; i < 7; i++) {
-        const date = new Date(today);
-        date.setDate(today.getDate() - daysSinceMonday + i);
-        const dayKey = date.toISOString().split('T')[0];
-        currentWeek.push(dayKey);
-        dayCounts[dayKey] = 0;
-    }
-    
-    // Count songs per day using timezone-corrected dates
-    allSongs.forEach(song => {
-        const songDay = song.date; // Use the timezone-corrected date from backend
-        if (dayCounts.hasOwnProperty(songDay)) {
-            dayCounts[songDay]++;
+    // Plays of each day of the current week (Monday to Sunday)
+    const monday = new Date();
+    monday.setDate(monday.getDate() - (monday.getDay() + 6) % 7);
+    const sunday = new Date(monday);
+    sunday.setDate(monday.getDate() + 6);
+    loadChart('plays', { from: localDay(monday), to: localDay(sunday), bucket: 'day' }).then(chart => {
+        const currentWeek = chart.labels;
+        const dayCounts = Object.fromEntries(chart.labels.map((label, i) => [label, chart.values[i]]));
+    
+        if (listeningActivityChart) {
+            listeningActivityChart.destroy();
         }
-    });
     
-    if (listeningActivityChart) {
-        listeningActivityChart.destroy();
-    }
-    
-    listeningActivityChart = new Chart(ctx, {
-        type: 'line',
-        data: {
-            labels: currentWeek.map(day => {
-                const date = new Date(day);
-                return date.toLocaleDateString('en-US', { weekday: 'short' });
-            }),
-            datasets: [{
-                label: 'Songs Played',
-                data: currentWeek.map(day => dayCounts[day]),
-                borderColor: '#1db954',
-                backgroundColor: 'rgba(29, 185, 84, 0.1)',
-                borderWidth: 3,
-                fill: true,
-                tension: 0.4
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    display: false
-                }
+        listeningActivityChart = new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: currentWeek.map(day => {
+                    const date = new Date(day);
+                    return date.toLocaleDateString('en-US', { weekday: 'short' });
+                }),
+                datasets: [{
+                    label: 'Songs Played',
+                    data: currentWeek.map(day => dayCounts[day]),
+                    borderColor: '#1db954',
+                    backgroundColor: 'rgba(29, 185, 84, 0.1)',
+                    borderWidth: 3,
+                    fill: true,
+                    tension: 0.4
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
-                    },
-                    ticks: {
-                        color: '#b3b3b3'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        display: false
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading listening activity chart:', error));
 }
 
 // Create detailed charts for graphs tab
+function loadChartStats() {
+    return fetch('/api/chart-stats')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.error) {
+                chartStats = data;
+            }
+        })
+        .catch(error => {
+            console.error('❌ Error loading chart stats:', error);
+        });
+}
+
 function createDetailedCharts() {
-    createHourlyChart();
-    createDailyChart();
-    createTopArtistsAllTimeChart();
+    // These charts are computed by the server from its rollup tables
+    loadChartStats().then(() => {
+        if (!chartStats) return;
+        createHourlyChart();
+        createDailyChart();
+        createTopArtistsAllTimeChart();
+        createDeviceUsageChart();
+    });
     createTopArtistByDayChart();
-    createDeviceUsageChart();
     createTopAlbumsChart();
     createGenreChart();
     createHourlyListeningChart();
@@ -1545,12 +1674,7 @@ function createHourlyChart() {
     const ctx = document.getElementById('hourlyChart');
     if (!ctx) return;
     
-    const hourCounts = new Array(24).fill(0);
-    
-    allSongs.forEach(song => {
-        const hour = new Date(song.timestamp).getHours();
-        hourCounts[hour]++;
-    });
+    const hourCounts = chartStats.hourly;
     
     if (hourlyChart) {
         hourlyChart.destroy();
@@ -1616,10 +1740,9 @@ function createDailyChart() {
         dayCounts[dayKey] = 0;
     }
     
-    allSongs.forEach(song => {
-        const songDay = song.date; // Use the timezone-corrected date from backend
-        if (dayCounts.hasOwnProperty(songDay)) {
-            dayCounts[songDay]++;
+    Object.entries(chartStats.daily).forEach(([day, count]) => {
+        if (dayCounts.hasOwnProperty(day)) {
+            dayCounts[day] = count;
         }
     });
     
@@ -1680,25 +1803,7 @@ function createTopArtistsAllTimeChart() {
     const ctx = document.getElementById('topArtistsAllTimeChart');
     if (!ctx) return;
     
-    const artistCounts = {};
-    allSongs.forEach(song => {
-        // Handle special case for "Tyler, The Creator" - treat as single artist
-        let artistName = song.artist_name;
-        if (artistName === 'Tyler, The Creator') {
-            artistCounts[artistName] = (artistCounts[artistName] || 0) + 1;
-        } else {
-            // Split artist names by comma and count each individually
-            const artists = artistName.split(',').map(artist => artist.trim());
-            
-            artists.forEach(artist => {
-                artistCounts[artist] = (artistCounts[artist] || 0) + 1;
-            });
-        }
-    });
-    
-    const topArtists = Object.entries(artistCounts)
-        .sort(([,a], [,b]) => b - a)
-        .slice(0, 10);
+    const topArtists = chartStats.top_artists;
     
     if (topArtistsAllTimeChart) {
         topArtistsAllTimeChart.destroy();
@@ -1753,129 +1858,76 @@ function createTopArtistByDayChart() {
     const ctx = document.getElementById('topArtistByDayChart');
     if (!ctx) return;
     
-    // Group songs by day of week and find top artist for each day
-    const dayOfWeekData = {};
-    const dayNames = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'];
-    
-    // Initialize data structure for each day
-    dayNames.forEach(day => {
-        dayOfWeekData[day] = { artistCounts: {}, topArtist: null, topCount: 0 };
-    });
-    
-    // Process each song
-    allSongs.forEach(song => {
-        if (song.timestamp) {
-            const songDate = new Date(song.timestamp);
-            // Map JavaScript day index (0=Sunday, 1=Monday, etc.) to our Monday-first array
-            const jsDayIndex = songDate.getDay();
-            const dayIndex = jsDayIndex === 0 ? 6 : jsDayIndex - 1; // Sunday becomes index 6, Monday becomes index 0
-            const dayName = dayNames[dayIndex];
-            
-            // Only count songs with ≥1m listening time (same as Top Artist Today)
-            if (song.played_duration_ms && song.played_duration_ms >= 60000) {
-                // Handle special case for "Tyler, The Creator" - treat as single artist
-                let artistName = song.artist_name;
-                if (artistName === 'Tyler, The Creator') {
-                    dayOfWeekData[dayName].artistCounts[artistName] = 
-                        (dayOfWeekData[dayName].artistCounts[artistName] || 0) + 1;
-                } else {
-                    // Split artist names by comma and count each individually
-                    const artists = artistName.split(',').map(artist => artist.trim());
-                    
-                    artists.forEach(artist => {
-                        dayOfWeekData[dayName].artistCounts[artist] = 
-                            (dayOfWeekData[dayName].artistCounts[artist] || 0) + 1;
-                    });
-                }
-            }
-        }
-    });
+    // Most played artist of each day of the week over the last year
+    loadChart('top-artist-by-weekday', { days: 365 }).then(chart => {
+        const labels = chart.labels;
+        const data = chart.values;
+        const artistLabels = chart.artists.map(artist => artist || 'No data');
     
-    // Find top artist for each day
-    dayNames.forEach(day => {
-        const artistCounts = dayOfWeekData[day].artistCounts;
-        if (Object.keys(artistCounts).length > 0) {
-            const topArtist = Object.entries(artistCounts)
-                .sort(([,a], [,b]) => b - a)[0];
-            dayOfWeekData[day].topArtist = topArtist[0];
-            dayOfWeekData[day].topCount = topArtist[1];
+        if (topArtistByDayChart) {
+            topArtistByDayChart.destroy();
         }
-    });
-    
-    // Prepare chart data
-    const labels = dayNames;
-    const data = dayNames.map(day => dayOfWeekData[day].topCount);
-    const artistLabels = dayNames.map(day => dayOfWeekData[day].topArtist || 'No data');
-    
-    if (topArtistByDayChart) {
-        topArtistByDayChart.destroy();
-    }
     
-    topArtistByDayChart = new Chart(ctx, {
-        type: 'bar',
-        data: {
-            labels: labels,
-            datasets: [{
-                label: 'Top Artist Plays',
-                data: data,
-                backgroundColor: 'rgba(29, 185, 84, 0.8)',
-                borderColor: '#1db954',
-                borderWidth: 1
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        afterLabel: function(context) {
-                            const dayIndex = context.dataIndex;
-                            const artist = artistLabels[dayIndex];
-                            return `Top Artist: ${artist}`;
-                        }
-                    }
-                }
+        topArtistByDayChart = new Chart(ctx, {
+            type: 'bar',
+            data: {
+                labels: labels,
+                datasets: [{
+                    label: 'Top Artist Plays',
+                    data: data,
+                    backgroundColor: 'rgba(29, 185, 84, 0.8)',
+                    borderColor: '#1db954',
+                    borderWidth: 1
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            afterLabel: function(context) {
+                                const dayIndex = context.dataIndex;
+                                const artist = artistLabels[dayIndex];
+                                return `Top Artist: ${artist}`;
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        beginAtZero: true
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            beginAtZero: true
+                        }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading top artist by day chart:', error));
 }
 
 function createDeviceUsageChart() {
     const ctx = document.getElementById('deviceUsageChart');
     if (!ctx) return;
     
-    const deviceCounts = {};
-    allSongs.forEach(song => {
-        const device = song.device_name || 'Unknown';
-        deviceCounts[device] = (deviceCounts[device] || 0) + 1;
-    });
-    
-    const devices = Object.entries(deviceCounts);
+    const devices = Object.entries(chartStats.devices);
     
     if (deviceUsageChart) {
         deviceUsageChart.destroy();
@@ -1919,61 +1971,56 @@ function createTopAlbumsChart() {
     const ctx = document.getElementById('topAlbumsChart');
     if (!ctx) return;
     
-    const albumCounts = {};
-    allSongs.forEach(song => {
-        albumCounts[song.album_name] = (albumCounts[song.album_name] || 0) + 1;
-    });
-    
-    const topAlbums = Object.entries(albumCounts)
-        .sort(([,a], [,b]) => b - a)
-        .slice(0, 8);
+    loadChart('top-albums', { days: 30, top: 8 }).then(chart => {
+        const topAlbums = chart.labels.map((label, i) => [label, chart.values[i]]);
     
-    if (topAlbumsChart) {
-        topAlbumsChart.destroy();
-    }
+        if (topAlbumsChart) {
+            topAlbumsChart.destroy();
+        }
     
-    topAlbumsChart = new Chart(ctx, {
-        type: 'bar',
-        data: {
-            labels: topAlbums.map(([album]) => album.length > 20 ? album.substring(0, 20) + '...' : album),
-            datasets: [{
-                label: 'Plays',
-                data: topAlbums.map(([, count]) => count),
-                backgroundColor: 'rgba(29, 185, 84, 0.8)',
-                borderColor: '#1db954',
-                borderWidth: 1
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                }
+        topAlbumsChart = new Chart(ctx, {
+            type: 'bar',
+            data: {
+                labels: topAlbums.map(([album]) => album.length > 20 ? album.substring(0, 20) + '...' : album),
+                datasets: [{
+                    label: 'Plays',
+                    data: topAlbums.map(([, count]) => count),
+                    backgroundColor: 'rgba(29, 185, 84, 0.8)',
+                    borderColor: '#1db954',
+                    borderWidth: 1
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
-                    },
-                    ticks: {
-                        color: '#b3b3b3'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading top albums chart:', error));
 }
 
 function createGenreChart() {
@@ -2028,717 +2075,598 @@ function createHourlyListeningChart() {
     const ctx = document.getElementById('hourlyListeningChart');
     if (!ctx) return;
     
-    const hourlyListening = new Array(24).fill(0);
+    // Minutes listened per hour of the day over the last year
+    loadChart('listening-time', { days: 365, bucket: 'hour' }).then(chart => {
+        const hourlyListening = chart.values;
     
-    allSongs.forEach(song => {
-        if (song.played_duration_ms && song.played_duration_ms > 0) {
-            const hour = new Date(song.timestamp).getHours();
-            hourlyListening[hour] += song.played_duration_ms / 1000 / 60; // Convert to minutes
+        if (hourlyListeningChart) {
+            hourlyListeningChart.destroy();
         }
-    });
-    
-    if (hourlyListeningChart) {
-        hourlyListeningChart.destroy();
-    }
     
-    hourlyListeningChart = new Chart(ctx, {
-        type: 'line',
-        data: {
-            labels: Array.from({length: 24}, (_, i) => `${i}:00`),
-            datasets: [{
-                label: 'Minutes Listened',
-                data: hourlyListening,
-                borderColor: '#1ed760',
-                backgroundColor: 'rgba(30, 215, 96, 0.1)',
-                borderWidth: 3,
-                fill: true,
-                tension: 0.4,
-                pointBackgroundColor: '#1ed760',
-                pointBorderColor: '#fff',
-                pointBorderWidth: 2,
-                pointRadius: 4
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            const minutes = context.parsed.y;
-                            const hours = Math.floor(minutes / 60);
-                            const remainingMinutes = Math.round(minutes % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${remainingMinutes}m listened`;
-                            } else {
-                                return `${Math.round(minutes)}m listened`;
-                            }
-                        }
-                    }
-                }
+        hourlyListeningChart = new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: Array.from({length: 24}, (_, i) => `${i}:00`),
+                datasets: [{
+                    label: 'Minutes Listened',
+                    data: hourlyListening,
+                    borderColor: '#1ed760',
+                    backgroundColor: 'rgba(30, 215, 96, 0.1)',
+                    borderWidth: 3,
+                    fill: true,
+                    tension: 0.4,
+                    pointBackgroundColor: '#1ed760',
+                    pointBorderColor: '#fff',
+                    pointBorderWidth: 2,
+                    pointRadius: 4
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                const minutes = context.parsed.y;
+                                const hours = Math.floor(minutes / 60);
+                                const remainingMinutes = Math.round(minutes % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${remainingMinutes}m listened`;
+                                } else {
+                                    return `${Math.round(minutes)}m listened`;
+                                }
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        callback: function(value) {
-                            const hours = Math.floor(value / 60);
-                            const minutes = Math.round(value % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${minutes}m`;
-                            } else {
-                                return `${minutes}m`;
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            callback: function(value) {
+                                const hours = Math.floor(value / 60);
+                                const minutes = Math.round(value % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${minutes}m`;
+                                } else {
+                                    return `${minutes}m`;
+                                }
                             }
                         }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading hourly listening chart:', error));
 }
 
 function createDailyListeningChart() {
     const ctx = document.getElementById('dailyListeningChart');
     if (!ctx) return;
     
-    // Get last 30 days
-    const last30Days = [];
-    const dailyListening = {};
-    
-    for (let i = 29; i >= 0; i--) {
-        const date = new Date();
-        date.setDate(date.getDate() - i);
-        const dayKey = date.toISOString().split('T')[0];
-        last30Days.push(dayKey);
-        dailyListening[dayKey] = 0;
-    }
+    // Minutes listened on each of the last 30 days
+    loadChart('listening-time', { days: 30, bucket: 'day' }).then(chart => {
+        const last30Days = chart.labels;
+        const dailyListening = Object.fromEntries(chart.labels.map((label, i) => [label, chart.values[i]]));
     
-    allSongs.forEach(song => {
-        if (song.played_duration_ms && song.played_duration_ms > 0) {
-            const songDay = song.date; // Use the timezone-corrected date from backend
-            if (dailyListening.hasOwnProperty(songDay)) {
-                dailyListening[songDay] += song.played_duration_ms / 1000 / 60; // Convert to minutes
-            }
+        if (dailyListeningChart) {
+            dailyListeningChart.destroy();
         }
-    });
-    
-    if (dailyListeningChart) {
-        dailyListeningChart.destroy();
-    }
     
-    dailyListeningChart = new Chart(ctx, {
-        type: 'bar',
-        data: {
-            labels: last30Days.map(day => {
-                const date = new Date(day);
-                return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-            }),
-            datasets: [{
-                label: 'Minutes Listened',
-                data: last30Days.map(day => dailyListening[day]),
-                backgroundColor: 'rgba(29, 185, 84, 0.8)',
-                borderColor: '#1db954',
-                borderWidth: 1,
-                borderRadius: 4
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            const minutes = context.parsed.y;
-                            const hours = Math.floor(minutes / 60);
-                            const remainingMinutes = Math.round(minutes % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${remainingMinutes}m listened`;
-                            } else {
-                                return `${Math.round(minutes)}m listened`;
-                            }
-                        }
-                    }
-                }
+        dailyListeningChart = new Chart(ctx, {
+            type: 'bar',
+            data: {
+                labels: last30Days.map(day => {
+                    const date = new Date(day);
+                    return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+                }),
+                datasets: [{
+                    label: 'Minutes Listened',
+                    data: last30Days.map(day => dailyListening[day]),
+                    backgroundColor: 'rgba(29, 185, 84, 0.8)',
+                    borderColor: '#1db954',
+                    borderWidth: 1,
+                    borderRadius: 4
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                const minutes = context.parsed.y;
+                                const hours = Math.floor(minutes / 60);
+                                const remainingMinutes = Math.round(minutes % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${remainingMinutes}m listened`;
+                                } else {
+                                    return `${Math.round(minutes)}m listened`;
+                                }
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        callback: function(value) {
-                            const hours = Math.floor(value / 60);
-                            const minutes = Math.round(value % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${minutes}m`;
-                            } else {
-                                return `${minutes}m`;
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            callback: function(value) {
+                                const hours = Math.floor(value / 60);
+                                const minutes = Math.round(value % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${minutes}m`;
+                                } else {
+                                    return `${minutes}m`;
+                                }
                             }
                         }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading daily listening chart:', error));
 }
 
 function createWeeklyListeningChart() {
     const ctx = document.getElementById('weeklyListeningChart');
     if (!ctx) return;
     
-    const weekDays = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'];
-    const weeklyListening = new Array(7).fill(0);
-    const weeklySongs = new Array(7).fill(0);
+    // Minutes listened and songs played per day of the week over the last year
+    const range = { days: 365, bucket: 'weekday' };
+    Promise.all([loadChart('listening-time', range), loadChart('plays', range)]).then(([minutes, plays]) => {
+        const weekDays = minutes.labels;
+        const weeklyListening = minutes.values;
+        const weeklySongs = plays.values;
     
-    allSongs.forEach(song => {
-        const dayOfWeek = new Date(song.date).getDay(); // Use timezone-corrected date
-        weeklySongs[dayOfWeek]++;
-        if (song.played_duration_ms && song.played_duration_ms > 0) {
-            weeklyListening[dayOfWeek] += song.played_duration_ms / 1000 / 60; // Convert to minutes
+        if (weeklyListeningChart) {
+            weeklyListeningChart.destroy();
         }
-    });
-    
-    if (weeklyListeningChart) {
-        weeklyListeningChart.destroy();
-    }
     
-    weeklyListeningChart = new Chart(ctx, {
-        type: 'bar',
-        data: {
-            labels: weekDays,
-            datasets: [{
-                label: 'Minutes Listened',
-                data: weeklyListening,
-                backgroundColor: 'rgba(29, 185, 84, 0.8)',
-                borderColor: '#1db954',
-                borderWidth: 1,
-                borderRadius: 4,
-                yAxisID: 'y'
-            }, {
-                label: 'Songs Played',
-                data: weeklySongs,
-                backgroundColor: 'rgba(30, 215, 96, 0.6)',
-                borderColor: '#1ed760',
-                borderWidth: 1,
-                borderRadius: 4,
-                yAxisID: 'y1'
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            if (context.dataset.label === 'Minutes Listened') {
-                                const minutes = context.parsed.y;
-                                const hours = Math.floor(minutes / 60);
-                                const remainingMinutes = Math.round(minutes % 60);
-                                if (hours > 0) {
-                                    return `${hours}h ${remainingMinutes}m listened`;
+        weeklyListeningChart = new Chart(ctx, {
+            type: 'bar',
+            data: {
+                labels: weekDays,
+                datasets: [{
+                    label: 'Minutes Listened',
+                    data: weeklyListening,
+                    backgroundColor: 'rgba(29, 185, 84, 0.8)',
+                    borderColor: '#1db954',
+                    borderWidth: 1,
+                    borderRadius: 4,
+                    yAxisID: 'y'
+                }, {
+                    label: 'Songs Played',
+                    data: weeklySongs,
+                    backgroundColor: 'rgba(30, 215, 96, 0.6)',
+                    borderColor: '#1ed760',
+                    borderWidth: 1,
+                    borderRadius: 4,
+                    yAxisID: 'y1'
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
+                    },
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                if (context.dataset.label === 'Minutes Listened') {
+                                    const minutes = context.parsed.y;
+                                    const hours = Math.floor(minutes / 60);
+                                    const remainingMinutes = Math.round(minutes % 60);
+                                    if (hours > 0) {
+                                        return `${hours}h ${remainingMinutes}m listened`;
+                                    } else {
+                                        return `${Math.round(minutes)}m listened`;
+                                    }
                                 } else {
-                                    return `${Math.round(minutes)}m listened`;
+                                    return `${context.parsed.y} songs played`;
                                 }
-                            } else {
-                                return `${context.parsed.y} songs played`;
                             }
                         }
                     }
-                }
-            },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
-                    },
-                    ticks: {
-                        color: '#b3b3b3'
-                    }
                 },
-                y: {
-                    type: 'linear',
-                    display: true,
-                    position: 'left',
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        callback: function(value) {
-                            const hours = Math.floor(value / 60);
-                            const minutes = Math.round(value % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${minutes}m`;
-                            } else {
-                                return `${minutes}m`;
+                    y: {
+                        type: 'linear',
+                        display: true,
+                        position: 'left',
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            callback: function(value) {
+                                const hours = Math.floor(value / 60);
+                                const minutes = Math.round(value % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${minutes}m`;
+                                } else {
+                                    return `${minutes}m`;
+                                }
                             }
                         }
-                    }
-                },
-                y1: {
-                    type: 'linear',
-                    display: true,
-                    position: 'right',
-                    grid: {
-                        drawOnChartArea: false,
                     },
-                    ticks: {
-                        color: '#1ed760'
+                    y1: {
+                        type: 'linear',
+                        display: true,
+                        position: 'right',
+                        grid: {
+                            drawOnChartArea: false,
+                        },
+                        ticks: {
+                            color: '#1ed760'
+                        }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading weekly listening chart:', error));
 }
 
 function createAverageDurationChart() {
     const ctx = document.getElementById('averageDurationChart');
     if (!ctx) return;
     
-    // Get last 30 days
-    const last30Days = [];
-    const dailyAverages = {};
-    
-    for (let i = 29; i >= 0; i--) {
-        const date = new Date();
-        date.setDate(date.getDate() - i);
-        const dayKey = date.toISOString().split('T')[0];
-        last30Days.push(dayKey);
-        dailyAverages[dayKey] = { total: 0, count: 0 };
-    }
+    // Average length of the songs played on each of the last 30 days, in minutes
+    loadChart('average-duration', { days: 30, bucket: 'day' }).then(chart => {
+        const last30Days = chart.labels;
+        const averageData = chart.values;
     
-    allSongs.forEach(song => {
-        if (song.track_duration_ms && song.track_duration_ms > 0) {
-            const songDay = song.date; // Use the timezone-corrected date from backend
-            if (dailyAverages.hasOwnProperty(songDay)) {
-                dailyAverages[songDay].total += song.track_duration_ms;
-                dailyAverages[songDay].count++;
-            }
+        if (averageDurationChart) {
+            averageDurationChart.destroy();
         }
-    });
     
-    const averageData = last30Days.map(day => {
-        const dayData = dailyAverages[day];
-        return dayData.count > 0 ? dayData.total / dayData.count / 1000 / 60 : 0; // Convert to minutes
-    });
-    
-    if (averageDurationChart) {
-        averageDurationChart.destroy();
-    }
-    
-    averageDurationChart = new Chart(ctx, {
-        type: 'line',
-        data: {
-            labels: last30Days.map(day => {
-                const date = new Date(day);
-                return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-            }),
-            datasets: [{
-                label: 'Average Song Duration (minutes)',
-                data: averageData,
-                borderColor: '#ff6b6b',
-                backgroundColor: 'rgba(255, 107, 107, 0.1)',
-                borderWidth: 2,
-                fill: true,
-                tension: 0.4,
-                pointBackgroundColor: '#ff6b6b',
-                pointBorderColor: '#fff',
-                pointBorderWidth: 2,
-                pointRadius: 3
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            const minutes = context.parsed.y;
-                            const hours = Math.floor(minutes / 60);
-                            const remainingMinutes = Math.round(minutes % 60);
-                            if (hours > 0) {
-                                return `Average: ${hours}h ${remainingMinutes}m`;
-                            } else {
-                                return `Average: ${Math.round(minutes)}m`;
-                            }
-                        }
-                    }
-                }
+        averageDurationChart = new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: last30Days.map(day => {
+                    const date = new Date(day);
+                    return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+                }),
+                datasets: [{
+                    label: 'Average Song Duration (minutes)',
+                    data: averageData,
+                    borderColor: '#ff6b6b',
+                    backgroundColor: 'rgba(255, 107, 107, 0.1)',
+                    borderWidth: 2,
+                    fill: true,
+                    tension: 0.4,
+                    pointBackgroundColor: '#ff6b6b',
+                    pointBorderColor: '#fff',
+                    pointBorderWidth: 2,
+                    pointRadius: 3
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                const minutes = context.parsed.y;
+                                const hours = Math.floor(minutes / 60);
+                                const remainingMinutes = Math.round(minutes % 60);
+                                if (hours > 0) {
+                                    return `Average: ${hours}h ${remainingMinutes}m`;
+                                } else {
+                                    return `Average: ${Math.round(minutes)}m`;
+                                }
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        callback: function(value) {
-                            const hours = Math.floor(value / 60);
-                            const minutes = Math.round(value % 60);
-                            if (hours > 0) {
-                                return `${hours}h ${minutes}m`;
-                            } else {
-                                return `${minutes}m`;
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            callback: function(value) {
+                                const hours = Math.floor(value / 60);
+                                const minutes = Math.round(value % 60);
+                                if (hours > 0) {
+                                    return `${hours}h ${minutes}m`;
+                                } else {
+                                    return `${minutes}m`;
+                                }
                             }
                         }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading average duration chart:', error));
 }
 
 function createListeningStreakChart() {
     const ctx = document.getElementById('listeningStreakChart');
     if (!ctx) return;
     
-    // Calculate listening streaks
-    const dailyListening = {};
-    const today = new Date();
-    today.setHours(0, 0, 0, 0);
-    
-    // Get last 60 days for streak calculation
-    for (let i = 59; i >= 0; i--) {
-        const date = new Date();
-        date.setDate(date.getDate() - i);
-        const dayKey = date.toISOString().split('T')[0];
-        dailyListening[dayKey] = 0;
-    }
-    
-    allSongs.forEach(song => {
-        if (song.played_duration_ms && song.played_duration_ms > 0) {
-            const songDay = song.date; // Use the timezone-corrected date from backend
-            if (dailyListening.hasOwnProperty(songDay)) {
-                dailyListening[songDay] += song.played_duration_ms / 1000 / 60; // Convert to minutes
-            }
-        }
-    });
+    // Days in a row with listening time, over the last 60 days
+    loadChart('streak', { days: 60 }).then(chart => {
+        const days = chart.labels;
+        const streakData = chart.values;
+        const maxStreak = Math.max(0, ...streakData);
     
-    // Calculate streaks
-    const days = Object.keys(dailyListening).sort();
-    const streakData = [];
-    let currentStreak = 0;
-    let maxStreak = 0;
-    
-    days.forEach(day => {
-        const minutes = dailyListening[day];
-        if (minutes > 0) {
-            currentStreak++;
-            maxStreak = Math.max(maxStreak, currentStreak);
-        } else {
-            currentStreak = 0;
+        if (listeningStreakChart) {
+            listeningStreakChart.destroy();
         }
-        streakData.push(currentStreak);
-    });
-    
-    if (listeningStreakChart) {
-        listeningStreakChart.destroy();
-    }
     
-    listeningStreakChart = new Chart(ctx, {
-        type: 'line',
-        data: {
-            labels: days.map(day => {
-                const date = new Date(day);
-                return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-            }),
-            datasets: [{
-                label: 'Current Streak (days)',
-                data: streakData,
-                borderColor: '#ffd93d',
-                backgroundColor: 'rgba(255, 217, 61, 0.1)',
-                borderWidth: 3,
-                fill: true,
-                tension: 0.2,
-                pointBackgroundColor: '#ffd93d',
-                pointBorderColor: '#fff',
-                pointBorderWidth: 2,
-                pointRadius: 4
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        afterBody: function(context) {
-                            return `Max streak: ${maxStreak} days`;
-                        }
-                    }
-                }
+        listeningStreakChart = new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: days.map(day => {
+                    const date = new Date(day);
+                    return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+                }),
+                datasets: [{
+                    label: 'Current Streak (days)',
+                    data: streakData,
+                    borderColor: '#ffd93d',
+                    backgroundColor: 'rgba(255, 217, 61, 0.1)',
+                    borderWidth: 3,
+                    fill: true,
+                    tension: 0.2,
+                    pointBackgroundColor: '#ffd93d',
+                    pointBorderColor: '#fff',
+                    pointBorderWidth: 2,
+                    pointRadius: 4
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            afterBody: function(context) {
+                                return `Max streak: ${maxStreak} days`;
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3',
-                        stepSize: 1
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            stepSize: 1
+                        }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading listening streak chart:', error));
 }
 
 function createTopGenresChart() {
     const ctx = document.getElementById('topGenresChart');
     if (!ctx) return;
     
-    // For now, we'll use artist names as a proxy for genres since we don't have genre data
-    // In a real implementation, you'd want to fetch genre data from Spotify API
-    const artistCounts = {};
-    
-    allSongs.forEach(song => {
-        const artist = song.artist_name;
-        artistCounts[artist] = (artistCounts[artist] || 0) + 1;
-    });
-    
-    // Get top 10 artists
-    const topArtists = Object.entries(artistCounts)
-        .sort(([,a], [,b]) => b - a)
-        .slice(0, 10);
+    // Artists stand in for genres, which Spotify doesn't give for tracks
+    loadChart('top-artists', { days: 30, top: 10 }).then(chart => {
+        const topArtists = chart.labels.map((label, i) => [label, chart.values[i]]);
     
-    if (topGenresChart) {
-        topGenresChart.destroy();
-    }
+        if (topGenresChart) {
+            topGenresChart.destroy();
+        }
     
-    topGenresChart = new Chart(ctx, {
-        type: 'doughnut',
-        data: {
-            labels: topArtists.map(([artist]) => artist),
-            datasets: [{
-                data: topArtists.map(([,count]) => count),
-                backgroundColor: [
-                    '#1db954', '#1ed760', '#1fdf64', '#1ed760', '#1db954',
-                    '#1ed760', '#1fdf64', '#1ed760', '#1db954', '#1ed760'
-                ],
-                borderColor: '#fff',
-                borderWidth: 2
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    position: 'right',
-                    labels: {
-                        color: '#fff',
-                        padding: 10,
-                        usePointStyle: true
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            const total = context.dataset.data.reduce((a, b) => a + b, 0);
-                            const percentage = ((context.parsed / total) * 100).toFixed(1);
-                            return `${context.label}: ${context.parsed} songs (${percentage}%)`;
+        topGenresChart = new Chart(ctx, {
+            type: 'doughnut',
+            data: {
+                labels: topArtists.map(([artist]) => artist),
+                datasets: [{
+                    data: topArtists.map(([,count]) => count),
+                    backgroundColor: [
+                        '#1db954', '#1ed760', '#1fdf64', '#1ed760', '#1db954',
+                        '#1ed760', '#1fdf64', '#1ed760', '#1db954', '#1ed760'
+                    ],
+                    borderColor: '#fff',
+                    borderWidth: 2
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        position: 'right',
+                        labels: {
+                            color: '#fff',
+                            padding: 10,
+                            usePointStyle: true
+                        }
+                    },
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                const total = context.dataset.data.reduce((a, b) => a + b, 0);
+                                const percentage = ((context.parsed / total) * 100).toFixed(1);
+                                return `${context.label}: ${context.parsed} songs (${percentage}%)`;
+                            }
                         }
                     }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading top genres chart:', error));
 }
 
 function createCompletionRateChart() {
     const ctx = document.getElementById('completionRateChart');
     if (!ctx) return;
     
-    // Get last 30 days
-    const last30Days = [];
-    const dailyCompletion = {};
-    
-    for (let i = 29; i >= 0; i--) {
-        const date = new Date();
-        date.setDate(date.getDate() - i);
-        const dayKey = date.toISOString().split('T')[0];
-        last30Days.push(dayKey);
-        dailyCompletion[dayKey] = { completed: 0, total: 0 };
-    }
+    // Percentage of the plays of each of the last 30 days that were completed
+    loadChart('completion-rate', { days: 30, bucket: 'day' }).then(chart => {
+        const last30Days = chart.labels;
+        const completionData = chart.values;
     
-    allSongs.forEach(song => {
-        const songDay = song.date; // Use the timezone-corrected date from backend
-        if (dailyCompletion.hasOwnProperty(songDay)) {
-            dailyCompletion[songDay].total++;
-            if (song.is_completed) {
-                dailyCompletion[songDay].completed++;
-            }
+        if (completionRateChart) {
+            completionRateChart.destroy();
         }
-    });
-    
-    const completionData = last30Days.map(day => {
-        const dayData = dailyCompletion[day];
-        return dayData.total > 0 ? (dayData.completed / dayData.total) * 100 : 0;
-    });
-    
-    if (completionRateChart) {
-        completionRateChart.destroy();
-    }
     
-    completionRateChart = new Chart(ctx, {
-        type: 'line',
-        data: {
-            labels: last30Days.map(day => {
-                const date = new Date(day);
-                return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-            }),
-            datasets: [{
-                label: 'Completion Rate (%)',
-                data: completionData,
-                borderColor: '#a855f7',
-                backgroundColor: 'rgba(168, 85, 247, 0.1)',
-                borderWidth: 2,
-                fill: true,
-                tension: 0.4,
-                pointBackgroundColor: '#a855f7',
-                pointBorderColor: '#fff',
-                pointBorderWidth: 2,
-                pointRadius: 3
-            }]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: {
-                    labels: {
-                        color: '#fff'
-                    }
-                },
-                tooltip: {
-                    callbacks: {
-                        label: function(context) {
-                            return `Completion rate: ${context.parsed.y.toFixed(1)}%`;
-                        }
-                    }
-                }
+        completionRateChart = new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: last30Days.map(day => {
+                    const date = new Date(day);
+                    return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+                }),
+                datasets: [{
+                    label: 'Completion Rate (%)',
+                    data: completionData,
+                    borderColor: '#a855f7',
+                    backgroundColor: 'rgba(168, 85, 247, 0.1)',
+                    borderWidth: 2,
+                    fill: true,
+                    tension: 0.4,
+                    pointBackgroundColor: '#a855f7',
+                    pointBorderColor: '#fff',
+                    pointBorderWidth: 2,
+                    pointRadius: 3
+                }]
             },
-            scales: {
-                x: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                plugins: {
+                    legend: {
+                        labels: {
+                            color: '#fff'
+                        }
                     },
-                    ticks: {
-                        color: '#b3b3b3'
+                    tooltip: {
+                        callbacks: {
+                            label: function(context) {
+                                return `Completion rate: ${context.parsed.y.toFixed(1)}%`;
+                            }
+                        }
                     }
                 },
-                y: {
-                    grid: {
-                        color: 'rgba(255, 255, 255, 0.1)'
-                    },
-                    ticks: {
-                        color: '#b3b3b3',
-                        callback: function(value) {
-                            return value + '%';
+                scales: {
+                    x: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3'
                         }
                     },
-                    min: 0,
-                    max: 100
+                    y: {
+                        grid: {
+                            color: 'rgba(255, 255, 255, 0.1)'
+                        },
+                        ticks: {
+                            color: '#b3b3b3',
+                            callback: function(value) {
+                                return value + '%';
+                            }
+                        },
+                        min: 0,
+                        max: 100
+                    }
                 }
             }
-        }
-    });
+        });
+    }).catch(error => console.error('❌ Error loading completion rate chart:', error));
 }
 
+// Stats cards: totals of all plays from the server's rollups
 function updateStats() {
-    const uniqueArtists = new Set(allSongs.map(song => song.artist_name)).size;
-    const uniqueAlbums = new Set(allSongs.map(song => song.album_name)).size;
-    
-    // Calculate today's songs using the date field from backend (already timezone-corrected)
-    const today = new Date().toISOString().split('T')[0]; // YYYY-MM-DD format
-    
-    const todaysSongs = allSongs.filter(song => {
-        return song.date === today;
-    }).length;
-    
-    document.getElementById('totalSongs').textContent = allSongs.length;
-    document.getElementById('uniqueArtists').textContent = uniqueArtists;
-    document.getElementById('uniqueAlbums').textContent = uniqueAlbums;
-    
-    const todayElement = document.getElementById('todaySongs');
-    if (todayElement) {
-        todayElement.textContent = todaysSongs;
-    }
-    
-    // Load listening time statistics
-    loadListeningStats();
-}
-
-function loadListeningStats() {
     fetch('/api/listening-stats')
         .then(response => response.json())
         .then(data => {
             console.log('📊 Listening stats received:', data);
+            if (data.error) throw new Error(data.error);
+            
+            document.getElementById('totalSongs').textContent = data.total_songs;
+            document.getElementById('uniqueArtists').textContent = data.unique_artists;
+            document.getElementById('uniqueAlbums').textContent = data.unique_albums;
+            
+            const todayElement = document.getElementById('todaySongs');
+            if (todayElement) {
+                todayElement.textContent = data.today_songs;
+            }
             
             const totalListenedElement = document.getElementById('totalListened');
             const todayListenedElement = document.getElementById('todayListened');
@@ -2760,23 +2688,81 @@ function refreshData() {
     console.log('🔄 refreshData() called at:', new Date().toISOString());
     loadCurrentSong();
     
-    // Load history data first, then update UI based on active tab
-    loadHistory().then(() => {
-        // Always update recent activity regardless of current tab
-        // This ensures recent activity stays current even when on other pages
-        loadRecentActivity();
-        
-        // Update content for current active tab after history is loaded
-        const activeTab = document.querySelector('.nav-tab.active');
-        if (activeTab) {
-            const tabName = activeTab.getAttribute('data-tab');
-            if (tabName === 'home') {
-                createSimpleCharts();
-            } else if (tabName === 'graphs') {
-                createDetailedCharts();
-            }
+    // The history table only needs its current page
+    const currentTab = document.querySelector('.nav-tab.active');
+    if (currentTab && currentTab.getAttribute('data-tab') === 'history') {
+        loadHistoryPage();
+        return;
+    }
+    
+    // Load the recent songs first, then update UI based on active tab
+    updateStats();
+    loadRecentSongs().then(updateHistoryViews).catch(() => {});
+}
+
+// Redraw what shows the history after it changed
+function updateHistoryViews() {
+    // Always update recent activity regardless of current tab
+    // This ensures recent activity stays current even when on other pages
+    loadRecentActivity();
+    updateRecentActivityHeight();
+    
+    // Update content for current active tab after history is loaded
+    const activeTab = document.querySelector('.nav-tab.active');
+    if (activeTab) {
+        const tabName = activeTab.getAttribute('data-tab');
+        if (tabName === 'home') {
+            createSimpleCharts();
+        } else if (tabName === 'graphs') {
+            createDetailedCharts();
+        } else if (tabName === 'history') {
+            // The table's page is sorted and filtered by the server
+            loadHistoryPage();
         }
-    });
+    }
+}
+
+// Merge a pushed history_delta into recentSongs. It holds the groups changed
+// since its `since` change sequence, so it applies to any songs at least that
+// recent; older ones (or a delta without songs) are fetched again.
+function applyHistoryDelta(data) {
+    if (recentChangeSeq === null) return;  // the first load is still on its way
+    if (data.change_seq !== null && recentChangeSeq >= data.change_seq) return;
+    updateStats();
+    if (data.songs === null || data.since === null || recentChangeSeq < data.since) {
+        loadRecentSongs().then(updateHistoryViews).catch(() => {});
+        return;
+    }
+    mergeSongs(data.songs);
+    recentChangeSeq = data.change_seq;
+    updateHistoryViews();
+}
+
+// Suggest matching tracks from the server's search index while typing
+let searchRequest = 0;
+function loadSearchSuggestions(query) {
+    const suggestions = document.getElementById('searchSuggestions');
+    const request = ++searchRequest;
+    if (query.trim().length < 2) {
+        suggestions.innerHTML = '';
+        return;
+    }
+    fetch(`/api/search?q=${encodeURIComponent(query)}&limit=8`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignore answers to keystrokes that were already superseded
+            if (request !== searchRequest || data.error) return;
+            suggestions.innerHTML = '';
+            data.results.forEach(track => {
+                const option = document.createElement('option');
+                option.value = track.track_name;
+                option.label = `${track.artists.join(', ')} · ${track.album_name}`;
+                suggestions.appendChild(option);
+            });
+        })
+        .catch(error => {
+            console.error('❌ Error searching tracks:', error);
+        });
 }
 
 // Initialize when DOM is loaded
@@ -2786,16 +2772,14 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Filter event listeners
     document.getElementById('globalFilter').addEventListener('input', function() {
-        currentPage = 1; // Reset to first page when filtering
-        updateHistoryDisplay();
+        resetHistoryPages(); // Reset to first page when filtering
+        loadSearchSuggestions(this.value);
     });
     document.getElementById('artistFilter').addEventListener('input', function() {
-        currentPage = 1; // Reset to first page when filtering
-        updateHistoryDisplay();
+        resetHistoryPages(); // Reset to first page when filtering
     });
     document.getElementById('albumFilter').addEventListener('input', function() {
-        currentPage = 1; // Reset to first page when filtering
-        updateHistoryDisplay();
+        resetHistoryPages(); // Reset to first page when filtering
     });
 
     // Table sorting event listeners
@@ -2873,8 +2857,13 @@ document.addEventListener('DOMContentLoaded', function() {
     // Update progress bar every second
     setInterval(updateProgressBar, 1000);
 
-    // Fallback refresh every 10 seconds (in case WebSocket fails)
-    setInterval(refreshData, 10000);
+    // Fallback refresh every 10 seconds while the WebSocket is down; while
+    // it is up, changes are pushed
+    setInterval(() => {
+        if (!socket || !socket.connected) {
+            refreshData();
+        }
+    }, 10000);
     
     // Add resize listener for table overflow detection
     window.addEventListener('resize', function() {
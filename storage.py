@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Database engine configuration for the Spotify Tracker
+
+The tracker writes to the database while the web app reads from it, each in
+its own process. SQLite's defaults (rollback journal, no busy timeout, a full
+fsync on every commit) make them block each other and fail with "database is
+locked", so every connection is configured with pragmas when it is opened:
+
+- WAL journal mode, so readers never block the writer and vice versa
+- synchronous=NORMAL, which is durable in WAL mode except for the last
+  commits before a power loss, and avoids an fsync per commit
+- a busy timeout, so a writer waits for another writer instead of failing
+- a larger page cache and memory-mapped I/O for the read queries
+
+Run this file directly to benchmark reader latency while a writer process
+writes like the tracker does.
+"""
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from sqlalchemy import create_engine, event, text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger('storage')
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///songs.db')
+# How long a connection waits for a lock held by another connection (milliseconds)
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+# Size of the memory-mapped part of the database file (bytes)
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# Page cache per connection; negative values are KiB, as in PRAGMA cache_size
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -32000))
+# Connections kept open by the web app for its read-only queries
+READ_POOL_SIZE = int(os.getenv('READ_POOL_SIZE', 8))
+
+def configure_sqlite(engine, read_only=False):
+    """Set the connection pragmas on every new connection of an SQLite engine"""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+        if not read_only:
+            # Stored in the database file, so read-only connections use it too
+            cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+def create_database_engine(url=None, read_only=False):
+    """Create the engine for `url` (DATABASE_URL by default)
+
+    `read_only` engines refuse writes and keep their own connection pool, so
+    the web app's queries never wait for a connection held by a write.
+    """
+    url = url or DATABASE_URL
+    if not url.startswith('sqlite'):
+        return create_engine(url)
+
+    options = {'pool_size': READ_POOL_SIZE, 'max_overflow': READ_POOL_SIZE} if read_only else {}
+    engine = create_engine(url, **options)
+    configure_sqlite(engine, read_only)
+    return engine
+
+def _benchmark_writer(url, baseline, writes_per_second, stop_at):
+    """Write like the tracker: an insert when a song starts and updates for
+    its progress, each in its own transaction"""
+    engine = create_engine(url) if baseline else create_database_engine(url)
+    errors = 0
+    writes = 0
+    latencies = []
+    play_id = None
+    interval = 1 / writes_per_second
+    while time.time() < stop_at:
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if writes % 4 == 0:
+                    play_id = conn.execute(text(
+                        "INSERT INTO song_plays (track_name, artist_name, album_name, played_duration_ms, "
+                        "timestamp, timestamp_ms, local_date) VALUES ('Song', 'Artist', 'Album', 0, "
+                        ":now, :now_ms, '2024-01-01')"
+                    ), {'now': time.strftime('%Y-%m-%d %H:%M:%S'), 'now_ms': int(time.time() * 1000)}).lastrowid
+                else:
+                    conn.execute(text('UPDATE song_plays SET played_duration_ms = played_duration_ms + 1000 WHERE id = :id'),
+                                 {'id': play_id})
+            latencies.append((time.perf_counter() - started) * 1000)
+        except Exception:
+            errors += 1
+        writes += 1
+        time.sleep(interval)
+    return latencies, errors
+
+def benchmark(rows=20000, duration=10.0, readers=4, writes_per_second=50, baseline=False):
+    """Measure the latency of the web app's queries while a writer process writes"""
+    directory = tempfile.mkdtemp(prefix='spotify-bench-')
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+
+    os.environ['DATABASE_URL'] = url
+    import models  # Creates the schema in the benchmark database
+    import synthetic
+
+    with models.engine.begin() as conn:
+        synthetic.generate_history(conn, rows, start=datetime(2024, 1, 1))
+    if baseline:
+        # Undo the persistent part of the configuration: back to a rollback journal
+        with models.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode = DELETE')
+        read_engine = create_engine(url)
+    else:
+        read_engine = create_database_engine(url, read_only=True)
+
+    queries = [
+        # Like /api/history, which reads every play
+        'SELECT * FROM song_plays ORDER BY timestamp_ms DESC',
+        "SELECT sum(played_duration_ms) FROM song_plays WHERE local_date = '2024-01-01'",
+        'SELECT count(*) FROM song_plays WHERE is_completed = 1'
+    ]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def read():
+        while time.time() < stop_at:
+            for sql in queries:
+                started = time.perf_counter()
+                try:
+                    with read_engine.connect() as conn:
+                        conn.execute(text(sql)).fetchall()
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+    with multiprocessing.Pool(1) as pool:
+        writer = pool.apply_async(_benchmark_writer, (url, baseline, writes_per_second, stop_at))
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        write_latencies, write_errors = writer.get()
+
+    def percentiles(values):
+        values = sorted(values) or [0.0]
+        p50, p99 = (values[min(len(values) - 1, int(len(values) * p))] for p in (0.5, 0.99))
+        return f"p50 {p50:.2f}ms, p99 {p99:.2f}ms, max {values[-1]:.2f}ms"
+    print(f"Configuration:   {'SQLite defaults' if baseline else 'WAL + pragmas, read-only pool'}")
+    print(f"Reads:           {len(latencies)} in {duration:.0f}s by {readers} threads ({errors[0]} failed)")
+    print(f"Read latency:    {percentiles(latencies)}")
+    print(f"Writes:          {len(write_latencies)} ({write_errors} failed)")
+    print(f"Write latency:   {percentiles(write_latencies)}")
+    print(f"Database:        {url}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark reader latency while the tracker writes")
+    parser.add_argument('--rows', type=int, default=20000, help="Plays in the database before the benchmark starts")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writes', type=float, default=50, help="Writer transactions per second")
+    parser.add_argument('--baseline', action='store_true', help="Use SQLite's default settings for comparison")
+    args = parser.parse_args()
+    benchmark(args.rows, args.duration, args.readers, args.writes, args.baseline)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Synthetic listening histories for the benchmarks and tests
+
+The plays are the same for a given seed: one every few minutes, most of
+them of a few hundred popular artists (each with 20 albums of 10 tracks),
+every fifth one featuring a second artist, on three devices, and about 60%
+of them played to the end. `generate_history` writes them to a database as
+closed, rolled up plays with their tracks, albums and artists in the
+catalog, as if the tracker had recorded them.
+"""
+
+import zlib
+import random
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+import rollups
+
+DEVICES = [('Phone', 'Smartphone'), ('Laptop', 'Computer'), ('Living Room', 'Speaker')]
+# Plays inserted per statement
+BATCH_SIZE = 100000
+
+PLAY_COLUMNS = ('id', 'track_name', 'artist_name', 'album_name', 'device_name', 'device_type', 'album_cover_url',
+                'track_uri', 'track_id', 'track_duration_ms', 'played_duration_ms', 'is_completed', 'start_time',
+                'end_time', 'timestamp', 'timestamp_ms', 'local_date', 'local_hour')
+
+def plays(count, artists=2000, start=None, seed=1):
+    """Yield `count` synthetic plays, oldest first, as dicts of song_plays
+    columns plus the ids of their artists ('artist_ids')
+
+    The plays end around now unless they begin at `start` (a naive local time).
+    """
+    rng = random.Random(seed)
+    moment = start or datetime.now() - timedelta(seconds=count * 300)
+    for play_id in range(1, count + 1):
+        moment += timedelta(seconds=rng.randint(30, 570))
+        # Plays per artist fall off with their rank, like in a real history;
+        # the favourite artist gets about 6% of them
+        artist = min(int(20 * rng.paretovariate(1.2)) - 20, artists - 1)
+        album, track = f'{artist}-{rng.randrange(20)}', rng.randrange(10)
+        device_name, device_type = DEVICES[rng.randrange(len(DEVICES))]
+        duration = 120000 + zlib.crc32(f'{album}-{track}'.encode()) % 180000
+        played = duration if rng.random() < 0.6 else rng.randrange(duration)
+        artist_ids = [f'artist{artist}']
+        featured = rng.randrange(artists)
+        if play_id % 5 == 0 and featured != artist:
+            artist_ids.append(f'artist{featured}')
+        yield {
+            'id': play_id, 'track_name': f'Track {album}-{track}',
+            'artist_name': ', '.join(f'Artist {artist_id[6:]}' for artist_id in artist_ids),
+            'album_name': f'Album {album}', 'device_name': device_name, 'device_type': device_type,
+            'album_cover_url': f'https://i.scdn.co/image/ab67616d0000b273{zlib.crc32(album.encode()):024x}', 'track_uri': f'spotify:track:{album}-{track}',
+            'track_id': f'track{album}-{track}', 'track_duration_ms': duration, 'played_duration_ms': played,
+            'is_completed': played >= duration * 0.9, 'start_time': moment,
+            'end_time': moment + timedelta(milliseconds=played),
+            'timestamp': moment.astimezone(timezone.utc).replace(tzinfo=None),
+            'timestamp_ms': int(moment.timestamp() * 1000), 'local_date': moment.strftime('%Y-%m-%d'),
+            'local_hour': moment.hour, 'artist_ids': artist_ids
+        }
+
+def generate_history(conn, count, artists=2000, start=None, seed=1):
+    """Write `count` synthetic plays (see `plays`) and their catalog entries
+    and rollups in the transaction of `conn`; returns the last play"""
+    from models import next_change_seq
+
+    conn.execute(text('INSERT OR IGNORE INTO artists (id, name) VALUES (:id, :name)'),
+                 [{'id': f'artist{index}', 'name': f'Artist {index}'} for index in range(artists)])
+    insert_play = text(f"INSERT INTO song_plays ({', '.join(PLAY_COLUMNS)}, change_seq) "
+                       f"VALUES ({', '.join(':' + column for column in PLAY_COLUMNS)}, :change_seq)")
+    batch, play = [], None
+    for play in plays(count, artists, start, seed):
+        batch.append(play)
+        if len(batch) == BATCH_SIZE:
+            write_batch(conn, batch, insert_play, next_change_seq)
+            batch = []
+    if batch:
+        write_batch(conn, batch, insert_play, next_change_seq)
+    rollups.rebuild(conn)
+    return play
+
+def write_batch(conn, batch, insert_play, next_change_seq):
+    last_seq = next_change_seq(conn, len(batch))
+    for offset, play in enumerate(batch):
+        play['change_seq'] = last_seq - len(batch) + 1 + offset
+    conn.execute(text('INSERT OR IGNORE INTO albums (id, name, cover_url) VALUES (:id, :name, :cover)'),
+                 [{'id': f'album{play["album_name"][6:]}', 'name': play['album_name'], 'cover': play['album_cover_url']}
+                  for play in batch])
+    conn.execute(text('INSERT OR IGNORE INTO tracks (id, name, album_id, duration_ms, uri) '
+                      'VALUES (:id, :name, :album, :duration, :uri)'),
+                 [{'id': play['track_id'], 'name': play['track_name'], 'album': f'album{play["album_name"][6:]}',
+                   'duration': play['track_duration_ms'], 'uri': play['track_uri']} for play in batch])
+    conn.execute(insert_play, batch)
+    conn.execute(text('INSERT INTO play_artists (play_id, artist_id, position) VALUES (:play_id, :artist_id, :position)'),
+                 [{'play_id': play['id'], 'artist_id': artist_id, 'position': position}
+                  for play in batch for position, artist_id in enumerate(play['artist_ids'])])
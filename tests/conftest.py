@@ -0,0 +1,42 @@
+"""
+The modules open the database named by DATABASE_URL and their output.log
+log file when they are imported, so both are pointed at a scratch directory
+before any test imports them.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix='spotify-tracker-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'songs.db')}"
+os.environ.setdefault('SPOTIFY_API_URL', 'http://127.0.0.1:9/v1')
+os.chdir(WORKDIR)
+
+# Tables emptied before each test that uses the database
+TABLES = ('song_plays', 'play_artists', 'tracks', 'artists', 'albums', 'play_partitions', 'hourly_rollups',
+          'artist_rollups', 'track_rollups', 'total_rollups', 'track_search')
+
+@pytest.fixture
+def db():
+    """The models module, over an empty database without cold partitions"""
+    import models
+    import partitions
+    with models.engine.begin() as conn:
+        for table in TABLES:
+            conn.exec_driver_sql(f'DELETE FROM {table}')
+    shutil.rmtree(partitions.PARTITION_DIR, ignore_errors=True)
+    return models
+
+@pytest.fixture
+def client(db):
+    """Test client of the web app, with an empty response cache"""
+    import app
+    app.response_cache.clear()
+    return app.app.test_client()
@@ -0,0 +1,97 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import synthetic
+from tracker import insert_play
+
+PLAYS = 10000
+
+@pytest.fixture
+def plays(db):
+    """About five weeks of plays from March 2024 and one of 2021; returns the newest"""
+    with db.engine.begin() as conn:
+        newest = synthetic.generate_history(conn, PLAYS - 1, artists=40, start=datetime(2024, 3, 1))
+    insert_play({'track_name': 'Old Song', 'start_time': datetime(2021, 6, 1, 12),
+                 'end_time': datetime(2021, 6, 1, 12, 3)})
+    return newest
+
+def test_history_is_sent_a_page_at_a_time(client, plays):
+    data = client.get('/api/history').get_json()
+    assert len(data['songs']) == 50
+    assert data['next_cursor']
+    assert data['change_seq'] >= plays['change_seq']
+
+    following = client.get(f"/api/history?cursor={data['next_cursor']}").get_json()
+    assert following['songs'][0] != data['songs'][-1]
+    assert len(following['songs']) == 50
+
+def test_whole_history_needs_an_opt_in(client, plays):
+    data = client.get('/api/history?all=1').get_json()
+    assert data['full'] is True
+    assert sum(song['plays'] for song in data['songs']) == PLAYS
+
+def test_sorted_pages_report_their_range(client, plays):
+    data = client.get('/api/history?limit=10&sort=track_name').get_json()
+    newest = date.fromisoformat(plays['local_date'])
+    assert (data['from'], data['to']) == ((newest - timedelta(days=365)).isoformat(), newest.isoformat())
+
+    response = client.get('/api/history?limit=10&sort=track_name&from=2020-01-01')
+    assert response.status_code == 400
+    assert 'at most 366 days' in response.get_json()['error']
+
+def test_too_large_delta_asks_for_a_reload(client, plays):
+    data = client.get('/api/history?since=0').get_json()
+    assert data['songs'] is None
+    assert data['full'] is False
+
+    data = client.get('/api/history?since=0&all=1').get_json()
+    assert data['full'] is True
+    assert sum(song['plays'] for song in data['songs']) == PLAYS
+
+@pytest.mark.parametrize('query', ['since=latest', 'days=0', 'limit=5&from=2024-02-30'])
+def test_invalid_arguments_are_rejected(client, plays, query):
+    assert client.get(f'/api/history?{query}').status_code == 400
+
+def test_unchanged_history_is_answered_with_304(client, plays):
+    response = client.get('/api/history?limit=10')
+    etag = response.headers['ETag']
+    assert response.headers['X-Cache'] == 'MISS'
+    assert client.get('/api/history?limit=10').headers['X-Cache'] == 'HIT'
+
+    response = client.get('/api/history?limit=10', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    # Another query is another representation
+    assert client.get('/api/history?limit=20', headers={'If-None-Match': etag}).status_code == 200
+
+    insert_play({'track_name': 'New Song', 'start_time': datetime.now()})
+    response = client.get('/api/history?limit=10', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['songs'][0]['track_name'] == 'New Song'
+
+def test_compressed_history_carries_a_weak_etag(client, plays):
+    response = client.get('/api/history?limit=100', headers={'Accept-Encoding': 'gzip'})
+    assert response.content_encoding == 'gzip'
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+
+    response = client.get('/api/history?limit=100', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+def test_delta_returns_the_changed_songs(client, plays):
+    since = client.get('/api/history?limit=10').get_json()['change_seq']
+    response = client.get(f'/api/history?since={since}')
+    assert response.get_json()['songs'] == []
+    # Polled again with the ETag of the delta, nothing changed
+    assert client.get(f'/api/history?since={since}',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    insert_play({'track_name': 'New Song', 'start_time': datetime.now()})
+    delta = client.get(f'/api/history?since={since}').get_json()
+    assert [song['track_name'] for song in delta['songs']] == ['New Song']
+    assert delta['change_seq'] > since
+    assert client.get(f"/api/history?since={delta['change_seq']}").get_json()['songs'] == []
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import artists
+import partitions
+import synthetic
+from tracker import insert_play
+
+@pytest.fixture
+def session(db):
+    """About five weeks of plays from March 2024, March's in a cold partition"""
+    with db.engine.begin() as conn:
+        synthetic.generate_history(conn, 10000, artists=200, start=datetime(2024, 3, 1))
+    expected = {}
+    with db.engine.connect() as conn:
+        for name in ('Artist 0', 'Artist 150'):
+            expected[name] = [tuple(row) for row in conn.execute(text(
+                'SELECT song_plays.timestamp, song_plays.track_name FROM song_plays '
+                'JOIN play_artists ON play_artists.play_id = song_plays.id '
+                'JOIN artists ON artists.id = play_artists.artist_id WHERE artists.name = :name '
+                'ORDER BY song_plays.timestamp_ms DESC, song_plays.id DESC'), {'name': name})]
+    partitions.roll_over(db.engine, month='2024-05')
+    session = db.Session()
+    session.expected = expected
+    yield session
+    session.close()
+
+def all_pages(session, name, list_name, limit):
+    songs, cursor = [], None
+    while True:
+        page, cursor = artists.songs(session, name, list_name, limit, cursor)
+        songs.extend(page)
+        if not cursor:
+            return songs
+
+def plays(songs):
+    return [(song['timestamp'].replace('T', ' '), song['track_name']) for song in songs]
+
+@pytest.mark.parametrize('name', ['Artist 0', 'Artist 150'])
+def test_history_pages_list_every_play_once_across_partitions(session, name):
+    assert partitions.cold_months(session.connection()) == ['2024-03']
+
+    songs = all_pages(session, name, 'history', 7)
+
+    assert plays(songs) == session.expected[name]
+    assert songs
+
+def test_plays_at_the_same_moment_are_paged_by_id(db):
+    track = {'id': 'same', 'name': 'Same Time', 'artists': [{'id': 'artist1', 'name': 'Artist 1'}],
+             'album': {'id': 'album1', 'name': 'Album', 'images': []}}
+    moment = datetime(2024, 3, 1, 12)
+    for device in ('Phone', 'Laptop', 'Speaker'):
+        insert_play({'track_name': 'Same Time', 'artist_name': 'Artist 1', 'device_name': device,
+                     'start_time': moment, 'timestamp': moment}, track)
+    session = db.Session()
+    try:
+        assert len(all_pages(session, 'Artist 1', 'history', 1)) == 3
+    finally:
+        session.close()
+
+def test_track_lists_cover_every_group_once(session):
+    page = artists.artist_page(session, 'Artist 0')
+    solo = all_pages(session, 'Artist 0', 'solo', 4)
+    feature = all_pages(session, 'Artist 0', 'feature', 4)
+
+    assert solo[:len(page['solo_songs_list'])] == page['solo_songs_list']
+    assert len(solo) + len(feature) == page['unique_tracks']
+    assert len({(song['track_name'], song['album_name']) for song in solo}) == len(solo)
+    assert page['total_songs'] == len(session.expected['Artist 0'])
+    assert feature and all(', ' in song['artist_name'] for song in feature)
+
+def test_invalid_cursors_and_lists_are_rejected(session):
+    with pytest.raises(ValueError):
+        artists.songs(session, 'Artist 0', 'history', cursor='bm90IGEgY3Vyc29y')
+    with pytest.raises(ValueError):
+        artists.songs(session, 'Artist 0', 'solo', cursor=artists.encode_cursor([1, 2]))
+    with pytest.raises(ValueError):
+        artists.songs(session, 'Artist 0', 'remixes')
@@ -0,0 +1,78 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import export
+import partitions
+import synthetic
+
+@pytest.fixture
+def history(db):
+    """About two weeks of plays from the end of January 2024, January's in a cold partition"""
+    with db.engine.begin() as conn:
+        synthetic.generate_history(conn, 4000, artists=40, start=datetime(2024, 1, 25))
+    partitions.roll_over(db.engine, month='2024-03')
+    return db
+
+def count(db, first_day='', last_day='9999'):
+    with db.engine.connect() as conn:
+        return sum(conn.execute(text(
+            f'SELECT count(*) FROM {schema}.song_plays WHERE local_date BETWEEN :first_day AND :last_day'),
+            {'first_day': first_day, 'last_day': last_day}).scalar()
+            for schema in partitions.routed(conn))
+
+def test_csv_export_has_every_play_of_every_partition(history):
+    rows = list(csv.DictReader(io.StringIO(b''.join(export.export(history.ReadSession)).decode())))
+
+    assert len(rows) == count(history) == 4000
+    assert len({row['id'] for row in rows}) == len(rows)
+    assert {row['local_date'][:7] for row in rows} == {'2024-01', '2024-02'}
+    assert any(', ' in row['artists'] for row in rows)
+
+def test_ndjson_export_is_streamed_in_whole_lines(history, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 4096)
+    chunks = list(export.export(history.ReadSession, 'ndjson', '2024-01-30', '2024-02-02'))
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    plays = [json.loads(line) for line in b''.join(chunks).splitlines()]
+    assert len(plays) == count(history, '2024-01-30', '2024-02-02')
+    assert {play['local_date'] for play in plays} == {'2024-01-30', '2024-01-31', '2024-02-01', '2024-02-02'}
+    assert all(isinstance(play['artists'], list) and isinstance(play['is_completed'], bool) for play in plays)
+
+@pytest.mark.parametrize('format', list(export.FORMATS))
+def test_compressed_export_is_the_same_file(history, format):
+    plain = b''.join(export.export(history.ReadSession, format))
+    assert gzip.decompress(b''.join(export.export(history.ReadSession, format, compress=True))) == plain
+
+def test_abandoned_export_closes_its_session(history, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 1024)
+    sessions = []
+
+    def session_factory():
+        session = history.ReadSession()
+        close = session.close
+        session.close = lambda: (sessions.append('closed'), close())
+        return session
+
+    chunks = export.export(session_factory, 'csv')
+    next(chunks)
+    chunks.close()
+
+    assert sessions == ['closed']
+
+def test_export_endpoint_streams_a_download(client, history):
+    response = client.get('/api/export?format=ndjson&from=2024-02-01&gzip=1')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'] == \
+        'attachment; filename="spotify-history-2024-02-01-to-today.ndjson.gz"'
+    assert len(gzip.decompress(response.get_data()).splitlines()) == count(history, '2024-02-01')
+    assert client.get('/api/export?format=xml').status_code == 400
+    assert client.get('/api/export?from=2024-02-30').status_code == 400
@@ -0,0 +1,113 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import history
+import partitions
+import synthetic
+from tracker import insert_play, update_play
+
+@pytest.fixture
+def session(db):
+    """About two weeks of plays from March 2024, the first days of them in a
+    cold partition, and one play of 2021"""
+    with db.engine.begin() as conn:
+        synthetic.generate_history(conn, 4000, artists=40, start=datetime(2024, 2, 25))
+    partitions.roll_over(db.engine, month='2024-04')
+    insert_play({'track_name': 'Old Song', 'artist_name': 'Old Artist', 'album_name': 'Old Album',
+                 'start_time': datetime(2021, 6, 1, 12), 'end_time': datetime(2021, 6, 1, 12, 3)})
+    session = db.Session()
+    yield session
+    session.close()
+
+def all_pages(session, limit, **arguments):
+    songs, cursor, pages = [], None, 0
+    while True:
+        page, cursor, _ = history.page(session, limit, cursor, **arguments)
+        songs.extend(page)
+        pages += 1
+        if not cursor:
+            return songs, pages
+
+def keys(songs):
+    return [(song['date'], song['track_name'], song['album_name']) for song in songs]
+
+def test_pages_by_time_walk_the_whole_history_once(session):
+    songs, pages = all_pages(session, 37)
+
+    assert keys(songs) == keys(history.all_songs(session))
+    assert len(set(keys(songs))) == len(songs)
+    assert pages == -(-len(songs) // 37)
+    assert any(song['date'] < '2024-03-01' for song in songs)
+    assert songs[-1]['track_name'] == 'Old Song'
+
+def test_pages_by_time_ascending_are_the_reverse(session):
+    descending, _ = all_pages(session, 50)
+    ascending, _ = all_pages(session, 50, direction='asc')
+    assert keys(ascending) == keys(descending)[::-1]
+
+def test_pages_sorted_by_name_follow_the_sort(session):
+    songs, _ = all_pages(session, 40, sort='track_name', direction='asc', first_day='2024-02-26',
+                         last_day='2024-03-04')
+
+    expected = sorted((song for song in history.all_songs(session, '2024-02-26') if song['date'] <= '2024-03-04'),
+                      key=lambda song: (song['track_name'].lower(), song['date'], song['track_name'],
+                                        song['album_name']))
+    assert keys(songs) == keys(expected)
+
+def test_filtered_pages_include_featured_artists(session):
+    def credited(song):
+        # The filter matches artist names containing it
+        return any('Artist 3' in artist for artist in song['artists'])
+
+    songs, _ = all_pages(session, 25, artist='Artist 3')
+
+    # Groups are made of their matching plays only, which can order them
+    # differently from the unfiltered history
+    assert keys(songs) == keys(all_pages(session, 500, artist='Artist 3')[0])
+    assert set(keys(songs)) == set(keys(filter(credited, history.all_songs(session))))
+    assert any(not song['artists'][0].startswith('Artist 3') for song in songs)
+
+def test_sorts_other_than_time_cover_the_last_year_of_the_history(session):
+    songs, _, (first_day, last_day) = history.page(session, 500, sort='track_name')
+
+    newest = history.all_songs(session)[0]['date']
+    assert (last_day, first_day) == (newest, (date.fromisoformat(newest) - timedelta(days=365)).isoformat())
+    assert 'Old Song' not in [song['track_name'] for song in songs]
+    with pytest.raises(ValueError, match='at most 366 days'):
+        history.page(session, 50, sort='track_name', first_day='2021-01-01')
+    songs, _, _ = history.page(session, 50, sort='track_name', first_day='2021-01-01', last_day='2021-12-31')
+    assert [song['track_name'] for song in songs] == ['Old Song']
+
+@pytest.mark.parametrize('arguments', [{'cursor': 'not-a-cursor'}, {'sort': 'popularity'}, {'direction': 'up'},
+                                       {'first_day': '2024-13-01'}])
+def test_invalid_arguments_are_rejected(session, arguments):
+    with pytest.raises(ValueError):
+        history.page(session, 50, **arguments)
+
+def test_changed_songs_are_the_groups_of_changed_plays(session):
+    since, _ = history.version(session.connection())
+    assert history.changed_songs(session, since) == []
+
+    day = history.all_songs(session)[3]
+    play_id = session.execute(text(
+        'SELECT id FROM song_plays WHERE local_date = :day AND track_name = :track ORDER BY id LIMIT 1'),
+        {'day': day['date'], 'track': day['track_name']}).scalar()
+    session.rollback()
+    update_play(play_id, {'played_duration_ms': 1})
+    insert_play({'track_name': 'New Song', 'start_time': datetime.now()})
+
+    changed = history.changed_songs(session, since)
+    assert [song['track_name'] for song in changed] == ['New Song', day['track_name']]
+    # The whole group is sent again, with every play of it
+    assert changed[1]['plays'] == day['plays']
+    assert history.changed_songs(session, since, first_day=datetime.now().strftime('%Y-%m-%d'))[0] == changed[0]
+
+def test_changes_spanning_too_many_days_are_not_a_delta(session, monkeypatch):
+    monkeypatch.setattr(history, 'MAX_CHANGED_DAYS', 2)
+    newest = history.all_songs(session)[0]['date']
+
+    assert history.changed_songs(session, 0) is None
+    songs = history.changed_songs(session, 0, first_day=newest)
+    assert songs == history.all_songs(session, newest)
@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import text
+
+import migrations
+import models
+from storage import create_database_engine
+
+# song_plays as the first versions of the tracker created it
+LEGACY_SCHEMA = ('CREATE TABLE song_plays (id INTEGER PRIMARY KEY, track_name VARCHAR, artist_name VARCHAR, '
+                 'album_name VARCHAR, device_name VARCHAR, timestamp DATETIME)')
+
+LEGACY_PLAYS = [
+    {'track': 'Earfquake', 'artist': 'Tyler, The Creator', 'album': 'Igor', 'timestamp': '2023-03-01 20:15:00'},
+    {'track': 'See You Again', 'artist': 'Tyler, The Creator, Kali Uchis', 'album': 'Flower Boy',
+     'timestamp': '2023-03-01 20:20:00'},
+    {'track': 'Earfquake', 'artist': 'Tyler, The Creator', 'album': 'Igor', 'timestamp': '2023-03-02 08:00:00'},
+]
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(LEGACY_SCHEMA))
+        conn.execute(text("INSERT INTO song_plays (track_name, artist_name, album_name, device_name, timestamp) "
+                          "VALUES (:track, :artist, :album, 'Phone', :timestamp)"), LEGACY_PLAYS)
+    yield engine
+    engine.dispose()
+
+def snapshot(engine):
+    """Schema and rows of every table; the FTS index is compared through its
+    virtual table, whose internal segments a rebuild renumbers"""
+    with engine.connect() as conn:
+        schema = conn.execute(text(
+            "SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY type, name")).fetchall()
+        rows = {name: sorted(map(tuple, conn.execute(text(f'SELECT * FROM {name}'))), key=repr)
+                for kind, name, _ in schema
+                if kind == 'table' and not name.startswith('track_search_') and name != 'schema_migrations'}
+    return schema, rows
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text('SELECT version FROM schema_migrations ORDER BY version'))]
+
+def test_legacy_database_is_upgraded(legacy_engine):
+    migrations.migrate(legacy_engine, models.Base.metadata)
+
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text('SELECT count(*) FROM song_plays WHERE local_date IS NULL')).scalar() == 0
+        assert sorted(row[0] for row in conn.execute(text('SELECT name FROM artists'))) == \
+            ['Kali Uchis', 'Tyler, The Creator']
+        assert conn.execute(text('SELECT count(*) FROM tracks')).scalar() == 2
+        assert conn.execute(text('SELECT plays FROM total_rollups')).scalar() == 3
+    assert applied_versions(legacy_engine) == [version for version, _, _ in migrations.MIGRATIONS]
+
+def test_migrating_again_changes_nothing(legacy_engine):
+    migrations.migrate(legacy_engine, models.Base.metadata)
+    before = snapshot(legacy_engine)
+
+    migrations.migrate(legacy_engine, models.Base.metadata)
+
+    assert snapshot(legacy_engine) == before
+    assert applied_versions(legacy_engine) == [version for version, _, _ in migrations.MIGRATIONS]
+
+def test_every_migration_can_run_twice(legacy_engine):
+    """A migration interrupted after its changes but before it was recorded
+    runs again on the next start"""
+    migrations.migrate(legacy_engine, models.Base.metadata)
+    before = snapshot(legacy_engine)
+
+    for _, _, upgrade in migrations.MIGRATIONS:
+        with legacy_engine.begin() as conn:
+            upgrade(conn)
+
+    assert snapshot(legacy_engine) == before
+
+def test_new_database_gets_the_same_schema_as_an_upgraded_one(legacy_engine, tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    try:
+        migrations.migrate(engine, models.Base.metadata)
+        migrations.migrate(legacy_engine, models.Base.metadata)
+
+        def indexes(engine):
+            with engine.connect() as conn:
+                return {row[0] for row in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'song_plays' "
+                    "AND name NOT LIKE 'sqlite_%'"))}
+
+        assert indexes(legacy_engine) == indexes(engine)
+        with engine.connect() as conn, legacy_engine.connect() as legacy:
+            assert migrations.table_columns(legacy, 'song_plays') == migrations.table_columns(conn, 'song_plays')
+    finally:
+        engine.dispose()
@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+import multi_tracker
+from multi_tracker import BatchWriter
+
+class RecordingPublisher:
+    def __init__(self):
+        self.events = []
+
+    def publish(self, event):
+        self.events.append(event)
+
+def play_fields(name, minute):
+    return {'user_id': 'alice', 'track_name': name, 'artist_name': 'Artist', 'album_name': 'Album',
+            'start_time': datetime(2024, 5, 1, 12, minute), 'played_duration_ms': 0}
+
+def closed(minute):
+    return {'end_time': datetime(2024, 5, 1, 12, minute), 'played_duration_ms': 60000, 'is_completed': True}
+
+def failing_for(track_name, add_play, times=None):
+    """add_play that fails for plays of `track_name` (the first `times` times)"""
+    failures = []
+
+    def add_failing_play(session, fields, track=None):
+        if fields['track_name'] == track_name and (times is None or len(failures) < times):
+            failures.append(fields)
+            raise OperationalError('INSERT INTO song_plays', {}, Exception('disk I/O error'))
+        return add_play(session, fields, track)
+    return add_failing_play
+
+def stored_plays(db):
+    session = db.Session()
+    try:
+        return {play.track_name: play for play in session.query(db.SongPlay)}
+    finally:
+        session.close()
+
+def test_a_failing_play_does_not_drop_the_rest_of_its_batch(db, monkeypatch, caplog):
+    monkeypatch.setattr(multi_tracker, 'add_play', failing_for('Broken', multi_tracker.add_play))
+    publisher = RecordingPublisher()
+    writer = BatchWriter(publisher)
+    first = writer.insert(play_fields('First', 0))
+    broken = writer.insert(play_fields('Broken', 1))
+    writer.update(first, closed(1))
+    writer.update(broken, closed(2))
+    last = writer.insert(play_fields('Last', 2))
+
+    with caplog.at_level(logging.ERROR, logger='multi_tracker'):
+        writer.write(writer.take())
+
+    plays = stored_plays(db)
+    assert set(plays) == {'First', 'Last'}
+    assert plays['First'].end_time == datetime(2024, 5, 1, 12, 1)
+    assert plays['First'].rolled_up
+    assert (first.id, last.id) == (plays['First'].id, plays['Last'].id)
+    assert broken.id is None
+    assert publisher.events == [{'event': 'plays', 'inserted': [first.id, last.id], 'updated': [first.id]}]
+    assert any('Dropped 2 writes of Broken of alice' in message for message in caplog.messages)
+
+def test_a_batch_that_fails_once_is_written_in_full(db, monkeypatch):
+    monkeypatch.setattr(multi_tracker, 'add_play', failing_for('Second', multi_tracker.add_play, times=1))
+    writer = BatchWriter(RecordingPublisher())
+    handles = [writer.insert(play_fields(name, minute)) for minute, name in enumerate(('First', 'Second'))]
+
+    writer.write(writer.take())
+
+    assert set(stored_plays(db)) == {'First', 'Second'}
+    assert all(handle.id is not None for handle in handles)
+    assert (writer.batches, writer.rows) == (0, 2)
+
+def test_updates_of_an_earlier_batch_are_retried(db, monkeypatch):
+    writer = BatchWriter(RecordingPublisher())
+    handle = writer.insert(play_fields('First', 0))
+    writer.write(writer.take())
+    monkeypatch.setattr(multi_tracker, 'add_play', failing_for('Broken', multi_tracker.add_play))
+    writer.update(handle, closed(3))
+    writer.insert(play_fields('Broken', 4))
+
+    writer.write(writer.take())
+
+    assert stored_plays(db)['First'].end_time == datetime(2024, 5, 1, 12, 3)
@@ -0,0 +1,89 @@
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import partitions
+import rollups
+import synthetic
+
+ROLLUP_TABLES = ('hourly_rollups', 'artist_rollups', 'track_rollups', 'total_rollups')
+
+@pytest.fixture
+def history(db):
+    """About five weeks of plays from January 2024; March is the current month"""
+    with db.engine.begin() as conn:
+        synthetic.generate_history(conn, 10000, artists=50, start=datetime(2024, 1, 1))
+    return db.engine
+
+def count(conn, sql, **params):
+    return conn.execute(text(sql), params).scalar()
+
+def rollup_rows(conn):
+    return {table: sorted(map(tuple, conn.execute(text(f'SELECT * FROM {table}')))) for table in ROLLUP_TABLES}
+
+def routed_plays(conn):
+    return sum(count(conn, f'SELECT count(*) FROM {schema}.song_plays') for schema in partitions.routed(conn))
+
+def test_roll_over_moves_the_months_before_the_hot_window(history):
+    with history.connect() as conn:
+        january = count(conn, "SELECT count(*) FROM song_plays WHERE local_date < '2024-02-01'")
+        total = count(conn, 'SELECT count(*) FROM song_plays')
+        before = rollup_rows(conn)
+
+    assert partitions.roll_over(history, month='2024-03') == january
+
+    with history.connect() as conn:
+        assert count(conn, "SELECT count(*) FROM song_plays WHERE local_date < '2024-02-01'") == 0
+        assert partitions.cold_months(conn) == ['2024-01']
+        assert count(conn, "SELECT plays FROM play_partitions WHERE month = '2024-01'") == january
+        assert routed_plays(conn) == total
+        assert [schema for schema in partitions.routed(conn, first_day='2024-02-01')] == ['main']
+        assert rollup_rows(conn) == before
+        conn.commit()
+    with partitions.partition_connection('2024-01') as partition:
+        assert count(partition, 'SELECT count(*) FROM song_plays') == january
+        assert count(partition, 'SELECT count(DISTINCT play_id) FROM play_artists') == january
+    assert os.stat(partitions.partition_path('2024-01')).st_mode & 0o222 == 0
+
+def test_moving_a_month_again_changes_nothing(history):
+    partitions.roll_over(history, month='2024-03')
+    with history.connect() as conn:
+        moved = count(conn, "SELECT plays FROM play_partitions WHERE month = '2024-01'")
+        newest_id = count(conn, 'SELECT max(id) FROM song_plays')
+
+        assert partitions.move_month(conn, '2024-01', newest_id) == 0
+        assert count(conn, "SELECT plays FROM play_partitions WHERE month = '2024-01'") == moved
+        assert routed_plays(conn) == 10000
+
+def test_rebuild_reads_the_partitions(history):
+    partitions.roll_over(history, month='2024-03')
+    with history.begin() as conn:
+        before = rollup_rows(conn)
+    with history.begin() as conn:
+        rollups.rebuild(conn, partitions.partition_connections(conn))
+        assert rollup_rows(conn) == before
+
+def test_retention_drops_old_partitions_but_keeps_their_rollups(history, monkeypatch):
+    partitions.roll_over(history, month='2024-03')
+    with history.connect() as conn:
+        before = rollup_rows(conn)
+        hot = count(conn, 'SELECT count(*) FROM song_plays')
+    monkeypatch.setattr(partitions, 'RETENTION_MONTHS', 1)
+
+    assert partitions.apply_retention(history, month='2024-03') == ['2024-01']
+
+    assert not os.path.exists(partitions.partition_path('2024-01'))
+    with history.begin() as conn:
+        assert partitions.cold_months(conn) == []
+        assert count(conn, "SELECT dropped_at IS NOT NULL FROM play_partitions WHERE month = '2024-01'") == 1
+        assert routed_plays(conn) == hot
+        assert rollup_rows(conn) == before
+        rollups.rebuild(conn, partitions.partition_connections(conn))
+        assert rollup_rows(conn) == before
+
+def test_retention_is_off_by_default(history):
+    partitions.roll_over(history, month='2024-03')
+    assert partitions.apply_retention(history, month='2030-01') == []
+    assert os.path.exists(partitions.partition_path('2024-01'))
@@ -0,0 +1,84 @@
+import shutil
+from datetime import datetime
+
+import pytest
+
+import synthetic
+from response_cache import ResponseCache
+from tracker import insert_play
+
+def test_least_recently_used_bodies_are_evicted():
+    cache = ResponseCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb', 'gzip')
+    assert cache.get('a') == (b'aaaa', None)
+
+    cache.put('c', b'cccc')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == (b'aaaa', None)
+    assert cache.get('c') == (b'cccc', None)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'hit_rate': 75.0, 'evictions': 1, 'entries': 2,
+                             'size_bytes': 8, 'max_bytes': 10}
+
+def test_replacing_a_body_frees_its_size():
+    cache = ResponseCache(10)
+    cache.put('a', b'aaaaaaaa')
+    cache.put('a', b'aa', 'br')
+    cache.put('b', b'bbbbbbbb')
+
+    assert cache.get('a') == (b'aa', 'br')
+    assert cache.stats()['size_bytes'] == 10
+    assert cache.stats()['evictions'] == 0
+
+def test_bodies_larger_than_the_cache_are_not_kept():
+    cache = ResponseCache(4)
+    cache.put('a', b'aaaaa')
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+def play(name):
+    insert_play({'track_name': name, 'artist_name': 'Artist', 'album_name': 'Album', 'start_time': datetime.now(),
+                 'end_time': datetime.now(), 'played_duration_ms': 1000})
+
+def test_responses_are_cached_until_the_database_changes(client):
+    play('First')
+    first = client.get('/api/listening-stats')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert client.get('/api/listening-stats').headers['X-Cache'] == 'HIT'
+    assert first.get_json()['total_songs'] == 1
+
+    play('Second')
+
+    second = client.get('/api/listening-stats')
+    assert second.headers['X-Cache'] == 'MISS'
+    assert second.get_json()['total_songs'] == 2
+
+def test_arguments_and_encodings_are_cached_apart(client):
+    play('First')
+    assert client.get('/api/history?limit=5').headers['X-Cache'] == 'MISS'
+    assert client.get('/api/history?limit=6').headers['X-Cache'] == 'MISS'
+    assert client.get('/api/history?limit=5', headers={'Accept-Encoding': 'gzip'}).headers['X-Cache'] == 'MISS'
+    assert client.get('/api/history?limit=5').headers['X-Cache'] == 'HIT'
+
+def test_archive_stats_are_cached_until_the_archive_changes(client, db):
+    pytest.importorskip('pyarrow')
+    import archive
+    with db.engine.begin() as conn:
+        synthetic.generate_history(conn, 500, artists=20, start=datetime(2024, 1, 25))
+    try:
+        for endpoint in ('/api/listening-stats?source=archive', '/api/chart-stats?source=archive'):
+            assert client.get(endpoint).headers['X-Cache'] == 'MISS'
+            assert client.get(endpoint).headers['X-Cache'] == 'HIT'
+        expected = client.get('/api/listening-stats?source=archive').get_json()
+
+        assert archive.export(db.engine, current_month='2024-03') > 0
+        response = client.get('/api/listening-stats?source=archive')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.get_json() == expected
+        assert client.get('/api/chart-stats?source=archive').headers['X-Cache'] == 'MISS'
+
+        archive.export(db.engine, force=True, current_month='2024-03')
+        assert client.get('/api/listening-stats?source=archive').headers['X-Cache'] == 'MISS'
+    finally:
+        shutil.rmtree(archive.ARCHIVE_DIR, ignore_errors=True)
@@ -0,0 +1,84 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import rollups
+import tracker
+
+ROLLUP_TABLES = ('hourly_rollups', 'artist_rollups', 'track_rollups', 'total_rollups')
+
+def spotify_track(number):
+    artists = [{'id': f'artist{number % 4}', 'name': f'Artist {number % 4}'}]
+    if number % 3 == 0:
+        artists.append({'id': 'artist9', 'name': 'Featured'})
+    return {'id': f'track{number}', 'name': f'Track {number}', 'duration_ms': 200000, 'uri': f'spotify:track:{number}',
+            'artists': artists, 'album': {'id': f'album{number % 2}', 'name': f'Album {number % 2}', 'images': []}}
+
+def record_plays(count, open_plays=1):
+    """Record plays like the tracker does: each is rolled up when it is closed;
+    the last `open_plays` are still playing"""
+    rng = random.Random(1)
+    moment = datetime.now() - timedelta(minutes=4 * count)
+    for index in range(count):
+        moment += timedelta(minutes=4)
+        track = spotify_track(rng.randrange(10))
+        play_id = tracker.insert_play({
+            'track_name': track['name'], 'artist_name': ', '.join(a['name'] for a in track['artists']),
+            'album_name': track['album']['name'], 'device_name': rng.choice(['Phone', 'Laptop', None]),
+            'track_duration_ms': track['duration_ms'], 'start_time': moment, 'played_duration_ms': 0
+        }, track)
+        if index < count - open_plays:
+            played = rng.randrange(200000)
+            tracker.update_play(play_id, {'end_time': moment + timedelta(milliseconds=played),
+                                          'played_duration_ms': played, 'is_completed': played >= 180000})
+        else:
+            tracker.update_play(play_id, {'played_duration_ms': 30000})
+
+def rollup_rows(conn):
+    return {table: sorted(map(tuple, conn.execute(text(f'SELECT * FROM {table}')))) for table in ROLLUP_TABLES}
+
+def test_incremental_rollups_match_a_rebuild(db):
+    record_plays(60)
+
+    with db.engine.begin() as conn:
+        incremental = rollup_rows(conn)
+        assert incremental['total_rollups'][0][1] == 59
+        rollups.rebuild(conn)
+        assert rollup_rows(conn) == incremental
+        assert conn.execute(text(f'SELECT count(*) FROM song_plays WHERE {rollups.PENDING}')).scalar() == 1
+
+def test_totals_add_the_plays_not_rolled_up_yet(db):
+    record_plays(25, open_plays=2)
+
+    session = db.Session()
+    try:
+        expected = session.execute(text(
+            'SELECT count(*), sum(played_duration_ms), sum(is_completed) FROM song_plays')).one()
+        totals = rollups.totals(session)
+        assert (totals['plays'], totals['listened_ms'], totals['completed']) == tuple(expected)
+        today = datetime.now().strftime('%Y-%m-%d')
+        expected_today = session.execute(text(
+            'SELECT count(*), coalesce(sum(played_duration_ms), 0) FROM song_plays WHERE local_date = :day'),
+            {'day': today}).one()
+        today_totals = rollups.totals(session, today)
+        assert (today_totals['plays'], today_totals['listened_ms']) == tuple(expected_today)
+    finally:
+        session.close()
+
+def test_chart_stats_match_the_raw_plays(db):
+    record_plays(40, open_plays=1)
+
+    session = db.Session()
+    try:
+        stats = rollups.chart_stats(session, '2000-01-01', top=100)
+        raw_hours = dict(session.execute(text('SELECT local_hour, count(*) FROM song_plays GROUP BY local_hour')).all())
+        assert stats['hourly'] == [raw_hours.get(hour, 0) for hour in range(24)]
+        assert stats['daily'] == dict(session.execute(text(
+            'SELECT local_date, count(*) FROM song_plays GROUP BY local_date')).all())
+        raw_artists = dict(session.execute(text(
+            'SELECT artists.name, count(*) FROM play_artists JOIN artists ON artists.id = play_artists.artist_id '
+            'GROUP BY artists.name')).all())
+        assert dict(stats['top_artists']) == raw_artists
+    finally:
+        session.close()
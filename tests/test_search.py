@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import search
+from tracker import insert_play, update_play
+
+def play(number, name, artist='Artist', album='Album', closed=True, track_id=None):
+    track = {'id': track_id or f'track{number}', 'name': name, 'uri': f'spotify:track:{number}', 'duration_ms': 200000,
+             'artists': [{'id': f'artist-{artist}', 'name': artist}],
+             'album': {'id': f'album-{album}', 'name': album, 'images': []}}
+    start = datetime(2024, 3, 1) + timedelta(minutes=4 * number)
+    play_id = insert_play({'track_name': name, 'artist_name': artist, 'album_name': album, 'start_time': start},
+                          track)
+    if closed:
+        update_play(play_id, {'end_time': start + timedelta(minutes=3), 'played_duration_ms': 180000})
+
+def test_exact_matches_are_found_beyond_the_recent_candidates(db, monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_CANDIDATES', 5)
+    play(0, 'Lovely', artist='Lover Band')
+    play(1, 'Lover', album='Lovers')
+    for number in range(2, 30):
+        play(number, f'Lovers Rock {number}')
+
+    session = db.Session()
+    try:
+        results = [result['track_name'] for result in search.search(session, 'lover')]
+        assert results[0] == 'Lover'
+        assert [result['track_name'] for result in search.search(session, 'lover band')] == ['Lovely']
+        # A single letter ranks the most recently added matches only
+        assert {result['track_name'] for result in search.search(session, 'l')} == \
+            {f'Lovers Rock {number}' for number in range(25, 30)}
+    finally:
+        session.close()
+
+def test_plays_include_those_not_rolled_up_yet(db):
+    for number in range(3):
+        play(number, 'Lover', track_id='lover', closed=number < 2)
+    play(3, 'Lovers Rock', closed=False)
+
+    session = db.Session()
+    try:
+        assert {result['track_id']: result['plays'] for result in search.search(session, 'lover')} == \
+            {'lover': 3, 'track3': 1}
+    finally:
+        session.close()
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from tracker import PlayTracker
+
+START = pytz.utc.localize(datetime(2024, 5, 1, 12, 0))
+
+class RecordingWriter:
+    """Writer that keeps the plays in memory"""
+
+    def __init__(self):
+        self.plays = {}
+
+    def insert(self, fields, track=None):
+        play_id = len(self.plays) + 1
+        self.plays[play_id] = dict(fields)
+        return play_id
+
+    def update(self, play_id, fields):
+        self.plays[play_id].update(fields)
+        return True
+
+class VirtualClock:
+    def __init__(self):
+        self.seconds = 0
+
+    def monotonic(self):
+        return self.seconds
+
+    def wall(self):
+        return START + timedelta(seconds=self.seconds)
+
+def playback(progress_s, is_playing=True, track_id='track-1', duration_s=600):
+    return {
+        'is_playing': is_playing,
+        'progress_ms': int(progress_s * 1000),
+        'device': {'name': 'Phone', 'type': 'Smartphone'},
+        'item': {'id': track_id, 'name': track_id, 'uri': f'spotify:track:{track_id}',
+                 'duration_ms': duration_s * 1000, 'artists': [{'name': 'Artist'}],
+                 'album': {'name': 'Album', 'images': []}}
+    }
+
+def make_tracker():
+    clock = VirtualClock()
+    writer = RecordingWriter()
+    tracker = PlayTracker(writer=writer, clock=clock.monotonic, wall_clock=clock.wall)
+    return tracker, writer, clock
+
+def listened_s(play):
+    return play['played_duration_ms'] / 1000
+
+def test_fresh_track_is_back_dated_by_its_progress():
+    tracker, writer, clock = make_tracker()
+    tracker.handle_playback(None)
+    clock.seconds = 10
+    tracker.handle_playback(playback(4))
+    assert writer.plays[1]['start_time'] == START + timedelta(seconds=6)
+
+def test_back_dating_is_capped_by_the_poll_gap():
+    tracker, writer, clock = make_tracker()
+    tracker.handle_playback(None)
+    clock.seconds = 5
+    tracker.handle_playback(playback(90))
+    assert writer.plays[1]['start_time'] == START
+
+def test_pause_then_resume_counts_only_the_time_played():
+    tracker, writer, clock = make_tracker()
+    tracker.handle_playback(playback(0))
+    clock.seconds = 100
+    tracker.handle_playback(playback(100))
+    # Paused at 100s for five minutes, polled slowly while idle
+    for clock.seconds in range(110, 400, 120):
+        tracker.handle_playback(playback(100, is_playing=False))
+    # Resumed at 400s; the next poll, two minutes after the last idle one,
+    # sees the song 10s further on
+    clock.seconds = 470 + 10
+    tracker.handle_playback(playback(110))
+    clock.seconds = 580
+    tracker.handle_playback(playback(210))
+    tracker.handle_playback(None)
+
+    first, resumed = writer.plays[1], writer.plays[2]
+    assert listened_s(first) == 100
+    assert resumed['start_time'] == START + timedelta(seconds=470)
+    assert listened_s(resumed) == 110
+    assert listened_s(first) + listened_s(resumed) == 210
+
+def test_resume_after_seeking_back_is_not_back_dated():
+    tracker, writer, clock = make_tracker()
+    tracker.handle_playback(playback(0))
+    clock.seconds = 100
+    tracker.handle_playback(playback(100, is_playing=False))
+    clock.seconds = 160
+    tracker.handle_playback(playback(30))
+    assert writer.plays[2]['start_time'] == START + timedelta(seconds=160)
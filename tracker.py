@@ -1,33 +1,35 @@
 import os
+import sys
+import signal
 import time
 import logging
-from datetime import datetime
-import pytz
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyOAuth
-from models import SongPlay, Session
+from models import SongPlay, Session, LOCAL_TZ, add_play
+from rollups import roll_up_play
+from scheduler import PollScheduler
+from spotify_client import create_spotify
+from notify import Publisher, playback_snapshot
 
 load_dotenv()
 
-# Configure logging with Berlin timezone
+# Configure logging with the configured timezone
 # Get log level from environment variable, default to ERROR
 log_level_str = os.getenv('LOG_LEVEL', 'ERROR').upper()
 log_level = getattr(logging, log_level_str, logging.ERROR)
 
-# Create a custom formatter that uses Berlin timezone
-class BerlinTimeFormatter(logging.Formatter):
+# Create a custom formatter that uses the configured timezone
+class LocalTimeFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
-        # Convert to Berlin timezone
-        berlin_tz = pytz.timezone('Europe/Berlin')
-        dt = datetime.fromtimestamp(record.created, berlin_tz)
+        # Convert to the configured timezone
+        dt = datetime.fromtimestamp(record.created, LOCAL_TZ)
         if datefmt:
             return dt.strftime(datefmt)
         else:
             return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 # Configure logging with custom formatter
-formatter = BerlinTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 # Create handlers
 file_handler = logging.FileHandler('output.log')
@@ -43,15 +45,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger('tracker')
 
-# Initialize Spotify client with configurable timeout
-spotify_timeout = int(os.getenv('SPOTIFY_TIMEOUT', 30))  # Default 30 seconds
-sp = Spotify(auth_manager=SpotifyOAuth(
-    client_id=os.getenv('SPOTIPY_CLIENT_ID'),
-    client_secret=os.getenv('SPOTIPY_CLIENT_SECRET'),
-    redirect_uri=os.getenv('SPOTIPY_REDIRECT_URI'),
-    scope='user-read-playback-state user-read-currently-playing user-modify-playback-state'
-), requests_timeout=spotify_timeout)
-
 def get_album_cover_url(track):
     """Get album cover URL from track data"""
     try:
@@ -63,190 +56,268 @@ def get_album_cover_url(track):
         logger.error(f"Error getting album cover: {e}")
     return None
 
+# How often (in seconds) the progress of the song that is currently playing
+# is written back to the database. State transitions (start, skip, pause/stop)
+# are always written immediately; this only bounds how much listening time can
+# be lost if the tracker crashes mid-song.
+CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', 30))  # Default 30 seconds
+
+def insert_play(fields, track=None):
+    """Insert a new play (and the catalog entries of its track) and return its
+    id, or None if the write failed"""
+    session = None
+    try:
+        session = Session()
+        play = add_play(session, fields, track)
+        session.commit()
+        return play.id
+    except Exception as db_error:
+        logger.error(f"Database error: {db_error}")
+        if session:
+            session.rollback()
+        return None
+    finally:
+        if session:
+            session.close()
+
+def update_play(play_id, fields):
+    """Write the given fields of an existing play; closing a play also adds it
+    to the rollups"""
+    session = None
+    try:
+        session = Session()
+        session.query(SongPlay).filter_by(id=play_id).update(fields)
+        if 'end_time' in fields:
+            # The play is closed, count it in the listening stats
+            roll_up_play(session, play_id)
+        session.commit()
+        return True
+    except Exception as db_error:
+        logger.error(f"Database error updating play {play_id}: {db_error}")
+        if session:
+            session.rollback()
+        return False
+    finally:
+        if session:
+            session.close()
+
+class DatabaseWriter:
+    """Writes plays to the database immediately, one transaction per write,
+    and tells the web app about new and closed plays"""
+
+    def __init__(self, publisher=None):
+        self.publisher = publisher or Publisher()
+
+    def insert(self, fields, track=None):
+        play_id = insert_play(fields, track)
+        if play_id is not None:
+            self.publisher.publish({'event': 'plays', 'inserted': [play_id], 'updated': []})
+        return play_id
+
+    def update(self, play_id, fields):
+        updated = update_play(play_id, fields)
+        # Progress checkpoints are not worth a notification, closing a play is
+        if updated and 'end_time' in fields:
+            self.publisher.publish({'event': 'plays', 'inserted': [], 'updated': [play_id]})
+        return updated
+
+class OpenPlay:
+    """In-memory state of the song that is currently playing"""
+
+    def __init__(self, play_id, track_id, track_name, track_duration_ms, start_time, now):
+        self.play_id = play_id
+        self.track_id = track_id
+        self.track_name = track_name
+        self.track_duration_ms = track_duration_ms
+        self.start_time = start_time
+        self.played_duration_ms = 0
+        self.last_checkpoint = now
+        self.dirty = False
+        # Wall-clock time and playback position of the last poll that saw
+        # this song playing, used to place pauses between two polls
+        self.last_seen = start_time
+        self.last_progress_ms = None
+
+class PlayTracker:
+    """Tracks the open play in memory and writes it back to the database
+    only on state transitions and every `checkpoint_interval` seconds"""
+
+    def __init__(self, writer=None, user_id=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 clock=time.monotonic, wall_clock=None):
+        self.writer = writer or DatabaseWriter()
+        self.user_id = user_id
+        self.checkpoint_interval = checkpoint_interval
+        self.clock = clock
+        # Returns the current local time; replaceable to run on a virtual clock
+        self.wall_clock = wall_clock or (lambda: datetime.now(LOCAL_TZ))
+        self.current = None
+        self.last_poll = None
+        # Track and position of the song seen paused, so that resuming it is
+        # not mistaken for a song that played from the start
+        self.paused = None
+        self.writes = 0
+
+    def handle_playback(self, playback):
+        """Update the in-memory state from a `current_playback()` response"""
+        now = self.wall_clock()
+        last_poll, self.last_poll = self.last_poll, now
+
+        if playback and playback.get('item') and playback.get('is_playing'):
+            track = playback['item']
+            progress_ms = playback.get('progress_ms') or 0
+            if self.current is None or track['id'] != self.current.track_id:
+                # Polls can be several seconds apart, so the song actually
+                # started `progress_ms` ago (or, when a paused song resumes,
+                # as long ago as it moved on from the paused position) - but
+                # no earlier than the last poll
+                played_ms = progress_ms
+                if self.current is None and self.paused and self.paused[0] == track['id']:
+                    played_ms = max(0, progress_ms - self.paused[1])
+                changed_at = now
+                if last_poll is not None:
+                    since_last_poll_ms = (now - last_poll).total_seconds() * 1000
+                    changed_at = now - timedelta(milliseconds=min(played_ms, since_last_poll_ms))
+                if self.current is not None:
+                    self.close("⏭️ Song skipped", changed_at)
+                self.start(playback, changed_at)
+                self.current.last_seen = now
+                self.current.last_progress_ms = progress_ms
+            else:
+                self.progress(now, progress_ms)
+            self.paused = None
+            return
+
+        item = playback.get('item') if playback else None
+        self.paused = (item['id'], playback.get('progress_ms') or 0) if item else None
+        if self.current is not None:
+            play = self.current
+            end_time = now
+            if item and item['id'] == play.track_id and play.last_progress_ms is not None:
+                # Paused: the song played on from where the last poll saw it
+                # until the position it is paused at now
+                played_since_ms = max(0, (playback.get('progress_ms') or 0) - play.last_progress_ms)
+                end_time = min(now, play.last_seen + timedelta(milliseconds=played_since_ms))
+            self.close("⏸️ Song stopped/paused", end_time)
+
+    def start(self, playback, start_time):
+        """Insert a row for the song that just started playing"""
+        track = playback['item']
+        album_cover_url = get_album_cover_url(track)
+        artist_name = ', '.join([a['name'] for a in track['artists']])
+
+        play_id = self.writer.insert({
+            'user_id': self.user_id,
+            'track_name': track['name'],
+            'artist_name': artist_name,
+            'album_name': track['album']['name'],
+            'device_name': playback['device']['name'],
+            'device_type': playback['device']['type'],
+            'album_cover_url': album_cover_url,
+            'track_uri': track.get('uri'),
+            'track_duration_ms': track.get('duration_ms', 0),
+            'start_time': start_time,
+            'played_duration_ms': 0
+        }, track)
+        self.writes += 1
+
+        # Remember the track even if the insert failed so that we don't retry
+        # the insert on every poll; progress is simply not recorded for it.
+        self.current = OpenPlay(play_id, track['id'], track['name'],
+                                track.get('duration_ms', 0), start_time, self.clock())
+        if play_id is not None:
+            cover_status = "with album cover" if album_cover_url else "without album cover"
+            logger.info(f"🎵 New song started: {track['name']} by {artist_name} ({cover_status})")
+
+    def progress(self, now, progress_ms):
+        """Advance the listening duration of the open play in memory"""
+        play = self.current
+        elapsed_ms = (now - play.start_time).total_seconds() * 1000
+        play.played_duration_ms = min(elapsed_ms, play.track_duration_ms or elapsed_ms)
+        play.last_seen = now
+        play.last_progress_ms = progress_ms
+        play.dirty = True
+
+        if self.clock() - play.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write the in-memory progress of the open play to the database"""
+        play = self.current
+        if play is None or play.play_id is None or not play.dirty:
+            return
+        if self.writer.update(play.play_id, {'played_duration_ms': play.played_duration_ms}):
+            play.dirty = False
+        play.last_checkpoint = self.clock()
+        self.writes += 1
+
+    def close(self, reason, end_time):
+        """Write the final state of the open play and forget it"""
+        play = self.current
+        self.current = None
+        if play.play_id is None:
+            return
+
+        end_time = max(end_time, play.start_time)
+        total_listened = (end_time - play.start_time).total_seconds() * 1000
+        played_duration_ms = min(total_listened, play.track_duration_ms or total_listened)
+
+        # Mark as completed if listened to 90% or more of the song
+        is_completed = bool(play.track_duration_ms and played_duration_ms >= (play.track_duration_ms * 0.9))
+
+        if self.writer.update(play.play_id, {
+            'end_time': end_time,
+            'played_duration_ms': played_duration_ms,
+            'is_completed': is_completed
+        }):
+            logger.info(f"{reason}: {play.track_name} - Listened for {played_duration_ms/1000:.1f}s")
+        self.writes += 1
+
 def track_loop():
-    last_track_id = None
-    current_session = None
+    sp = create_spotify()
+    publisher = Publisher()
+    tracker = PlayTracker(writer=DatabaseWriter(publisher))
+    scheduler = PollScheduler()
+    last_report = time.monotonic()
     
     # Get port from environment variable, default to 5000
     port = int(os.getenv('PORT', 5000))
     logger.info("🎵 Starting Spotify tracking loop...")
     logger.info("📊 Songs will be saved to the database automatically")
     logger.info("⏱️  Listening duration will be tracked")
+    logger.info(f"💾 Progress is checkpointed every {tracker.checkpoint_interval}s")
     logger.info("🖼️  Album covers will be fetched and stored")
     logger.info(f"🌐 Open http://localhost:{port} in your browser to view the data")
     logger.info("=" * 50)
     
-    while True:
-        try:
-            playback = sp.current_playback()
-            
-            # Handle song start
-            if playback and playback.get('item') and playback.get('is_playing'):
-                track = playback['item']
-                track_id = track['id']
-                current_progress = playback.get('progress_ms', 0)
-                track_duration = track.get('duration_ms', 0)
-
-                if track_id != last_track_id:
-                    # If there was a previous song playing, mark it as stopped (song was skipped)
-                    if last_track_id and current_session:
-                        try:
-                            session = Session()
-                            play = session.query(SongPlay).filter_by(id=current_session).first()
-                            if play:
-                                # Get local timezone
-                                local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-                                local_time = datetime.now(local_tz)
-                                play.end_time = local_time
-                                
-                                # Calculate final listening duration
-                                if play.start_time:
-                                    # Ensure start_time is timezone-aware
-                                    if play.start_time.tzinfo is None:
-                                        play.start_time = local_tz.localize(play.start_time)
-                                    
-                                    total_listened = (play.end_time - play.start_time).total_seconds() * 1000
-                                    play.played_duration_ms = min(total_listened, play.track_duration_ms or total_listened)
-                                    
-                                    # Mark as completed if listened to 90% or more of the song
-                                    if play.track_duration_ms and play.played_duration_ms >= (play.track_duration_ms * 0.9):
-                                        play.is_completed = True
-                                
-                                session.commit()
-                                logger.info(f"⏭️ Song skipped: {play.track_name} - Listened for {play.played_duration_ms/1000:.1f}s")
-                        except Exception as db_error:
-                            logger.error(f"Database error stopping skipped song: {db_error}")
-                            if session:
-                                session.rollback()
-                        finally:
-                            if session:
-                                session.close()
-                    
-                    # Reset session for new song
-                    current_session = None
-                    
-                    # New song started
-                    last_track_id = track_id
-                    
-                    # Get album cover URL
-                    album_cover_url = get_album_cover_url(track)
-
-                    session = None
-                    try:
-                        session = Session()
-                        # Get local timezone
-                        local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-                        local_time = datetime.now(local_tz)
-                        
-                        play = SongPlay(
-                            track_name=track['name'],
-                            artist_name=', '.join([a['name'] for a in track['artists']]),
-                            album_name=track['album']['name'],
-                            device_name=playback['device']['name'],
-                            device_type=playback['device']['type'],
-                            album_cover_url=album_cover_url,
-                            track_uri=track.get('uri'),
-                            track_duration_ms=track_duration,
-                            start_time=local_time,
-                            played_duration_ms=0
-                        )
-                        session.add(play)
-                        session.commit()
-                        current_session = play.id
-                        
-                        cover_status = "with album cover" if album_cover_url else "without album cover"
-                        logger.info(f"🎵 New song started: {track['name']} by {', '.join([a['name'] for a in track['artists']])} ({cover_status})")
-                    except Exception as db_error:
-                        logger.error(f"Database error: {db_error}")
-                        if session:
-                            session.rollback()
-                    finally:
-                        if session:
-                            session.close()
-                else:
-                    # Same song, update progress
-                    if current_session:
-                        try:
-                            session = Session()
-                            play = session.query(SongPlay).filter_by(id=current_session).first()
-                            if play:
-                                # Calculate how much time has passed since last update
-                                local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-                                current_time = datetime.now(local_tz)
-                                
-                                # Ensure start_time is timezone-aware
-                                if play.start_time and play.start_time.tzinfo is None:
-                                    play.start_time = local_tz.localize(play.start_time)
-                                
-                                time_diff = (current_time - play.start_time).total_seconds() * 1000
-                                play.played_duration_ms = min(time_diff, track_duration)
-                                session.commit()
-                        except Exception as db_error:
-                            logger.error(f"Database error updating progress: {db_error}")
-                            if session:
-                                session.rollback()
-                        finally:
-                            if session:
-                                session.close()
-            
-            # Handle song stop/pause or skip (when no playback or not playing)
-            elif last_track_id and (not playback or not playback.get('is_playing')):
-                if current_session:
-                    try:
-                        session = Session()
-                        play = session.query(SongPlay).filter_by(id=current_session).first()
-                        if play:
-                            # Get local timezone
-                            local_tz = pytz.timezone('Europe/Berlin')  # Adjust to your timezone
-                            local_time = datetime.now(local_tz)
-                            play.end_time = local_time
-                            
-                            # Calculate final listening duration
-                            if play.start_time:
-                                # Ensure start_time is timezone-aware
-                                if play.start_time.tzinfo is None:
-                                    play.start_time = local_tz.localize(play.start_time)
-                                
-                                total_listened = (play.end_time - play.start_time).total_seconds() * 1000
-                                play.played_duration_ms = min(total_listened, play.track_duration_ms or total_listened)
-                                
-                                # Mark as completed if listened to 90% or more of the song
-                                if play.track_duration_ms and play.played_duration_ms >= (play.track_duration_ms * 0.9):
-                                    play.is_completed = True
-                            
-                            session.commit()
-                            logger.info(f"⏸️ Song stopped/paused: {play.track_name} - Listened for {play.played_duration_ms/1000:.1f}s")
-                    except Exception as db_error:
-                        logger.error(f"Database error stopping song: {db_error}")
-                        if session:
-                            session.rollback()
-                    finally:
-                        if session:
-                            session.close()
-                
-                last_track_id = None
-                current_session = None
-
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"❌ Error in track loop: {error_msg}")
-            
-            # Handle specific Spotify API errors
-            if "Read timed out" in error_msg or "timeout" in error_msg.lower():
-                logger.warning("⏰ Spotify API timeout - waiting longer before retry")
-                time.sleep(10)  # Wait longer on timeout
-                continue
-            elif "429" in error_msg or "rate limit" in error_msg.lower():
-                logger.warning("🚫 Spotify API rate limit - waiting before retry")
-                time.sleep(30)  # Wait longer on rate limit
-                continue
-            elif "401" in error_msg or "unauthorized" in error_msg.lower():
-                logger.error("🔐 Spotify authentication error - check your credentials")
-                time.sleep(60)  # Wait longer on auth error
-                continue
-
-        time.sleep(5)
+    try:
+        while True:
+            try:
+                playback = sp.current_playback()
+                # Share the result with the web app so it doesn't poll Spotify itself
+                publisher.publish(playback_snapshot(playback))
+                tracker.handle_playback(playback)
+                delay = scheduler.after_playback(playback)
+            except Exception as e:
+                logger.error(f"❌ Error in track loop: {e}")
+                delay = scheduler.after_error(e)
+
+            # Report how many API calls the adaptive schedule saved every hour
+            if time.monotonic() - last_report >= 3600:
+                last_report = time.monotonic()
+                stats = scheduler.stats()
+                logger.info(f"📉 {stats['calls']} API calls vs. {stats['baseline_calls']} with a fixed 5s loop "
+                            f"({stats['saved_calls']} saved, {stats['saved_percentage']}%)")
+
+            time.sleep(delay)
+    finally:
+        # Don't lose the progress made since the last checkpoint on shutdown
+        tracker.checkpoint()
+        stats = scheduler.stats()
+        logger.info(f"📉 Saved {stats['saved_calls']} of {stats['baseline_calls']} API calls ({stats['saved_percentage']}%)")
 
 if __name__ == "__main__":
+    # Turn SIGTERM (sent by run.py on shutdown) into a normal exit so the
+    # final checkpoint in track_loop gets written
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
     logger.info("🚀 Starting Spotify Tracker...")
     track_loop()